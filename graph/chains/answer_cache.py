@@ -0,0 +1,187 @@
+"""
+Caché de respuestas completas por tema.
+
+Una consulta completa (embedding, Pinecone, reranking, generación y calificadores)
+tarda decenas de segundos; cuando la misma pregunta se repite en la misma página
+de tema, la respuesta (texto, citas y fuentes) se sirve desde aquí en milisegundos.
+
+La clave combina el tema, la pregunta normalizada, la versión del snapshot del
+namespace del tema y la versión del prompt de generación, de modo que al
+sincronizar el corpus o cambiar el prompt las entradas anteriores dejan de
+usarse y se van descartando por la poda (LRU o LFU). Si el namespace no tiene
+snapshot local, la invalidación queda a cargo del TTL.
+
+Un LRU en memoria va delante del almacén SQLite (ANSWER_CACHE_PATH vacío lo desactiva).
+
+Las páginas guardan con `put_verified`: la respuesta se califica en un hilo en
+segundo plano y solo se guarda si resulta fundamentada y útil, sin retrasar la
+respuesta que ve el usuario.
+"""
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.documents import Document
+
+from graph.chains.cache import LRUCache, SQLiteStore
+from graph.chains.embedding_cache import normalize_query
+from graph.chains.prompts import prompt_version
+from graph.chains.vectorstores import snapshot_version
+
+ANSWER_CACHE_PATH = os.environ.get("ANSWER_CACHE_PATH", os.path.join(".cache", "answers.sqlite"))
+ANSWER_CACHE_MAX_BYTES = int(os.environ.get("ANSWER_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", str(7 * 24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+# Política de poda del almacén en disco: "lru" o "lfu"
+ANSWER_CACHE_POLICY = os.environ.get("ANSWER_CACHE_POLICY", "lfu")
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE", "true").lower() in ("1", "true", "yes")
+# Cada cuántas escrituras se poda el almacén en disco
+PRUNE_EVERY = 50
+
+# Hilos que califican las respuestas de las páginas antes de guardarlas
+_admission_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="answer-cache")
+
+
+def corpus_version(topic: str) -> str:
+    """
+    Versión del snapshot del namespace asociado a un tema ("-" si no hay snapshot).
+    """
+    # Importación diferida: retrieval crea los clientes de OpenAI y Pinecone al importarse
+    from graph.chains.retrieval import resolve_topic
+
+    config = resolve_topic(topic)
+    return f"{config.index_name}/{config.namespace}@{snapshot_version(config.index_name, config.namespace) or '-'}"
+
+
+def _source_reference(doc: Document) -> Dict[str, Any]:
+    metadata = {key: doc.metadata[key] for key in ("source", "page", "pages") if key in doc.metadata}
+    return {"page_content": doc.page_content, "metadata": metadata}
+
+
+class AnswerCache:
+    """
+    Caché de dos niveles de respuestas completas (texto, citas y fuentes).
+    """
+
+    def __init__(self, path: Optional[str] = ANSWER_CACHE_PATH, max_bytes: int = ANSWER_CACHE_MAX_BYTES,
+                 ttl: Optional[float] = ANSWER_CACHE_TTL, max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 policy: str = ANSWER_CACHE_POLICY, enabled: bool = ANSWER_CACHE_ENABLED):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.policy = policy
+        self.enabled = enabled
+        self.memory = LRUCache(max_bytes, ttl=ttl)
+        self.store = None
+        self.disk_hits = 0
+        self.misses = 0
+        self._writes = 0
+        if path and enabled:
+            try:
+                self.store = SQLiteStore(path, table="answers")
+            except Exception as e:
+                print(f"AnswerCache: No se pudo abrir la caché en disco {path}: {str(e)}")
+                self.store = None
+
+    def key(self, topic: str, question: str) -> str:
+        raw = "\x00".join([topic, normalize_query(question), corpus_version(topic), prompt_version()])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, topic: str, question: str) -> Optional[Dict[str, Any]]:
+        """
+        Devuelve {"text", "citations", "documents", "cached_at"} si la consulta está en caché, o None.
+        """
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        key = self.key(topic, question)
+        blob = self.memory.get(key)
+        if blob is None and self.store is not None:
+            blob = self.store.get(key, ttl=self.ttl)
+            if blob is not None:
+                self.disk_hits += 1
+                blob = bytes(blob)
+                self.memory.put(key, blob)
+        if blob is None:
+            self.misses += 1
+            return None
+        entry = json.loads(blob)
+        print(f"AnswerCache: Respuesta de {topic} servida desde caché en {(time.perf_counter() - start) * 1000:.1f} ms")
+        return {
+            "text": entry["text"],
+            "citations": entry["citations"],
+            "documents": [Document(page_content=source["page_content"], metadata=source["metadata"])
+                          for source in entry["sources"]],
+            "cached_at": entry["cached_at"],
+        }
+
+    def put(self, topic: str, question: str, text: str, citations: List[Dict[str, Any]],
+            documents: Sequence[Document]):
+        if not self.enabled or not text:
+            return
+        key = self.key(topic, question)
+        blob = json.dumps({
+            "text": text,
+            "citations": citations,
+            "sources": [_source_reference(doc) for doc in documents],
+            "cached_at": time.time(),
+        }, ensure_ascii=False, default=str).encode("utf-8")
+        self.memory.put(key, blob)
+        if self.store is None:
+            return
+        try:
+            self.store.put(key, blob, tag=topic)
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                self.store.prune(self.max_entries, policy=self.policy)
+        except Exception as e:
+            print(f"AnswerCache: Error al guardar en disco: {str(e)}")
+
+    def put_verified(self, topic: str, question: str, text: str, citations: List[Dict[str, Any]],
+                     documents: Sequence[Document]) -> Optional[Future]:
+        """
+        Guarda la respuesta en segundo plano si el calificador la da por fundamentada y útil.
+
+        Devuelve el Future del trabajo (None si la caché está desactivada).
+        """
+        if not self.enabled or not text:
+            return None
+        documents = list(documents)
+        return _admission_executor.submit(self._admit, topic, question, text, citations, documents)
+
+    def _admit(self, topic: str, question: str, text: str, citations: List[Dict[str, Any]],
+               documents: List[Document]) -> bool:
+        # Importación diferida: el calificador crea su cliente de OpenAI al importarse
+        from graph.chains.generation_grader import verified_useful
+
+        try:
+            if not verified_useful(question, documents, text):
+                print(f"AnswerCache: Respuesta de {topic} sin verificar, no se guarda")
+                return False
+        except Exception as e:
+            print(f"AnswerCache: Error al calificar la respuesta: {str(e)}")
+            return False
+        self.put(topic, question, text, citations, documents)
+        return True
+
+    def clear(self):
+        self.memory.clear()
+        if self.store is not None:
+            self.store.clear()
+
+    def stats(self) -> Dict[str, int]:
+        memory = self.memory.stats()
+        return {
+            "memory_hits": memory["hits"],
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_entries": memory["entries"],
+            "disk_entries": len(self.store) if self.store is not None else 0,
+        }
+
+
+# Caché compartida por los grafos de tema y las páginas
+answer_cache = AnswerCache()
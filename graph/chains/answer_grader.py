@@ -1,7 +1,8 @@
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
-from langchain_core.runnables import RunnableSequence
-from langchain_openai import ChatOpenAI
+from langchain_core.runnables import Runnable
+from graph.chains.clients import openai_clients
+from graph.chains.resilience import resilient_runnable
 import os
 from dotenv import load_dotenv
 
@@ -21,7 +22,7 @@ class GradeAnswer(BaseModel):
     )
 
 
-llm = ChatOpenAI(temperature=0, model="gpt-3.5-turbo", api_key=openai_api_key)
+llm = openai_clients.chat("answer_grader", model="gpt-3.5-turbo", temperature=0, max_retries=0)
 structured_llm_grader = llm.with_structured_output(GradeAnswer, method="function_calling")
 
 system = """You are a grader assessing whether an answer addresses / resolves a question \n 
@@ -33,4 +34,8 @@ answer_prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-answer_grader: RunnableSequence = answer_prompt | structured_llm_grader
+# Si el calificador no responde a tiempo (o su circuito está abierto) devuelve None:
+# la respuesta queda sin verificar, nunca se da por útil
+answer_grader: Runnable = resilient_runnable(
+    "graders", answer_prompt | structured_llm_grader, fallback=lambda inputs: None
+)
@@ -0,0 +1,180 @@
+"""
+Piezas de caché reutilizables: un LRU en memoria con presupuesto en bytes y TTL,
+y un almacén persistente clave-valor sobre SQLite.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+
+class LRUCache:
+    """
+    Caché LRU en memoria, segura entre hilos, limitada por bytes y opcionalmente por TTL.
+    """
+
+    def __init__(self, max_bytes: int, ttl: Optional[float] = None, sizeof: Callable[[Any], int] = len):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, stored_at = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value):
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic())
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def pop(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class SQLiteStore:
+    """
+    Almacén clave-valor persistente en SQLite.
+
+    Cada entrada guarda una etiqueta (`tag`) que permite invalidar en bloque, por
+    ejemplo todas las entradas de un modelo o de una versión de índice anterior,
+    y contadores de acceso para podar por LRU o LFU.
+    """
+
+    def __init__(self, path: str, table: str = "entries"):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, tag TEXT, value BLOB, "
+            "created REAL, accessed REAL, hits INTEGER DEFAULT 0)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str, ttl: Optional[float] = None) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, created FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            now = time.time()
+            if ttl is not None and now - created > ttl:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                f"UPDATE {self.table} SET accessed = ?, hits = hits + 1 WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            return value
+
+    def put(self, key: str, value: bytes, tag: str = ""):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, tag, value, created, accessed, hits) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                (key, tag, sqlite3.Binary(value), now, now),
+            )
+            self._conn.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def delete_tag_not(self, tag: str) -> int:
+        """
+        Elimina todas las entradas cuya etiqueta sea distinta de `tag`.
+        """
+        with self._lock:
+            cursor = self._conn.execute(f"DELETE FROM {self.table} WHERE tag != ?", (tag,))
+            self._conn.commit()
+            return cursor.rowcount
+
+    def prune(self, max_entries: int, policy: str = "lru") -> int:
+        """
+        Reduce el almacén a `max_entries` entradas, descartando por LRU o LFU.
+        """
+        order = "hits ASC, accessed ASC" if policy == "lfu" else "accessed ASC"
+        with self._lock:
+            count = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+            excess = count - max_entries
+            if excess <= 0:
+                return 0
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY {order} LIMIT ?)",
+                (excess,),
+            )
+            self._conn.commit()
+            return excess
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
@@ -0,0 +1,180 @@
+"""
+Extracción incremental de citas [n] y construcción de la sección "6. Citas".
+
+CitationStream consume el texto de la respuesta por fragmentos (tal como llega
+en streaming) con una pequeña máquina de estados, de modo que una cita partida
+entre dos fragmentos ("[1" + "2]") se reconoce igual. Cada índice se emite la
+primera vez que aparece. Mientras tanto registra dónde insertar la sección de
+citas, que se construye en una sola pasada al terminar.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+CITATIONS_HEADING = "6. Citas"
+ANALYSIS_HEADING = "5. ANÁLISIS"
+PARAGRAPH_BREAK = "\n\n"
+# Caracteres que se conservan entre fragmentos para detectar encabezados partidos
+CARRY = 16
+# Dígitos máximos de un índice de cita
+MAX_DIGITS = 4
+
+_TEXT, _OPEN, _DIGITS = range(3)
+
+
+def citation_record(doc: Document, citation_num: int) -> Dict[str, Any]:
+    """
+    Registro de cita para el documento `citation_num` (empezando en 1).
+    """
+    # Extraer un fragmento más significativo del documento
+    content = doc.page_content
+    excerpt = content[:200] + "..." if len(content) > 200 else content
+
+    # Obtener la fuente del documento
+    source = doc.metadata.get("source", f"Documento {citation_num}")
+
+    # Obtener la página del documento si está disponible
+    page = doc.metadata.get("page", None)
+    page_info = f" (Pág. {page})" if page and page != 0 else ""
+
+    # Verificar si la fuente es de Pinecone
+    if "pinecone_docs" in source:
+        # Formatear la fuente para que sea más clara
+        source = source.replace("pinecone_docs/", "Pinecone: ")
+
+    return {
+        "document_title": f"{source}{page_info}",
+        "cited_text": excerpt,
+        "document_index": citation_num - 1,
+        "page": page,
+    }
+
+
+def section_title(citation: Dict[str, Any]) -> str:
+    """
+    Nombre del archivo citado, sin prefijos de Pinecone ni página.
+    """
+    doc_title = citation["document_title"]
+    if "Pinecone: pinecone_docs/" in doc_title:
+        doc_title = doc_title.replace("Pinecone: pinecone_docs/", "")
+    elif "Pinecone: " in doc_title:
+        doc_title = doc_title.replace("Pinecone: ", "")
+    if " (Pág. " in doc_title:
+        doc_title = doc_title.split(" (Pág. ")[0]
+    return doc_title
+
+
+def citations_section(citations: List[Dict[str, Any]]) -> str:
+    lines = [f"   ○  6.{i+1}. {section_title(citation)}.\n" for i, citation in enumerate(citations)]
+    return f"{PARAGRAPH_BREAK}{CITATIONS_HEADING}{PARAGRAPH_BREAK}" + "".join(lines)
+
+
+class CitationStream:
+    """
+    Máquina de estados que extrae citas [n] de un texto recibido por fragmentos.
+    """
+
+    def __init__(self, documents: List[Document]):
+        self.documents = documents
+        self.citations: List[Dict[str, Any]] = []
+        self._seen = set()
+        self._parts: List[str] = []
+        self._state = _TEXT
+        self._digits = ""
+        self._offset = 0
+        self._carry = ""
+        self._has_citations_heading = False
+        self._has_conclusion = False
+        self._analysis_end: Optional[int] = None
+        self._last_break: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Tuple[int, Dict[str, Any]]]:
+        """
+        Procesa un fragmento y devuelve las citas nuevas como [(n, registro)].
+        """
+        if not chunk:
+            return []
+        self._parts.append(chunk)
+        self._scan_structure(chunk)
+        self._offset += len(chunk)
+        return self._scan_citations(chunk)
+
+    def _scan_citations(self, chunk: str) -> List[Tuple[int, Dict[str, Any]]]:
+        new = []
+        position = 0
+        length = len(chunk)
+        while position < length:
+            if self._state == _TEXT:
+                # Saltar directamente al siguiente corchete
+                position = chunk.find("[", position)
+                if position == -1:
+                    break
+                self._state = _OPEN
+                position += 1
+                continue
+            char = chunk[position]
+            position += 1
+            if char == "[":
+                self._state = _OPEN
+                self._digits = ""
+            elif char in "0123456789" and len(self._digits) < MAX_DIGITS:
+                self._state = _DIGITS
+                self._digits += char
+            elif char == "]" and self._state == _DIGITS:
+                citation = self._emit(int(self._digits))
+                if citation is not None:
+                    new.append(citation)
+                self._state = _TEXT
+                self._digits = ""
+            else:
+                self._state = _TEXT
+                self._digits = ""
+        return new
+
+    def _emit(self, citation_num: int) -> Optional[Tuple[int, Dict[str, Any]]]:
+        if citation_num in self._seen or not 0 < citation_num <= len(self.documents):
+            return None
+        self._seen.add(citation_num)
+        record = citation_record(self.documents[citation_num - 1], citation_num)
+        self.citations.append(record)
+        return citation_num, record
+
+    def _scan_structure(self, chunk: str):
+        """
+        Registra encabezados y saltos de párrafo (con solape para los que llegan partidos).
+        """
+        window = self._carry + chunk
+        base = self._offset - len(self._carry)
+        if not self._has_citations_heading and CITATIONS_HEADING in window:
+            self._has_citations_heading = True
+        if not self._has_conclusion and "CONCLUS" in window.upper():
+            self._has_conclusion = True
+        if self._analysis_end is None:
+            found = window.find(ANALYSIS_HEADING)
+            if found != -1:
+                self._analysis_end = base + found + len(ANALYSIS_HEADING)
+        found = window.rfind(PARAGRAPH_BREAK)
+        if found != -1:
+            self._last_break = base + found
+        self._carry = window[-CARRY:]
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def finish(self) -> str:
+        """
+        Devuelve la respuesta completa, con la sección "6. Citas" si el modelo no la incluyó.
+
+        La sección se inserta en el último salto de párrafo del análisis (o al
+        final si la respuesta no tiene esa estructura).
+        """
+        text = self.text
+        if self._has_citations_heading or not self.citations:
+            return text
+        section = citations_section(self.citations)
+        if (self._has_conclusion and self._analysis_end is not None
+                and self._last_break is not None and self._last_break >= self._analysis_end):
+            return text[:self._last_break] + section + text[self._last_break:]
+        return text + section
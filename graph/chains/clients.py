@@ -0,0 +1,235 @@
+"""
+Fábrica de clientes de OpenAI compartida por todo el proceso.
+
+Todas las etapas (embeddings, reranking, generación, router y calificadores)
+usan el mismo pool HTTP keep-alive, síncrono y asíncrono, con los mismos
+tiempos de espera y la misma política de reintentos, de modo que un pool ya
+calentado sirve a todas y no se repiten handshakes TLS.
+
+Cada cliente lleva una etiqueta de etapa (`stage`). Los hooks del pool la
+quitan de la solicitud antes de enviarla y registran, por etapa, el número de
+llamadas, los errores HTTP y el tiempo hasta la respuesta (en streaming, hasta
+las cabeceras).
+
+HTTP/2 es opcional (OPENAI_HTTP2=true) y requiere el paquete `h2`.
+"""
+
+import asyncio
+import importlib.util
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, OpenAI
+
+# Cargar variables de entorno
+load_dotenv()
+
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", "2"))
+# Tamaño del pool y tiempo que se conserva una conexión ociosa
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "64"))
+OPENAI_MAX_KEEPALIVE = int(os.environ.get("OPENAI_MAX_KEEPALIVE", "32"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "90"))
+OPENAI_HTTP2 = os.environ.get("OPENAI_HTTP2", "false").lower() == "true"
+# Cabecera interna con la etapa; no llega a enviarse
+STAGE_HEADER = "x-pipeline-stage"
+DEFAULT_STAGE = "default"
+
+
+class StageMetrics:
+    """
+    Llamadas, errores y latencia de las solicitudes a OpenAI por etapa.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, float]] = {}
+
+    def record(self, stage: str, elapsed_ms: float, status_code: int):
+        with self._lock:
+            entry = self._stages.setdefault(stage, {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+            entry["calls"] += 1
+            entry["errors"] += status_code >= 400
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                stage: {**entry, "avg_ms": entry["total_ms"] / entry["calls"] if entry["calls"] else 0.0}
+                for stage, entry in self._stages.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+
+def _take_stage(request: httpx.Request):
+    request.extensions["pipeline_stage"] = request.headers.pop(STAGE_HEADER, DEFAULT_STAGE)
+    request.extensions["pipeline_start"] = time.perf_counter()
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+class OpenAIClients:
+    """
+    Pools HTTP y clientes de OpenAI (SDK y LangChain) reutilizables entre etapas.
+    """
+
+    def __init__(self, api_key: Optional[str] = OPENAI_API_KEY, timeout: float = OPENAI_TIMEOUT,
+                 connect_timeout: float = OPENAI_CONNECT_TIMEOUT, max_retries: int = OPENAI_MAX_RETRIES,
+                 http2: bool = OPENAI_HTTP2):
+        self.api_key = api_key
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.http2 = http2 and http2_available()
+        if http2 and not self.http2:
+            print("OpenAIClients: OPENAI_HTTP2 activo pero falta el paquete 'h2'; se usa HTTP/1.1")
+        self.metrics = StageMetrics()
+        self._lock = threading.RLock()
+        self._http_client: Optional[httpx.Client] = None
+        self._async_http_client: Optional[httpx.AsyncClient] = None
+        self._client: Optional[OpenAI] = None
+        self._async_client: Optional[AsyncOpenAI] = None
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY)
+
+    def _record(self, response: httpx.Response):
+        request = response.request
+        start = request.extensions.get("pipeline_start")
+        if start is not None:
+            self.metrics.record(request.extensions.get("pipeline_stage", DEFAULT_STAGE),
+                                (time.perf_counter() - start) * 1000, response.status_code)
+
+    def http_client(self) -> httpx.Client:
+        """
+        Pool HTTP síncrono del proceso, creado en el primer uso.
+        """
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(
+                    timeout=self.timeout, limits=self._limits(), http2=self.http2,
+                    event_hooks={"request": [_take_stage], "response": [self._record]},
+                )
+            return self._http_client
+
+    def async_http_client(self) -> httpx.AsyncClient:
+        """
+        Pool HTTP asíncrono del proceso, creado en el primer uso.
+        """
+        async def take_stage(request: httpx.Request):
+            _take_stage(request)
+
+        async def record(response: httpx.Response):
+            self._record(response)
+
+        with self._lock:
+            if self._async_http_client is None:
+                self._async_http_client = httpx.AsyncClient(
+                    timeout=self.timeout, limits=self._limits(), http2=self.http2,
+                    event_hooks={"request": [take_stage], "response": [record]},
+                )
+            return self._async_http_client
+
+    def openai(self, stage: str = DEFAULT_STAGE, max_retries: Optional[int] = None) -> OpenAI:
+        """
+        Cliente síncrono del SDK de OpenAI etiquetado con la etapa.
+
+        `max_retries=0` deja los reintentos a cargo del llamador (ver graph/chains/resilience.py).
+        """
+        with self._lock:
+            if self._client is None:
+                self._client = OpenAI(api_key=self.api_key, http_client=self.http_client(),
+                                      timeout=self.timeout, max_retries=self.max_retries)
+        return self._client.with_options(default_headers={STAGE_HEADER: stage},
+                                         max_retries=self.max_retries if max_retries is None else max_retries)
+
+    def async_openai(self, stage: str = DEFAULT_STAGE, max_retries: Optional[int] = None) -> AsyncOpenAI:
+        """
+        Cliente asíncrono del SDK de OpenAI etiquetado con la etapa.
+        """
+        with self._lock:
+            if self._async_client is None:
+                self._async_client = AsyncOpenAI(api_key=self.api_key, http_client=self.async_http_client(),
+                                                 timeout=self.timeout, max_retries=self.max_retries)
+        return self._async_client.with_options(default_headers={STAGE_HEADER: stage},
+                                               max_retries=self.max_retries if max_retries is None else max_retries)
+
+    def chat(self, stage: str, model: str = "gpt-3.5-turbo", temperature: float = 0, **kwargs):
+        """
+        ChatOpenAI de LangChain sobre los pools compartidos, etiquetado con la etapa.
+        """
+        # Importación diferida: langchain_openai solo se carga si alguna etapa lo usa
+        from langchain_openai import ChatOpenAI
+
+        return ChatOpenAI(
+            model=model,
+            temperature=temperature,
+            api_key=self.api_key,
+            http_client=self.http_client(),
+            http_async_client=self.async_http_client(),
+            timeout=kwargs.pop("timeout", self.timeout),
+            max_retries=kwargs.pop("max_retries", self.max_retries),
+            default_headers={STAGE_HEADER: stage},
+            **kwargs,
+        )
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return self.metrics.stats()
+
+    def _detach(self):
+        with self._lock:
+            pools = (self._http_client, self._async_http_client)
+            self._http_client = None
+            self._async_http_client = None
+            self._client = None
+            self._async_client = None
+        return pools
+
+    def close(self):
+        """
+        Cierra los pools síncrono y asíncrono.
+
+        Si se llama con un event loop en marcha, el cierre del pool asíncrono se
+        programa como tarea de ese loop; desde código asíncrono es preferible
+        `await aclose()`, que espera a que termine.
+        """
+        http_client, async_http_client = self._detach()
+        if http_client is not None:
+            http_client.close()
+        if async_http_client is None:
+            return
+        try:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                asyncio.run(async_http_client.aclose())
+            else:
+                loop.create_task(async_http_client.aclose())
+        except Exception as e:
+            print(f"OpenAIClients: No se pudo cerrar el pool asíncrono: {str(e)}")
+
+    async def aclose(self):
+        """
+        Cierra los pools síncrono y asíncrono desde código asíncrono.
+        """
+        http_client, async_http_client = self._detach()
+        if http_client is not None:
+            http_client.close()
+        if async_http_client is not None:
+            await async_http_client.aclose()
+
+
+# Clientes compartidos por todas las cadenas
+openai_clients = OpenAIClients()
@@ -0,0 +1,217 @@
+"""
+Construcción del contexto de generación con presupuesto de tokens.
+
+A partir de los fragmentos ya ordenados por relevancia:
+1. descarta pasajes duplicados (texto idéntico tras normalizar espacios) y casi
+   duplicados (similitud de Jaccard entre shingles de palabras);
+2. fusiona páginas consecutivas de una misma fuente en un solo bloque, que ocupa
+   el lugar del fragmento más relevante;
+3. empaqueta los bloques en orden de relevancia hasta el presupuesto de tokens del
+   modelo; el primero que no cabe entero se recorta a su ventana más relevante y
+   los siguientes se descartan.
+
+El resultado es un ContextManifest con el texto para el prompt y la lista de
+documentos incluidos en el orden en que se numeran ([1], [2], ...), que es la que
+debe usarse para resolver las citas de la respuesta.
+"""
+
+import hashlib
+import os
+import re
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from graph.chains.lexical import tokenize
+from graph.chains.tokens import DEFAULT_MODEL, best_window, count_tokens, truncate_to_tokens
+
+# Presupuesto de tokens del contexto por modelo (CONTEXT_TOKEN_BUDGET lo fija para todos)
+CONTEXT_TOKEN_BUDGETS: Dict[str, int] = {
+    "gpt-4o-mini": 12000,
+    "gpt-4o": 12000,
+}
+DEFAULT_CONTEXT_TOKEN_BUDGET = 8000
+CONTEXT_TOKEN_BUDGET = os.environ.get("CONTEXT_TOKEN_BUDGET")
+# Un bloque que no cabe entero solo se recorta si quedan al menos estos tokens
+CONTEXT_MIN_CHUNK_TOKENS = int(os.environ.get("CONTEXT_MIN_CHUNK_TOKENS", "128"))
+# Similitud de Jaccard a partir de la cual dos pasajes se consideran casi duplicados
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("NEAR_DUPLICATE_THRESHOLD", "0.85"))
+SHINGLE_SIZE = 4
+SEPARATOR = "-" * 50
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def token_budget(model: str = DEFAULT_MODEL) -> int:
+    """
+    Presupuesto de tokens del contexto para un modelo.
+    """
+    if CONTEXT_TOKEN_BUDGET:
+        return int(CONTEXT_TOKEN_BUDGET)
+    return CONTEXT_TOKEN_BUDGETS.get(model, DEFAULT_CONTEXT_TOKEN_BUDGET)
+
+
+class ContextEntry(NamedTuple):
+    number: int
+    document: Document
+    tokens: int
+    truncated: bool
+
+
+class ContextManifest(NamedTuple):
+    text: str
+    entries: List[ContextEntry]
+    tokens: int
+    budget: int
+    duplicates: int
+    merged: int
+    dropped: int
+
+    @property
+    def documents(self) -> List[Document]:
+        """
+        Documentos incluidos, en el orden de su número de cita.
+        """
+        return [entry.document for entry in self.entries]
+
+
+def _page(doc: Document) -> Optional[int]:
+    try:
+        return int(float(doc.metadata.get("page")))
+    except (TypeError, ValueError):
+        return None
+
+
+def _shingles(text: str) -> frozenset:
+    tokens = tokenize(text)
+    if len(tokens) < SHINGLE_SIZE:
+        return frozenset([tuple(tokens)]) if tokens else frozenset()
+    return frozenset(tuple(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1))
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def deduplicate(documents: Sequence[Document],
+                threshold: float = NEAR_DUPLICATE_THRESHOLD) -> Tuple[List[Document], int]:
+    """
+    Quita duplicados exactos y casi duplicados, conservando el más relevante (el primero).
+    """
+    kept: List[Document] = []
+    kept_shingles: List[frozenset] = []
+    digests = set()
+    for doc in documents:
+        normalized = _WHITESPACE.sub(" ", doc.page_content).strip().lower()
+        digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        if not normalized or digest in digests:
+            continue
+        shingles = _shingles(doc.page_content)
+        if any(_jaccard(shingles, other) >= threshold for other in kept_shingles):
+            continue
+        digests.add(digest)
+        kept.append(doc)
+        kept_shingles.append(shingles)
+    return kept, len(documents) - len(kept)
+
+
+def merge_adjacent_pages(documents: Sequence[Document]) -> Tuple[List[Document], int]:
+    """
+    Une fragmentos de páginas consecutivas de una misma fuente.
+
+    El bloque resultante ocupa la posición de su fragmento más relevante, conserva
+    sus metadatos y lista las páginas en `metadata["pages"]`.
+    """
+    groups: List[List[Document]] = []
+    merged = 0
+    for doc in documents:
+        page = _page(doc)
+        source = doc.metadata.get("source")
+        target = None
+        if page is not None and source:
+            for group in groups:
+                pages = [_page(member) for member in group]
+                if group[0].metadata.get("source") != source or None in pages:
+                    continue
+                if page == min(pages) - 1 or page == max(pages) + 1:
+                    target = group
+                    break
+        if target is None:
+            groups.append([doc])
+        else:
+            target.append(doc)
+            merged += 1
+
+    result = []
+    for group in groups:
+        if len(group) == 1:
+            result.append(group[0])
+            continue
+        ordered = sorted(group, key=_page)
+        pages = [_page(member) for member in ordered]
+        result.append(Document(
+            page_content="\n".join(member.page_content.strip() for member in ordered),
+            metadata={**group[0].metadata, "page": pages[0], "pages": pages},
+        ))
+    return result, merged
+
+
+def _header(doc: Document, number: int) -> str:
+    source = doc.metadata.get("source", f"Documento {number}")
+    if "pinecone_docs" in source:
+        source = source.replace("pinecone_docs/", "Pinecone: ")
+        return f"\n\nDOCUMENTO [{number}] (PINECONE): {source}\n"
+    return f"\n\nDOCUMENTO [{number}]: {source}\n"
+
+
+def _block(doc: Document, number: int, content: str) -> str:
+    return f"{_header(doc, number)}{content}\n{SEPARATOR}"
+
+
+def build_context(documents: Sequence[Document], question: Optional[str] = None, model: str = DEFAULT_MODEL,
+                  budget: Optional[int] = None, deduplicate_passages: bool = True,
+                  merge_pages: bool = True) -> ContextManifest:
+    """
+    Construye el contexto numerado para el prompt dentro del presupuesto de tokens del modelo.
+    """
+    budget = token_budget(model) if budget is None else budget
+    candidates = list(documents)
+    duplicates = merged = 0
+    if deduplicate_passages:
+        candidates, duplicates = deduplicate(candidates)
+    if merge_pages:
+        candidates, merged = merge_adjacent_pages(candidates)
+
+    blocks: List[str] = []
+    entries: List[ContextEntry] = []
+    used = 0
+    for doc in candidates:
+        number = len(entries) + 1
+        block = _block(doc, number, doc.page_content)
+        tokens = count_tokens(block, model)
+        truncated = False
+        if used + tokens > budget:
+            overhead = count_tokens(_block(doc, number, ""), model)
+            available = budget - used - overhead
+            if available < CONTEXT_MIN_CHUNK_TOKENS:
+                break
+            content = best_window(doc.page_content, question, available, model) if question \
+                else truncate_to_tokens(doc.page_content, available, model)
+            if count_tokens(content, model) > available:
+                content = truncate_to_tokens(content, available, model)
+            doc = Document(page_content=content, metadata={**doc.metadata, "truncated": True})
+            block = _block(doc, number, content)
+            tokens = count_tokens(block, model)
+            truncated = True
+        blocks.append(block)
+        entries.append(ContextEntry(number, doc, tokens, truncated))
+        used += tokens
+        if truncated:
+            break
+
+    dropped = len(candidates) - len(entries)
+    print(f"context: {len(entries)} bloques ({used} de {budget} tokens), {duplicates} duplicados, "
+          f"{merged} páginas fusionadas, {dropped} descartados por presupuesto")
+    return ContextManifest("".join(blocks), entries, used, budget, duplicates, merged, dropped)
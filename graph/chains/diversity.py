@@ -0,0 +1,114 @@
+"""
+Selección diversa de fragmentos antes de la generación.
+
+Con frecuencia varios de los fragmentos mejor puntuados provienen del mismo
+concepto de la DIAN (a veces de páginas consecutivas) y repiten el mismo texto.
+Esta etapa elige los `top_k` fragmentos con Maximal Marginal Relevance (MMR)
+sobre sus embeddings y limita cuántos pueden venir de una misma fuente, de modo
+que el contexto cubre más fuentes distintas con el mismo presupuesto de tokens.
+"""
+
+import os
+from typing import List, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+
+from graph.chains.lexical import tokenize
+
+DIVERSITY_LAMBDA = float(os.environ.get("DIVERSITY_LAMBDA", "0.7"))
+DIVERSITY_MAX_PER_SOURCE = int(os.environ.get("DIVERSITY_MAX_PER_SOURCE", "2"))
+
+
+def _source_name(doc: Document) -> str:
+    return os.path.basename(str(doc.metadata.get("source", "")))
+
+
+def relevance_scores(documents: Sequence[Document]) -> np.ndarray:
+    """
+    Relevancia normalizada a [0, 1]: puntuación del reranking, o de la fusión (RRF), o el orden recibido.
+
+    La `score` de la búsqueda no se usa: la densa (coseno) y la léxica (BM25
+    normalizado, o 1.0 en los aciertos del índice de citas) no son comparables
+    en una misma escala, mientras que la fusión ya las combina por posición.
+    """
+    for key in ("rerank_score", "fusion_score"):
+        values = [doc.metadata.get(key) for doc in documents]
+        if any(value is None for value in values):
+            continue
+        raw = np.array(values, dtype=np.float32)
+        spread = raw.max() - raw.min()
+        if spread >= 1e-9:
+            return (raw - raw.min()) / spread
+    # Sin puntuación común a todos los candidatos: se respeta el orden recibido
+    return np.linspace(1.0, 0.5, len(documents), dtype=np.float32)
+
+
+def similarity_matrix(documents: Sequence[Document]) -> np.ndarray:
+    """
+    Similitud coseno entre fragmentos: con sus vectores si todos lo tienen, o con sus términos si no.
+    """
+    if all(doc.metadata.get("values") is not None for doc in documents):
+        matrix = np.vstack([np.asarray(doc.metadata["values"], dtype=np.float32) for doc in documents])
+    else:
+        vocabulary = {}
+        rows = [[vocabulary.setdefault(token, len(vocabulary)) for token in set(tokenize(doc.page_content))]
+                for doc in documents]
+        matrix = np.zeros((len(documents), max(len(vocabulary), 1)), dtype=np.float32)
+        for i, columns in enumerate(rows):
+            matrix[i, columns] = 1.0
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = matrix / np.where(norms == 0, 1, norms)
+    return matrix @ matrix.T
+
+
+def mmr_select(relevance: np.ndarray, similarity: np.ndarray, k: int, lambda_mult: float = DIVERSITY_LAMBDA,
+               groups: Optional[Sequence[str]] = None, max_per_group: Optional[int] = None) -> List[int]:
+    """
+    Índices elegidos por MMR: `lambda * relevancia - (1 - lambda) * máxima similitud con los ya elegidos`.
+
+    Con `groups` y `max_per_group` ningún grupo (fuente) supera el límite mientras
+    queden candidatos de otros grupos; si no alcanzan, se completa sin límite.
+    """
+    n = len(relevance)
+    k = min(k, n)
+    selected: List[int] = []
+    available = np.ones(n, dtype=bool)
+    max_similarity = np.zeros(n, dtype=np.float32)
+    counts = {}
+    for enforce_cap in (True, False):
+        while len(selected) < k:
+            allowed = available.copy()
+            if enforce_cap and groups is not None and max_per_group:
+                allowed &= np.array([counts.get(group, 0) < max_per_group for group in groups])
+            if not allowed.any():
+                break
+            scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+            best = int(np.argmax(np.where(allowed, scores, -np.inf)))
+            selected.append(best)
+            available[best] = False
+            max_similarity = np.maximum(max_similarity, similarity[best])
+            if groups is not None:
+                counts[groups[best]] = counts.get(groups[best], 0) + 1
+    return selected
+
+
+def diversify(documents: List[Document], top_k: int, lambda_mult: float = DIVERSITY_LAMBDA,
+              max_per_source: int = DIVERSITY_MAX_PER_SOURCE) -> List[Document]:
+    """
+    Elige `top_k` fragmentos relevantes y diversos (MMR + límite por fuente).
+    """
+    if len(documents) <= 1:
+        return documents[:top_k]
+    selected = mmr_select(
+        relevance_scores(documents),
+        similarity_matrix(documents),
+        top_k,
+        lambda_mult,
+        groups=[_source_name(doc) for doc in documents],
+        max_per_group=max_per_source,
+    )
+    chosen = [documents[i] for i in selected]
+    print(f"diversify: {len(chosen)} de {len(documents)} fragmentos, "
+          f"{len({_source_name(doc) for doc in chosen})} fuentes distintas")
+    return chosen
@@ -0,0 +1,101 @@
+"""
+Caché de embeddings de consultas en dos niveles.
+
+Un LRU en memoria con presupuesto en bytes atiende las preguntas repetidas sin
+latencia añadida; detrás, un almacén SQLite conserva los vectores (float32)
+entre reinicios. La clave combina el modelo y el texto normalizado, y al abrir
+el almacén se descartan las entradas de cualquier otro modelo. Los textos de
+carga masiva (fragmentos) se guardan con `exact=True`, con clave sobre el texto
+tal cual, para que dos fragmentos que sólo difieren en mayúsculas o espacios no
+compartan vector.
+"""
+
+import hashlib
+import os
+import re
+import unicodedata
+from array import array
+from typing import Dict, List, Optional
+
+from graph.chains.cache import LRUCache, SQLiteStore
+
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", os.path.join(".cache", "embeddings.sqlite"))
+EMBEDDING_CACHE_MAX_BYTES = int(os.environ.get("EMBEDDING_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def normalize_query(text: str) -> str:
+    """
+    Normaliza una consulta para usarla como clave: Unicode NFC, minúsculas y espacios colapsados.
+    """
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class EmbeddingCache:
+    """
+    Caché de embeddings con LRU en memoria delante de un almacén persistente.
+    """
+
+    def __init__(self, model: str, path: Optional[str] = EMBEDDING_CACHE_PATH,
+                 max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        self.model = model
+        self.memory = LRUCache(max_bytes)
+        self.store = None
+        self.disk_hits = 0
+        self.misses = 0
+        if path:
+            try:
+                self.store = SQLiteStore(path, table="embeddings")
+                removed = self.store.delete_tag_not(model)
+                if removed:
+                    print(f"EmbeddingCache: Descartados {removed} embeddings de otros modelos")
+            except Exception as e:
+                print(f"EmbeddingCache: No se pudo abrir la caché en disco {path}: {str(e)}")
+                self.store = None
+
+    def key(self, text: str, exact: bool = False) -> str:
+        if exact:
+            return hashlib.sha256(f"{self.model}\x01{text}".encode("utf-8")).hexdigest()
+        return hashlib.sha256(f"{self.model}\x00{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+    def get(self, text: str, exact: bool = False) -> Optional[List[float]]:
+        """
+        Devuelve el embedding almacenado para el texto, o None si no está en ningún nivel.
+        """
+        key = self.key(text, exact)
+        blob = self.memory.get(key)
+        if blob is None and self.store is not None:
+            blob = self.store.get(key)
+            if blob is not None:
+                self.disk_hits += 1
+                self.memory.put(key, bytes(blob))
+        if blob is None:
+            self.misses += 1
+            return None
+        return array("f", blob).tolist()
+
+    def put(self, text: str, embedding: List[float], exact: bool = False):
+        key = self.key(text, exact)
+        blob = array("f", embedding).tobytes()
+        self.memory.put(key, blob)
+        if self.store is not None:
+            try:
+                self.store.put(key, blob, tag=self.model)
+            except Exception as e:
+                print(f"EmbeddingCache: Error al guardar en disco: {str(e)}")
+
+    def clear(self):
+        self.memory.clear()
+        if self.store is not None:
+            self.store.clear()
+
+    def stats(self) -> Dict[str, int]:
+        memory = self.memory.stats()
+        return {
+            "memory_hits": memory["hits"],
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_entries": memory["entries"],
+            "memory_bytes": memory["bytes"],
+            "disk_entries": len(self.store) if self.store is not None else 0,
+        }
@@ -0,0 +1,61 @@
+"""
+Fusión de listas de resultados de distintas fuentes (índices, búsqueda léxica, etc.).
+"""
+
+import hashlib
+import os
+from typing import Callable, Dict, Hashable, List, Optional, Sequence
+
+from langchain_core.documents import Document
+
+# Constante de suavizado habitual de Reciprocal Rank Fusion
+RRF_K = 60
+
+
+def document_key(doc: Document) -> Hashable:
+    """
+    Clave de deduplicación: nombre del archivo fuente, página y contenido del fragmento.
+
+    Se usa el nombre del archivo sin el prefijo del índice para que el mismo
+    fragmento recuperado desde dos índices cuente como un único documento.
+    """
+    source = os.path.basename(str(doc.metadata.get("source", "")))
+    digest = hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+    return (source, doc.metadata.get("page", 0), digest)
+
+
+def reciprocal_rank_fusion(
+    ranked_lists: Sequence[List[Document]],
+    k: int = RRF_K,
+    top_k: Optional[int] = None,
+    weights: Optional[Sequence[float]] = None,
+    key: Callable[[Document], Hashable] = document_key,
+) -> List[Document]:
+    """
+    Combina varias listas ordenadas con Reciprocal Rank Fusion y elimina duplicados.
+
+    Cada documento suma `peso / (k + rango)` por cada lista en la que aparece, de
+    modo que la fusión no depende de la escala de las puntuaciones de cada fuente.
+    Se conserva la primera aparición de cada documento y su puntuación de fusión
+    queda en `metadata["fusion_score"]`.
+    """
+    scores: Dict[Hashable, float] = {}
+    first_seen: Dict[Hashable, Document] = {}
+    for list_index, documents in enumerate(ranked_lists):
+        weight = weights[list_index] if weights is not None else 1.0
+        for rank, doc in enumerate(documents):
+            doc_key = key(doc)
+            scores[doc_key] = scores.get(doc_key, 0.0) + weight / (k + rank + 1)
+            first_seen.setdefault(doc_key, doc)
+
+    ordered = sorted(scores, key=lambda doc_key: scores[doc_key], reverse=True)
+    if top_k is not None:
+        ordered = ordered[:top_k]
+    fused = []
+    for doc_key in ordered:
+        doc = first_seen[doc_key]
+        fused.append(Document(
+            page_content=doc.page_content,
+            metadata={**doc.metadata, "fusion_score": scores[doc_key]},
+        ))
+    return fused
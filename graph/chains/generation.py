@@ -1,8 +1,9 @@
 from langchain import hub
 from langchain_core.output_parsers import StrOutputParser
-from langchain_openai import ChatOpenAI
 
-llm = ChatOpenAI(temperature=0)
+from graph.chains.clients import openai_clients
+
+llm = openai_clients.chat("rag_generation", temperature=0)
 prompt = hub.pull("rlm/rag-prompt")
 
 generation_chain = prompt | llm | StrOutputParser()
@@ -0,0 +1,184 @@
+"""
+Calificador combinado de la respuesta: en una sola llamada decide si está
+fundamentada en los documentos y si responde a la pregunta.
+
+Con VERIFY_MODE=parallel los grafos usan en su lugar los dos calificadores
+separados (`is_grounded` y `addresses_question`) en ramas paralelas, cuyas
+notas se combinan con `verify_result`.
+
+Si un calificador no responde a tiempo (o su circuito está abierto) no hay
+veredicto: la respuesta queda "unverified", se entrega sin regenerarla y no se
+guarda en la caché de respuestas.
+
+En lugar de serializar cada Document completo, los documentos se envían en
+forma compacta: su número y fuente, y solo el fragmento más relevante para las
+oraciones de la respuesta que los citan ([n]). Los documentos no citados se
+envían con un fragmento más corto, para cubrir afirmaciones sin cita.
+"""
+
+import os
+import re
+from typing import Dict, List, Optional, Sequence
+
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
+from pydantic import BaseModel, Field
+from dotenv import load_dotenv
+
+from graph.chains.answer_grader import answer_grader
+from graph.chains.citations import CITATIONS_HEADING
+from graph.chains.clients import openai_clients
+from graph.chains.hallucination_grader import hallucination_grader
+from graph.chains.resilience import resilient_runnable
+from graph.chains.tokens import best_window, split_segments
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Obtener la clave API de OpenAI
+openai_api_key = os.getenv("OPENAI_API_KEY")
+if not openai_api_key:
+    raise ValueError("No se encontró la clave API de OpenAI. Por favor, configúrela en las variables de entorno.")
+
+# Tokens del fragmento enviado por documento citado y no citado
+GRADER_CITED_TOKENS = int(os.environ.get("GRADER_CITED_TOKENS", "250"))
+GRADER_UNCITED_TOKENS = int(os.environ.get("GRADER_UNCITED_TOKENS", "60"))
+
+# Etapa de verificación de los grafos: "merged" (una llamada) o "parallel" (dos ramas)
+VERIFY_MODES = ("merged", "parallel")
+VERIFY_MODE = os.environ.get("VERIFY_MODE", "merged").lower()
+if VERIFY_MODE not in VERIFY_MODES:
+    print(f"generation_grader: VERIFY_MODE desconocido '{VERIFY_MODE}', se usa 'merged'")
+    VERIFY_MODE = "merged"
+
+_CITATION = re.compile(r"\[(\d{1,4})\]")
+
+
+class GradeGeneration(BaseModel):
+    """Grounding and relevance verdicts for an LLM generation."""
+
+    grounded: bool = Field(
+        description="The answer is grounded in / supported by the set of facts, 'yes' or 'no'"
+    )
+    addresses_question: bool = Field(
+        description="The answer addresses / resolves the question, 'yes' or 'no'"
+    )
+
+
+llm = openai_clients.chat("generation_grader", model="gpt-3.5-turbo", temperature=0, max_retries=0)
+structured_llm_grader = llm.with_structured_output(GradeGeneration, method="function_calling")
+
+system = """You are a grader assessing an LLM generation against a question and a set of retrieved facts. \n
+     Each fact is labeled with its number [n] and source; the generation cites facts with the same numbers. \n
+     Give two binary scores: 'grounded' is 'yes' if the answer is grounded in / supported by the set of facts, \n
+     and 'addresses_question' is 'yes' if the answer resolves the question."""
+generation_grader_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", system),
+        ("human", "User question: \n\n {question} \n\n Set of facts: \n\n {documents} \n\n LLM generation: {generation}"),
+    ]
+)
+
+# Si el calificador no responde a tiempo (o su circuito está abierto) devuelve None (sin veredicto)
+generation_grader: Runnable = resilient_runnable(
+    "graders", generation_grader_prompt | structured_llm_grader, fallback=lambda inputs: None
+)
+
+
+def strip_citations_section(generation: str) -> str:
+    """
+    Quita la sección "6. Citas" (solo lista fuentes) antes de calificar.
+    """
+    position = generation.find(CITATIONS_HEADING)
+    return generation[:position].rstrip() if position != -1 else generation
+
+
+def cited_spans(generation: str) -> Dict[int, str]:
+    """
+    Oraciones de la respuesta que citan cada documento: {n: "oración 1 oración 2"}.
+    """
+    spans: Dict[int, List[str]] = {}
+    for segment in split_segments(generation):
+        for number in {int(match) for match in _CITATION.findall(segment)}:
+            spans.setdefault(number, []).append(segment.strip())
+    return {number: " ".join(segments) for number, segments in spans.items()}
+
+
+def compact_documents(documents: Sequence, generation: str) -> str:
+    """
+    Representación compacta de los documentos para el calificador: número, fuente y fragmento relevante.
+    """
+    spans = cited_spans(generation)
+    lines = []
+    for i, doc in enumerate(documents, start=1):
+        content = getattr(doc, "page_content", str(doc))
+        metadata = getattr(doc, "metadata", {}) or {}
+        source = str(metadata.get("source", f"Documento {i}")).replace("pinecone_docs/", "")
+        page = metadata.get("page")
+        page_info = f" (Pág. {page})" if page else ""
+        if i in spans:
+            excerpt = best_window(content, spans[i], GRADER_CITED_TOKENS)
+        else:
+            excerpt = best_window(content, generation, GRADER_UNCITED_TOKENS)
+        lines.append(f"[{i}] {source}{page_info}: {' '.join(excerpt.split())}")
+    return "\n".join(lines)
+
+
+def grade_generation(question: str, documents: Sequence, generation: str) -> Optional[GradeGeneration]:
+    """
+    Califica en una sola llamada si la respuesta está fundamentada y si responde a la pregunta.
+
+    Devuelve None si el calificador no pudo dar un veredicto.
+    """
+    generation = strip_citations_section(generation)
+    return generation_grader.invoke({
+        "question": question,
+        "documents": compact_documents(documents, generation),
+        "generation": generation,
+    })
+
+
+def is_grounded(documents: Sequence, generation: str) -> Optional[bool]:
+    """
+    Rama de fundamentación: calificador de alucinaciones con la representación compacta (None sin veredicto).
+    """
+    generation = strip_citations_section(generation)
+    grade = hallucination_grader.invoke({
+        "documents": compact_documents(documents, generation),
+        "generation": generation,
+    })
+    return None if grade is None else grade.binary_score
+
+
+def addresses_question(question: str, generation: str) -> Optional[bool]:
+    """
+    Rama de relevancia: ¿la respuesta resuelve la pregunta? (None sin veredicto)
+    """
+    grade = answer_grader.invoke({"question": question, "generation": strip_citations_section(generation)})
+    return None if grade is None else grade.binary_score
+
+
+def verify_result(grades: Dict[str, Optional[bool]]) -> str:
+    """
+    Combina las notas: "not_supported", "not_useful", "useful" o "unverified" (falta un veredicto).
+    """
+    grounded = grades.get("grounded")
+    addresses = grades.get("addresses_question")
+    if grounded is False:
+        return "not_supported"
+    if grounded is None:
+        return "unverified"
+    if addresses is False:
+        return "not_useful"
+    if addresses is None:
+        return "unverified"
+    return "useful"
+
+
+def verified_useful(question: str, documents: Sequence, generation: str) -> bool:
+    """
+    True si el calificador combinado da la respuesta por fundamentada y útil (regla para guardarla en caché).
+    """
+    grade = grade_generation(question, documents, generation)
+    return grade is not None and grade.grounded and grade.addresses_question
+
@@ -1,7 +1,8 @@
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
-from langchain_core.runnables import RunnableSequence
-from langchain_openai import ChatOpenAI
+from langchain_core.runnables import Runnable
+from graph.chains.clients import openai_clients
+from graph.chains.resilience import resilient_runnable
 import os
 from dotenv import load_dotenv
 
@@ -13,7 +14,7 @@ openai_api_key = os.getenv("OPENAI_API_KEY")
 if not openai_api_key:
     raise ValueError("No se encontró la clave API de OpenAI. Por favor, configúrela en las variables de entorno.")
 
-llm = ChatOpenAI(temperature=0, model="gpt-3.5-turbo", api_key=openai_api_key)
+llm = openai_clients.chat("hallucination_grader", model="gpt-3.5-turbo", temperature=0, max_retries=0)
 
 
 class GradeHallucinations(BaseModel):
@@ -35,4 +36,8 @@ hallucination_prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-hallucination_grader: RunnableSequence = hallucination_prompt | structured_llm_grader
+# Si el calificador no responde a tiempo (o su circuito está abierto) devuelve None:
+# la respuesta queda sin verificar, nunca se da por fundamentada
+hallucination_grader: Runnable = resilient_runnable(
+    "graders", hallucination_prompt | structured_llm_grader, fallback=lambda inputs: None
+)
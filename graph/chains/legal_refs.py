@@ -0,0 +1,164 @@
+"""
+Extracción de referencias normativas e índice de citas por fragmento.
+
+Reconoce referencias como "art. 437" (o "art 437"), "artículo 240-1 del E.T.",
+"Decreto 1625 de 2016", "Ley 2277 de 2022", "Concepto DIAN 010470", "Resolución
+000165 de 2023" u "Oficio 907 de 2021", tanto en consultas como en el texto y el nombre de
+archivo de los fragmentos, y las normaliza a claves como `articulo:437`,
+`decreto:1625:2016` o `concepto:10470`.
+
+El índice de citas (clave normalizada -> filas del snapshot) se precalcula al
+exportar el snapshot y permite traer en O(1) los fragmentos de la norma citada.
+"""
+
+import json
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+CITATIONS_FILE = "citations.json"
+# Filas guardadas por referencia (las de mayor peso)
+MAX_ROWS_PER_REFERENCE = 50
+
+_NUMBER = r"(?:n(?:o|um|umero)?\.?\s*|°\s*)?(\d+(?:-\d+)?)"
+_YEAR = r"(?:\s*(?:de|del|/)\s*(\d{4}))?"
+
+REFERENCE_PATTERNS = [
+    ("articulo", re.compile(r"\bart(?:iculos?|s?\.?)\s*" + _NUMBER)),
+    ("decreto", re.compile(r"\bdecreto(?:\s+(?:unico\s+reglamentario|ley|legislativo|reglamentario))?\s+" + _NUMBER + _YEAR)),
+    ("ley", re.compile(r"\bley\s+" + _NUMBER + _YEAR)),
+    ("concepto", re.compile(r"\bconcepto(?:\s+(?:general|unificado|dian|juridico|tributario))*\s+" + _NUMBER + _YEAR)),
+    ("oficio", re.compile(r"\boficio(?:\s+dian)?\s+" + _NUMBER + _YEAR)),
+    ("resolucion", re.compile(r"\bresolucion(?:\s+dian)?\s+" + _NUMBER + _YEAR)),
+    ("sentencia", re.compile(r"\bsentencia\s+(c|t|su)\s*-?\s*(\d+)" + _YEAR)),
+]
+# Número interno entre paréntesis: "concepto 1163 (010470)"
+INTERNAL_NUMBER = re.compile(r"\bconcepto\s+\d+\s*\((\d+)\)")
+# Nombres de archivo del corpus: "2024_12_concepto_1163(010470)"
+SOURCE_PATTERN = re.compile(r"(\d{4})_\d{1,2}_(concepto|oficio|resolucion|decreto|ley)_(\d+)(?:\s*\((\d+)\))?")
+
+
+class LegalReference(NamedTuple):
+    """
+    Referencia normativa normalizada.
+    """
+    kind: str
+    number: str
+    year: Optional[str] = None
+
+    def keys(self) -> List[str]:
+        """
+        Claves de la referencia, de la más específica a la más general.
+        """
+        base = f"{self.kind}:{self.number}"
+        return [f"{base}:{self.year}", base] if self.year else [base]
+
+
+def _normalize_text(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    folded = "".join(char for char in decomposed if not unicodedata.combining(char))
+    # Quitar puntos de miles ("1.625" -> "1625")
+    return re.sub(r"(?<=\d)\.(?=\d{3}\b)", "", folded)
+
+
+def _normalize_number(number: str) -> str:
+    head, _, tail = number.partition("-")
+    head = head.lstrip("0") or "0"
+    return f"{head}-{tail}" if tail else head
+
+
+def extract_references(text: str) -> List[LegalReference]:
+    """
+    Extrae las referencias normativas de un texto, sin duplicados y en orden de aparición.
+    """
+    normalized = _normalize_text(text)
+    found: Dict[LegalReference, int] = {}
+    for kind, pattern in REFERENCE_PATTERNS:
+        for match in pattern.finditer(normalized):
+            if kind == "sentencia":
+                number = f"{match.group(1)}-{match.group(2).lstrip('0') or '0'}"
+                year = match.group(3)
+            else:
+                number = _normalize_number(match.group(1))
+                year = match.group(2) if match.lastindex and match.lastindex >= 2 else None
+            found.setdefault(LegalReference(kind, number, year), match.start())
+    for match in INTERNAL_NUMBER.finditer(normalized):
+        found.setdefault(LegalReference("concepto", _normalize_number(match.group(1))), match.start())
+    return sorted(found, key=found.get)
+
+
+def extract_source_references(source: str) -> List[LegalReference]:
+    """
+    Extrae las referencias del nombre de archivo de un fragmento (p. ej. "2024_12_concepto_1163(010470)").
+    """
+    name = os.path.basename(source or "").lower()
+    references = []
+    for match in SOURCE_PATTERN.finditer(name):
+        year, kind, number, internal = match.groups()
+        references.append(LegalReference(kind, _normalize_number(number), year))
+        if internal:
+            references.append(LegalReference(kind, _normalize_number(internal)))
+    return references + extract_references(name.replace("_", " "))
+
+
+class CitationIndex:
+    """
+    Índice invertido de referencia normalizada -> filas del snapshot.
+
+    Las filas cuyo archivo fuente es la propia norma citada pesan más que las que
+    solo la mencionan en el texto; dentro de cada grupo, más menciones pesan más.
+    """
+
+    def __init__(self, postings: Dict[str, List[int]], version: Optional[str] = None):
+        self.postings = postings
+        self.version = version
+
+    @classmethod
+    def build(cls, rows: Iterable[Tuple[int, str, str]], version: Optional[str] = None) -> "CitationIndex":
+        """
+        Construye el índice a partir de tuplas (fila, texto, fuente).
+        """
+        weights: Dict[str, Dict[int, float]] = defaultdict(dict)
+        for row, text, source in rows:
+            for reference in extract_source_references(source):
+                for key in reference.keys():
+                    weights[key][row] = weights[key].get(row, 0.0) + 100.0
+            for reference in extract_references(text or ""):
+                for key in reference.keys():
+                    weights[key][row] = weights[key].get(row, 0.0) + 1.0
+        postings = {
+            key: sorted(rows_weights, key=lambda row: (-rows_weights[row], row))[:MAX_ROWS_PER_REFERENCE]
+            for key, rows_weights in weights.items()
+        }
+        return cls(postings, version)
+
+    def save(self, directory: str):
+        with open(os.path.join(directory, CITATIONS_FILE), "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "postings": self.postings}, f)
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["CitationIndex"]:
+        path = os.path.join(directory, CITATIONS_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("postings", {}), data.get("version"))
+
+    def lookup(self, query: str, per_reference: int = 3) -> List[int]:
+        """
+        Devuelve las filas de los fragmentos de las normas citadas en la consulta.
+
+        Para cada referencia se usa la clave más específica que exista en el
+        índice (con año si la consulta lo indica) y se toman hasta `per_reference` filas.
+        """
+        rows: List[int] = []
+        for reference in extract_references(query):
+            for key in reference.keys():
+                posting = self.postings.get(key)
+                if posting:
+                    rows.extend(row for row in posting[:per_reference] if row not in rows)
+                    break
+        return rows
@@ -0,0 +1,231 @@
+"""
+Índice léxico BM25 sobre los fragmentos de cada namespace.
+
+La búsqueda densa es débil para referencias exactas ("artículo 240 del Estatuto
+Tributario", "Concepto 1163 de 2024"); BM25 sobre tokens normalizados en español
+(minúsculas, sin tildes, números sin ceros a la izquierda ni puntos de miles)
+las encuentra de forma fiable. El índice se construye sobre los mismos
+fragmentos del snapshot local del namespace (ver graph/chains/snapshot.py).
+
+Antes de BM25 se consulta el índice de citas del snapshot (ver
+graph/chains/legal_refs.py): si la consulta nombra una norma concreta, sus
+fragmentos se devuelven directamente y encabezan los resultados.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set
+
+import numpy as np
+
+from graph.chains.legal_refs import CitationIndex, extract_references
+from graph.chains.vectorstores import (
+    METADATA_FILE,
+    VectorMatch,
+    read_manifest,
+    snapshot_data_path,
+    snapshot_path,
+    snapshot_version,
+)
+
+# Palabras vacías frecuentes en español (ya sin tildes)
+SPANISH_STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes como con contra cual cuales cuando de del
+desde donde durante e el ella ellas ellos en entre era es esa esas ese eso esos esta estas este esto
+estos fue fueron ha han hasta hay la las le les lo los mas me mi muy no nos o otra otras otro otros
+para pero por que quien se sea segun ser si sin sobre su sus tambien tiene tienen todo todos un una
+unas uno unos y ya
+""".split())
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+THOUSANDS_SEPARATOR = re.compile(r"(?<=\d)\.(?=\d{3}\b)")
+
+
+def fold_accents(text: str) -> str:
+    """
+    Elimina tildes y diacríticos ("retención" -> "retencion").
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Tokeniza un texto en español: minúsculas, sin tildes ni palabras vacías.
+
+    Los números se normalizan quitando puntos de miles y ceros a la izquierda,
+    de modo que "1.625" y "1625", o "010470" y "10470", coinciden.
+    """
+    text = THOUSANDS_SEPARATOR.sub("", fold_accents(text).lower())
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text):
+        if token.isdigit():
+            tokens.append(token.lstrip("0") or "0")
+        elif token not in SPANISH_STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+
+def numeric_tokens(text: str) -> Set[str]:
+    """
+    Tokens numéricos de al menos dos dígitos (números de artículos, conceptos, leyes, años).
+    """
+    return {token for token in tokenize(text) if token.isdigit() and len(token) >= 2}
+
+
+def reference_numbers(text: str) -> Set[str]:
+    """
+    Números (y años) de las referencias normativas del texto según legal_refs.
+
+    Un número suelto ("19%", "2024") no es una referencia y no cuenta.
+    """
+    numbers = set()
+    for reference in extract_references(text):
+        numbers.update(token for token in tokenize(reference.number) if token.isdigit())
+        if reference.year:
+            numbers.add(reference.year)
+    return numbers
+
+
+class BM25Index:
+    """
+    Índice BM25 con listas invertidas en arrays de NumPy.
+    """
+
+    def __init__(self, texts: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_tokens: List[Set[str]] = []
+        postings: Dict[str, Dict[int, int]] = {}
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[row] = len(tokens)
+            self.doc_tokens.append(set(tokens))
+            for token in tokens:
+                counts = postings.setdefault(token, {})
+                counts[row] = counts.get(row, 0) + 1
+
+        self.size = len(texts)
+        average = float(lengths.mean()) if self.size else 0.0
+        # Parte de la normalización por longitud que solo depende del documento
+        self.length_norm = k1 * (1 - b + b * lengths / average) if average else np.full(self.size, k1, np.float32)
+        self.postings = {}
+        for token, counts in postings.items():
+            rows = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+            idf = np.log(1 + (self.size - len(counts) + 0.5) / (len(counts) + 0.5))
+            self.postings[token] = (rows, tf, np.float32(idf))
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(self.size, dtype=np.float32)
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            rows, tf, idf = posting
+            scores[rows] += idf * tf * (self.k1 + 1) / (tf + self.length_norm[rows])
+        return scores
+
+    def search(self, query: str, top_k: int) -> List[tuple]:
+        """
+        Devuelve [(fila, puntuación)] de los `top_k` fragmentos con puntuación positiva.
+        """
+        if self.size == 0:
+            return []
+        scores = self.scores(query)
+        k = min(top_k, self.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top if scores[row] > 0]
+
+
+class LexicalHit(NamedTuple):
+    match: VectorMatch
+    exact_reference: bool
+    # "citation" si viene del índice de citas, "bm25" si de la búsqueda BM25
+    origin: str = "bm25"
+
+
+class LexicalIndex:
+    """
+    Índice BM25 de un namespace construido a partir de su snapshot local.
+    """
+
+    def __init__(self, path: str, version: Optional[str]):
+        self.version = version
+        conn = sqlite3.connect(os.path.join(path, METADATA_FILE))
+        try:
+            rows = conn.execute("SELECT row, id, text, source, metadata FROM chunks ORDER BY row").fetchall()
+        finally:
+            conn.close()
+        self.ids = [chunk_id for _, chunk_id, _, _, _ in rows]
+        self.metadata = [json.loads(metadata or "{}") for _, _, _, _, metadata in rows]
+        self.bm25 = BM25Index([text or "" for _, _, text, _, _ in rows])
+        self.citations = CitationIndex.load(path)
+        if self.citations is None or self.citations.version != version:
+            # Snapshots anteriores al índice de citas: se construye en memoria
+            self.citations = CitationIndex.build(
+                ((row, text, source) for row, _, text, source, _ in rows), version=version
+            )
+
+    def lookup_references(self, query: str, per_reference: int = 3) -> List[LexicalHit]:
+        """
+        Fragmentos de las normas citadas en la consulta, según el índice de citas.
+        """
+        return [
+            LexicalHit(VectorMatch(id=self.ids[row], score=1.0, metadata=self.metadata[row]), True, "citation")
+            for row in self.citations.lookup(query, per_reference)
+        ]
+
+    def search(self, query: str, top_k: int) -> List[LexicalHit]:
+        """
+        Busca los fragmentos más relevantes y marca los que contienen los números
+        de todas las referencias normativas de la consulta (p. ej. "240" y
+        "2277" en "artículo 240 de la Ley 2277"); los números sueltos no marcan.
+
+        Los fragmentos de las normas citadas (índice de citas) van primero.
+        """
+        results = self.lookup_references(query)
+        seen = {hit.match.id for hit in results}
+        hits = self.bm25.search(query, top_k)
+        if not hits:
+            return results
+        numbers = reference_numbers(query)
+        best = hits[0][1]
+        for row, score in hits:
+            if self.ids[row] in seen:
+                continue
+            exact = bool(numbers) and numbers <= self.bm25.doc_tokens[row]
+            match = VectorMatch(id=self.ids[row], score=score / best, metadata=self.metadata[row])
+            results.append(LexicalHit(match, exact))
+        return results
+
+
+_indexes: Dict[str, LexicalIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_lexical_index(index_name: str, namespace: str) -> Optional[LexicalIndex]:
+    """
+    Devuelve el índice léxico del namespace, o None si no hay snapshot local.
+
+    El índice se construye una vez por versión de snapshot.
+    """
+    version = snapshot_version(index_name, namespace)
+    if version is None:
+        return None
+    key = f"{index_name}/{namespace}"
+    with _indexes_lock:
+        lexical = _indexes.get(key)
+        if lexical is None or lexical.version != version:
+            manifest = read_manifest(index_name, namespace)
+            lexical = LexicalIndex(snapshot_data_path(snapshot_path(index_name, namespace), manifest),
+                                   manifest.get("version"))
+            _indexes[key] = lexical
+            print(f"get_lexical_index: Índice BM25 de {key} construido ({len(lexical.ids)} fragmentos)")
+        return lexical
@@ -0,0 +1,173 @@
+"""
+Reranking local de candidatos, sin llamadas a un LLM.
+
+Combina, de forma vectorizada con NumPy, varias señales por candidato:
+- similitud coseno entre la consulta y el vector del fragmento (`metadata["values"]`,
+  que Pinecone devuelve con `include_values`);
+- similitud con la consulta expandida con los mejores candidatos (Rocchio);
+- solapamiento léxico ponderado por IDF dentro del conjunto de candidatos;
+- señales de metadatos: referencia exacta, norma citada en la consulta y año del concepto.
+
+Cada señal se normaliza entre los candidatos y se suma con los pesos de
+LOCAL_RERANK_WEIGHTS. El resultado queda en `metadata["rerank_score"]`.
+"""
+
+import re
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+
+from graph.chains.legal_refs import extract_references, extract_source_references
+from graph.chains.lexical import numeric_tokens, tokenize
+
+LOCAL_RERANK_WEIGHTS: Dict[str, float] = {
+    "dense": 0.40,
+    "feedback": 0.15,
+    "lexical": 0.20,
+    "reference": 0.20,
+    "recency": 0.05,
+}
+# Candidatos usados para expandir la consulta y peso de la expansión
+FEEDBACK_DOCS = 3
+FEEDBACK_WEIGHT = 0.5
+
+YEAR_PATTERN = re.compile(r"(?:^|/)((?:19|20)\d{2})_")
+
+
+def _minmax(values: np.ndarray) -> np.ndarray:
+    """
+    Normaliza a [0, 1]; los valores ausentes (NaN) toman la mediana de los presentes.
+    """
+    present = ~np.isnan(values)
+    if not present.any():
+        return np.zeros_like(values)
+    values = np.where(present, values, np.median(values[present]))
+    low, high = values.min(), values.max()
+    if high - low < 1e-9:
+        return np.full_like(values, 0.5)
+    return (values - low) / (high - low)
+
+
+def _unit_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def dense_features(documents: Sequence[Document], query_embedding: Optional[Sequence[float]]):
+    """
+    Similitud con la consulta y con la consulta expandida (NaN si el candidato no tiene vector).
+    """
+    n = len(documents)
+    dense = np.full(n, np.nan, dtype=np.float32)
+    feedback = np.full(n, np.nan, dtype=np.float32)
+    with_values = [i for i, doc in enumerate(documents) if doc.metadata.get("values") is not None]
+
+    if query_embedding is not None and with_values:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        matrix = _unit_rows(np.vstack([np.asarray(documents[i].metadata["values"], dtype=np.float32)
+                                       for i in with_values]))
+        similarities = matrix @ query
+        dense[with_values] = similarities
+        # Rocchio: la consulta se acerca al centroide de los mejores candidatos
+        best = np.argsort(-similarities)[:FEEDBACK_DOCS]
+        expanded = query + FEEDBACK_WEIGHT * matrix[best].mean(axis=0)
+        feedback[with_values] = matrix @ (expanded / (np.linalg.norm(expanded) or 1.0))
+
+    # Sin vector, la puntuación de Pinecone ya es la similitud coseno con la consulta
+    for i, doc in enumerate(documents):
+        if np.isnan(dense[i]) and doc.metadata.get("retrieval") not in ("lexical", "citation"):
+            score = doc.metadata.get("score")
+            if score is not None:
+                dense[i] = score
+    return dense, feedback
+
+
+def lexical_features(query: str, documents: Sequence[Document]) -> np.ndarray:
+    """
+    Fracción (ponderada por IDF entre los candidatos) de los términos de la consulta presentes en cada fragmento.
+    """
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+        return np.zeros(len(documents), dtype=np.float32)
+    presence = np.array(
+        [[term in doc_tokens for term in terms]
+         for doc_tokens in (set(tokenize(doc.page_content)) for doc in documents)],
+        dtype=np.float32,
+    )
+    df = presence.sum(axis=0)
+    idf = np.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+    return presence @ idf / idf.sum()
+
+
+def reference_features(query: str, documents: Sequence[Document]) -> np.ndarray:
+    """
+    Señales de metadatos ligadas a la referencia normativa de la consulta.
+    """
+    query_keys = {key for reference in extract_references(query) for key in reference.keys()}
+    numbers = numeric_tokens(query)
+    features = np.zeros(len(documents), dtype=np.float32)
+    for i, doc in enumerate(documents):
+        if doc.metadata.get("exact_reference"):
+            features[i] += 1.0
+        if query_keys:
+            source_keys = {key for reference in extract_source_references(str(doc.metadata.get("source", "")))
+                           for key in reference.keys()}
+            if query_keys & source_keys:
+                features[i] += 1.0
+        if numbers and numbers <= numeric_tokens(doc.page_content):
+            features[i] += 0.5
+    return features
+
+
+def recency_features(documents: Sequence[Document]) -> np.ndarray:
+    """
+    Año del documento según el nombre del archivo ("2024_12_concepto_..."); NaN si no lo tiene.
+    """
+    years = np.full(len(documents), np.nan, dtype=np.float32)
+    for i, doc in enumerate(documents):
+        match = YEAR_PATTERN.search(str(doc.metadata.get("source", "")))
+        if match:
+            years[i] = float(match.group(1))
+    return years
+
+
+def local_rerank_scores(query: str, documents: Sequence[Document],
+                        query_embedding: Optional[Sequence[float]] = None,
+                        weights: Dict[str, float] = LOCAL_RERANK_WEIGHTS) -> np.ndarray:
+    """
+    Puntuación combinada de cada candidato (mayor es más relevante).
+    """
+    dense, feedback = dense_features(documents, query_embedding)
+    features = {
+        "dense": _minmax(dense),
+        "feedback": _minmax(feedback) if not np.isnan(feedback).all() else _minmax(dense),
+        "lexical": _minmax(lexical_features(query, documents)),
+        "reference": _minmax(reference_features(query, documents)),
+        "recency": _minmax(recency_features(documents)),
+    }
+    return sum(weights[name] * values for name, values in features.items())
+
+
+def local_rerank(query: str, documents: List[Document], top_k: int,
+                 query_embedding: Optional[Sequence[float]] = None) -> List[Document]:
+    """
+    Reordena los candidatos con local_rerank_scores y devuelve los `top_k` mejores.
+    """
+    if not documents:
+        return []
+    start = time.perf_counter()
+    scores = local_rerank_scores(query, documents, query_embedding)
+    order = np.argsort(-scores, kind="stable")[:top_k]
+    reranked = []
+    for rank in order:
+        doc = documents[rank]
+        reranked.append(Document(page_content=doc.page_content,
+                                 metadata={**doc.metadata, "rerank_score": float(scores[rank])}))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"local_rerank: {len(documents)} candidatos reordenados en {elapsed_ms:.1f} ms")
+    for i, doc in enumerate(reranked):
+        print(f"  {i+1}. Puntuación: {doc.metadata['rerank_score']:.3f} - Fuente: {doc.metadata.get('source', 'Desconocido')}")
+    return reranked
@@ -0,0 +1,161 @@
+"""
+Registro de conexiones a Pinecone compartido por todo el proceso.
+
+Mantiene un único cliente `pinecone.Pinecone`, handles `Index` ya calentados
+(con su pool HTTP keep-alive) por nombre de índice y una caché con TTL del
+listado de índices, de modo que una consulta no paga un `list_indexes()` ni un
+handshake TLS nuevo cada vez.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import pinecone
+from dotenv import load_dotenv
+
+# Cargar variables de entorno
+load_dotenv()
+
+PINECONE_API_KEY = os.environ.get("PINECONE_API_KEY")
+# Segundos durante los que se reutiliza el listado de índices
+INDEX_LIST_TTL = float(os.environ.get("PINECONE_INDEX_LIST_TTL", "300"))
+# Hilos y conexiones keep-alive por handle de índice
+POOL_THREADS = int(os.environ.get("PINECONE_POOL_THREADS", "4"))
+CONNECTION_POOL_MAXSIZE = int(os.environ.get("PINECONE_CONNECTION_POOL_MAXSIZE", "16"))
+
+
+class PineconePool:
+    """
+    Cliente de Pinecone y handles de índice reutilizables entre consultas.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, index_list_ttl: float = INDEX_LIST_TTL):
+        self._api_key = api_key
+        self._index_list_ttl = index_list_ttl
+        self._lock = threading.RLock()
+        self._client = None
+        self._indexes: Dict[str, object] = {}
+        self._index_names: Optional[List[str]] = None
+        self._index_names_at = 0.0
+        self._stats = {
+            "client_builds": 0,
+            "client_reuses": 0,
+            "index_builds": 0,
+            "index_reuses": 0,
+            "list_calls": 0,
+            "list_cache_hits": 0,
+            "client_build_ms": 0.0,
+            "index_build_ms": 0.0,
+            "list_ms": 0.0,
+        }
+
+    def client(self):
+        """
+        Devuelve el cliente del proceso, creándolo en el primer uso.
+        """
+        with self._lock:
+            if self._client is not None:
+                self._stats["client_reuses"] += 1
+                return self._client
+            start = time.perf_counter()
+            api_key = self._api_key or PINECONE_API_KEY
+            self._client = pinecone.Pinecone(api_key=api_key, pool_threads=POOL_THREADS)
+            self._stats["client_builds"] += 1
+            self._stats["client_build_ms"] += (time.perf_counter() - start) * 1000
+            print("PineconePool: Cliente de Pinecone creado")
+            return self._client
+
+    def list_index_names(self, refresh: bool = False) -> List[str]:
+        """
+        Devuelve los nombres de los índices existentes, usando la caché mientras no expire el TTL.
+        """
+        with self._lock:
+            fresh = time.monotonic() - self._index_names_at < self._index_list_ttl
+            if self._index_names is not None and fresh and not refresh:
+                self._stats["list_cache_hits"] += 1
+                return list(self._index_names)
+            start = time.perf_counter()
+            self._index_names = [index.name for index in self.client().list_indexes()]
+            self._index_names_at = time.monotonic()
+            self._stats["list_calls"] += 1
+            self._stats["list_ms"] += (time.perf_counter() - start) * 1000
+            print(f"PineconePool: Índices existentes: {self._index_names}")
+            return list(self._index_names)
+
+    def has_index(self, index_name: str) -> bool:
+        """
+        Indica si el índice existe. Si no aparece en la caché se vuelve a listar una vez.
+        """
+        if index_name in self._indexes:
+            return True
+        if index_name in self.list_index_names():
+            return True
+        return index_name in self.list_index_names(refresh=True)
+
+    def get_index(self, index_name: str):
+        """
+        Devuelve un handle `Index` reutilizable, o None si el índice no existe.
+        """
+        with self._lock:
+            index = self._indexes.get(index_name)
+            if index is not None:
+                self._stats["index_reuses"] += 1
+                return index
+            if not self.has_index(index_name):
+                print(f"PineconePool: El índice {index_name} no existe.")
+                return None
+            start = time.perf_counter()
+            index = self.client().Index(
+                index_name,
+                pool_threads=POOL_THREADS,
+                connection_pool_maxsize=CONNECTION_POOL_MAXSIZE,
+            )
+            self._indexes[index_name] = index
+            self._stats["index_builds"] += 1
+            self._stats["index_build_ms"] += (time.perf_counter() - start) * 1000
+            print(f"PineconePool: Conectado al índice {index_name}")
+            return index
+
+    def discard(self, index_name: str):
+        """
+        Descarta el handle de un índice (por ejemplo tras un error de conexión).
+        """
+        with self._lock:
+            self._indexes.pop(index_name, None)
+
+    def reset(self):
+        """
+        Cierra todo el estado del registro. Útil en pruebas o al rotar la API key.
+        """
+        with self._lock:
+            self._client = None
+            self._indexes.clear()
+            self._index_names = None
+            self._index_names_at = 0.0
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Estadísticas del registro, incluida una estimación de la latencia ahorrada.
+
+        La estimación multiplica cada reutilización por el coste medio medido
+        de la operación que se evitó (crear cliente, crear handle o listar índices).
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["open_indexes"] = len(self._indexes)
+
+        def average(total_ms, count):
+            return total_ms / count if count else 0.0
+
+        stats["estimated_saved_ms"] = (
+            stats["client_reuses"] * average(stats["client_build_ms"], stats["client_builds"])
+            + stats["index_reuses"] * average(stats["index_build_ms"], stats["index_builds"])
+            + stats["list_cache_hits"] * average(stats["list_ms"], stats["list_calls"])
+        )
+        return stats
+
+
+# Registro compartido por MultiRetriever, los helpers query_<tema> y las páginas
+pinecone_pool = PineconePool()
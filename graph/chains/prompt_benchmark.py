@@ -0,0 +1,98 @@
+"""
+Compara las variantes del prompt de generación (latencia y tokens de entrada).
+
+Uso:
+    python -m graph.chains.prompt_benchmark --topic IVA --question "¿Cuál es la tarifa general del IVA?"
+    python -m graph.chains.prompt_benchmark --topic Renta --runs 3 --variants full lean
+    python -m graph.chains.prompt_benchmark --topic IVA --question "..." --dry-run
+
+Para cada variante se recuperan una sola vez los documentos y se genera la
+respuesta en streaming `--runs` veces, midiendo el tiempo hasta el primer token,
+el tiempo total, los tokens de entrada y los servidos desde el caché de prompts
+(a partir de la segunda ejecución el prefijo estático debería venir del caché).
+Con `--dry-run` solo se cuentan los tokens de entrada, sin llamar al modelo.
+"""
+
+import argparse
+import statistics
+import time
+from typing import Dict, List, Optional
+
+from graph.chains.openai_generation import build_messages, stream_with_openai
+from graph.chains.prompts import PROMPT_VARIANTS, prompt_version
+from graph.chains.tokens import count_tokens
+
+
+def input_tokens(question: str, documents, variant: str) -> int:
+    return sum(count_tokens(message["content"]) for message in build_messages(question, documents, variant))
+
+
+def run_variant(question: str, documents, variant: str, runs: int) -> Dict[str, float]:
+    """
+    Ejecuta la generación `runs` veces con una variante y devuelve las medianas.
+    """
+    first_token, total, prompt_tokens, cached_tokens, completion_tokens = [], [], [], [], []
+    for run in range(runs):
+        start = time.perf_counter()
+        first = None
+        for event in stream_with_openai(question, documents, variant):
+            if event["type"] == "delta" and first is None:
+                first = time.perf_counter() - start
+            elif event["type"] == "done":
+                usage = event.get("usage")
+                details = getattr(usage, "prompt_tokens_details", None)
+                prompt_tokens.append(getattr(usage, "prompt_tokens", 0) or 0)
+                cached_tokens.append((getattr(details, "cached_tokens", 0) or 0) if details is not None else 0)
+                completion_tokens.append(getattr(usage, "completion_tokens", 0) or 0)
+        total.append(time.perf_counter() - start)
+        first_token.append(first if first is not None else total[-1])
+        print(f"prompt_benchmark: {variant} ejecución {run + 1}/{runs}: primer token {first_token[-1]:.2f} s, "
+              f"total {total[-1]:.2f} s, entrada {prompt_tokens[-1]} ({cached_tokens[-1]} desde caché)")
+    return {
+        "first_token_s": statistics.median(first_token),
+        "total_s": statistics.median(total),
+        "prompt_tokens": statistics.median(prompt_tokens),
+        "cached_tokens": statistics.median(cached_tokens),
+        "completion_tokens": statistics.median(completion_tokens),
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark de las variantes del prompt de generación")
+    parser.add_argument("--topic", default="IVA", help="Tema registrado en TOPIC_REGISTRY")
+    parser.add_argument("--question", default="¿Cuál es la tarifa general del IVA y qué bienes están excluidos?")
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("--top-k", type=int, default=8)
+    parser.add_argument("--variants", nargs="+", choices=PROMPT_VARIANTS, default=list(PROMPT_VARIANTS))
+    parser.add_argument("--dry-run", action="store_true", help="Solo cuenta tokens de entrada")
+    args = parser.parse_args(argv)
+
+    # Importación diferida: la recuperación necesita las credenciales de OpenAI y Pinecone
+    from graph.chains.reranking import retrieve_with_reranking
+    from graph.chains.retrieval import query_hybrid, resolve_topic
+
+    config = resolve_topic(args.topic)
+
+    def retriever(query, top_k, **kwargs):
+        return query_hybrid(query, index_name=config.index_name, namespace=config.namespace, top_k=top_k, **kwargs)
+
+    documents = retrieve_with_reranking(args.question, retriever, top_k=args.top_k)
+    print(f"prompt_benchmark: {len(documents)} documentos recuperados para {args.topic}")
+
+    results = {}
+    for variant in args.variants:
+        if args.dry_run:
+            results[variant] = {"prompt_tokens": input_tokens(args.question, documents, variant)}
+        else:
+            results[variant] = run_variant(args.question, documents, variant, args.runs)
+
+    columns = sorted({column for result in results.values() for column in result})
+    print("\nvariante (versión) | " + " | ".join(columns))
+    for variant, result in results.items():
+        values = " | ".join(f"{result[column]:.2f}" if isinstance(result[column], float) else str(result[column])
+                            for column in columns)
+        print(f"{variant} ({prompt_version(variant)}) | {values}")
+
+
+if __name__ == "__main__":
+    main()
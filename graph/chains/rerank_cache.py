@@ -0,0 +1,155 @@
+"""
+Caché de resultados de reranking.
+
+Una pregunta repetida (o casi idéntica) suele traer exactamente los mismos
+candidatos; en ese caso el orden y las puntuaciones del reranking se reutilizan
+en lugar de recalcularse. La clave combina:
+- la consulta normalizada, el modo de reranking y `top_k`;
+- una huella estable del conjunto de candidatos (fuente, página, id y hash del texto);
+- la versión del snapshot de cada namespace de los candidatos, de modo que al
+  sincronizar un snapshot las entradas anteriores dejan de usarse.
+
+Un LRU en memoria con presupuesto en bytes va delante de un almacén SQLite
+opcional (RERANK_CACHE_PATH vacío lo desactiva); ambos niveles respetan el TTL.
+Solo los modos con LLM ("llm" y "pointwise") usan el almacén en disco: el
+reranking local se recalcula en un milisegundo, menos de lo que cuesta una
+escritura en SQLite, y se queda en memoria.
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from graph.chains.cache import LRUCache, SQLiteStore
+from graph.chains.embedding_cache import normalize_query
+from graph.chains.vectorstores import snapshot_version
+
+RERANK_CACHE_PATH = os.environ.get("RERANK_CACHE_PATH", os.path.join(".cache", "rerank.sqlite"))
+RERANK_CACHE_MAX_BYTES = int(os.environ.get("RERANK_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+RERANK_CACHE_TTL = float(os.environ.get("RERANK_CACHE_TTL", str(24 * 3600)))
+RERANK_CACHE_MAX_ENTRIES = int(os.environ.get("RERANK_CACHE_MAX_ENTRIES", "20000"))
+# Cada cuántas escrituras se poda el almacén en disco
+PRUNE_EVERY = 200
+# Modos cuyos resultados se guardan también en disco
+DISK_MODES = ("llm", "pointwise")
+
+
+def candidate_key(doc: Document) -> str:
+    """
+    Identificador estable de un candidato.
+    """
+    digest = hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()[:16]
+    return f"{doc.metadata.get('source', '')}|{doc.metadata.get('page', 0)}|{doc.metadata.get('id', '')}|{digest}"
+
+
+def candidate_fingerprint(documents: Sequence[Document]) -> Tuple[str, Dict[str, Document]]:
+    """
+    Huella del conjunto de candidatos (independiente de su orden) y mapa clave -> documento.
+    """
+    by_key = {candidate_key(doc): doc for doc in documents}
+    digest = hashlib.sha256("\n".join(sorted(by_key)).encode("utf-8")).hexdigest()
+    return digest, by_key
+
+
+def snapshot_versions(documents: Sequence[Document]) -> str:
+    """
+    Versiones de snapshot de los namespaces de los candidatos ("-" si no hay snapshot).
+    """
+    namespaces = sorted({
+        (doc.metadata.get("index_name"), doc.metadata.get("namespace"))
+        for doc in documents
+        if doc.metadata.get("index_name")
+    })
+    return ",".join(
+        f"{index_name}/{namespace}@{snapshot_version(index_name, namespace) or '-'}"
+        for index_name, namespace in namespaces
+    )
+
+
+class RerankCache:
+    """
+    Caché de dos niveles del orden y las puntuaciones del reranking.
+    """
+
+    def __init__(self, path: Optional[str] = RERANK_CACHE_PATH, max_bytes: int = RERANK_CACHE_MAX_BYTES,
+                 ttl: Optional[float] = RERANK_CACHE_TTL, max_entries: int = RERANK_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory = LRUCache(max_bytes, ttl=ttl)
+        self.store = None
+        self.disk_hits = 0
+        self.misses = 0
+        self._writes = 0
+        if path:
+            try:
+                self.store = SQLiteStore(path, table="rerank")
+            except Exception as e:
+                print(f"RerankCache: No se pudo abrir la caché en disco {path}: {str(e)}")
+                self.store = None
+
+    def key(self, query: str, documents: Sequence[Document], mode: str, top_k: int) -> str:
+        fingerprint, _ = candidate_fingerprint(documents)
+        raw = "\x00".join([normalize_query(query), mode, str(top_k), fingerprint, snapshot_versions(documents)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, query: str, documents: Sequence[Document], mode: str, top_k: int) -> Optional[List[Document]]:
+        """
+        Devuelve los candidatos reordenados según el resultado cacheado, o None.
+        """
+        key = self.key(query, documents, mode, top_k)
+        blob = self.memory.get(key)
+        if blob is None and self.store is not None and mode in DISK_MODES:
+            blob = self.store.get(key, ttl=self.ttl)
+            if blob is not None:
+                self.disk_hits += 1
+                blob = bytes(blob)
+                self.memory.put(key, blob)
+        if blob is None:
+            self.misses += 1
+            return None
+        _, by_key = candidate_fingerprint(documents)
+        reranked = []
+        for doc_key, score in json.loads(blob):
+            doc = by_key.get(doc_key)
+            if doc is None:
+                self.misses += 1
+                return None
+            reranked.append(Document(page_content=doc.page_content,
+                                     metadata={**doc.metadata, "rerank_score": score}))
+        return reranked
+
+    def put(self, query: str, documents: Sequence[Document], mode: str, top_k: int, reranked: Sequence[Document]):
+        key = self.key(query, documents, mode, top_k)
+        blob = json.dumps([[candidate_key(doc), doc.metadata.get("rerank_score")] for doc in reranked]).encode("utf-8")
+        self.memory.put(key, blob)
+        if self.store is None or mode not in DISK_MODES:
+            return
+        try:
+            self.store.put(key, blob, tag=mode)
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                self.store.prune(self.max_entries)
+        except Exception as e:
+            print(f"RerankCache: Error al guardar en disco: {str(e)}")
+
+    def clear(self):
+        self.memory.clear()
+        if self.store is not None:
+            self.store.clear()
+
+    def stats(self) -> Dict[str, int]:
+        memory = self.memory.stats()
+        return {
+            "memory_hits": memory["hits"],
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_entries": memory["entries"],
+            "disk_entries": len(self.store) if self.store is not None else 0,
+        }
+
+
+# Caché compartida por rerank_documents
+rerank_cache = RerankCache()
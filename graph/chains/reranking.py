@@ -1,21 +1,275 @@
 """
 Módulo para implementar reranking de documentos recuperados.
 Esto mejora la relevancia de los documentos antes de generar respuestas.
+
+Modos (variable de entorno RERANK_MODE):
+- "local" (por defecto): reranking local con vectores, solapamiento léxico y
+  metadatos, sin llamadas a un LLM (ver graph/chains/local_rerank.py).
+- "llm": evaluación de todos los candidatos con gpt-4o-mini (más preciso y más lento).
+- "pointwise": una solicitud corta y concurrente por candidato que solo devuelve
+  un entero; termina en cuanto hay suficientes candidatos con puntuación alta.
 """
 
 import os
-from typing import List, Dict, Any
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
-from openai import OpenAI
 from langchain_core.documents import Document
 
+from graph.chains.clients import openai_clients
+from graph.chains.diversity import diversify
+from graph.chains.legal_refs import extract_references
+from graph.chains.local_rerank import local_rerank
+from graph.chains import resilience
+from graph.chains.rerank_cache import rerank_cache
+from graph.chains.retrieval import get_embedding, strip_values
+from graph.chains.tokens import best_window, fit_to_budget
+
 # Cargar variables de entorno
 load_dotenv()
 
-# Inicializar cliente de OpenAI
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+RERANK_MODES = ("local", "llm", "pointwise")
+RERANK_MODE = os.environ.get("RERANK_MODE", "local").lower()
+
+# Modo pointwise: concurrencia, tiempo máximo por llamada y umbral de "relevante"
+POINTWISE_MAX_WORKERS = int(os.environ.get("RERANK_MAX_WORKERS", "8"))
+POINTWISE_TIMEOUT = float(os.environ.get("RERANK_TIMEOUT", "6"))
+POINTWISE_HIGH_SCORE = 8
+POINTWISE_DOC_TOKENS = 350
+# Puntuación neutra para un candidato cuya evaluación falló
+POINTWISE_FALLBACK_SCORE = 5
+
+# Modo llm: presupuesto de tokens repartido entre todos los candidatos del prompt
+RERANK_TOKEN_BUDGET = int(os.environ.get("RERANK_TOKEN_BUDGET", "6000"))
+RERANK_MIN_DOC_TOKENS = 64
+
+POINTWISE_SYSTEM_MESSAGE = """Eres un experto en derecho tributario colombiano. Evalúa la relevancia del documento para responder la consulta.
+Responde únicamente con un número entero del 0 (irrelevante) al 10 (responde directamente la consulta), sin texto adicional."""
+
+# Política adaptativa de retrieve_with_reranking: se omite el reranking si las
+# puntuaciones densas ya separan claramente los `top_k` primeros (salto en el
+# corte o todos por encima del umbral de confianza) y se amplía el pool de
+# candidatos solo cuando las puntuaciones son planas
+ADAPTIVE_RERANK = os.environ.get("ADAPTIVE_RERANK", "true").lower() == "true"
+RERANK_OVERFETCH = 2
+RERANK_WIDE_OVERFETCH = 4
+RERANK_SKIP_GAP = float(os.environ.get("RERANK_SKIP_GAP", "0.05"))
+RERANK_SKIP_SCORE = float(os.environ.get("RERANK_SKIP_SCORE", "0.60"))
+RERANK_FLAT_SPREAD = float(os.environ.get("RERANK_FLAT_SPREAD", "0.02"))
+
+# Selección diversa (MMR + límite por fuente) tras el reranking; el reranking
+# conserva un pool algo mayor que `top_k` para que haya de dónde elegir
+DIVERSITY = os.environ.get("DIVERSITY", "true").lower() == "true"
+DIVERSITY_POOL = 1.5
+
+# Cliente de OpenAI sobre el pool compartido (los reintentos los gestiona graph/chains/resilience.py)
+client = openai_clients.openai("rerank", max_retries=0)
+# Cliente sin reintentos para el modo pointwise: un fallo afecta solo a ese documento
+pointwise_client = client.with_options(timeout=POINTWISE_TIMEOUT, max_retries=0)
+# Pool compartido: limita la concurrencia total de evaluaciones entre consultas
+_pointwise_executor = ThreadPoolExecutor(max_workers=POINTWISE_MAX_WORKERS, thread_name_prefix="rerank")
+
+class RerankLatency:
+    """
+    Media móvil exponencial de la latencia del reranking por modo (para estimar el tiempo ahorrado).
+    """
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self._averages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def update(self, mode: str, elapsed_ms: float):
+        with self._lock:
+            previous = self._averages.get(mode)
+            self._averages[mode] = elapsed_ms if previous is None else \
+                self.alpha * elapsed_ms + (1 - self.alpha) * previous
+
+    def estimate(self, mode: str) -> Optional[float]:
+        with self._lock:
+            return self._averages.get(mode)
+
+
+rerank_latency = RerankLatency()
+
+def rerank_decision(documents: List[Document], top_k: int) -> str:
+    """
+    Decide qué hacer con los candidatos a partir de sus puntuaciones densas.
+
+    Devuelve "skip_gap" (salto claro entre el puesto `top_k` y el siguiente),
+    "skip_confident" (los `top_k` primeros superan RERANK_SKIP_SCORE), "widen"
+    (puntuaciones planas: conviene ampliar el pool) o "rerank".
+    """
+    scores = sorted(
+        (doc.metadata["score"] for doc in documents
+         if doc.metadata.get("retrieval") not in ("lexical", "citation") and doc.metadata.get("score") is not None),
+        reverse=True
+    )
+    if len(scores) <= top_k:
+        return "rerank"
+    if scores[top_k - 1] - scores[top_k] >= RERANK_SKIP_GAP:
+        return "skip_gap"
+    if scores[top_k - 1] >= RERANK_SKIP_SCORE:
+        return "skip_confident"
+    if scores[0] - scores[-1] < RERANK_FLAT_SPREAD:
+        return "widen"
+    return "rerank"
+
+def _top_by_score(documents: List[Document], top_k: int) -> List[Document]:
+    """
+    Los `top_k` candidatos densos de mayor puntuación más los léxicos y de citas, en el orden recibido.
+
+    Los candidatos léxicos no tienen puntuación densa comparable: se conservan en
+    la posición que les dio la fusión en lugar de descartarse al omitir el reranking.
+    """
+    dense = [doc for doc in documents if doc.metadata.get("retrieval") not in ("lexical", "citation")]
+    keep = {id(doc) for doc in sorted(dense, key=lambda doc: doc.metadata.get("score") or 0, reverse=True)[:top_k]}
+    return [doc for doc in documents if id(doc) in keep or doc.metadata.get("retrieval") in ("lexical", "citation")]
+
+def rerank_documents(query: str, documents: List[Document], top_k: int = 5,
+                     mode: Optional[str] = None) -> List[Document]:
+    """
+    Reordena los documentos según su relevancia para la consulta.
+
+    Args:
+        query: La consulta del usuario
+        documents: Lista de documentos recuperados
+        top_k: Número de documentos a devolver después del reranking
+        mode: "local", "llm" o "pointwise" (por defecto, RERANK_MODE)
+
+    Returns:
+        Lista reordenada de documentos más relevantes
+    """
+    if not documents:
+        return []
+    
+    if len(documents) <= top_k:
+        return documents
+    
+    mode = (mode or RERANK_MODE).lower()
+    if mode not in RERANK_MODES:
+        print(f"rerank_documents: Modo desconocido '{mode}', se usa 'local'")
+        mode = "local"
+    if mode != "local" and not resilience.get_breaker("rerank").allow():
+        # Ruta degradada: sin llamadas al LLM mientras el circuito esté abierto
+        print(f"rerank_documents: Circuito abierto para el reranking ({mode}), se usa el reranking local")
+        mode = "local"
+    
+    cached = rerank_cache.get(query, documents, mode, top_k)
+    if cached is not None:
+        print(f"rerank_documents: Resultado del reranking ({mode}) servido desde la caché")
+        return cached
+    
+    start = time.perf_counter()
+    if mode == "llm":
+        reranked = llm_rerank_documents(query, documents, top_k=top_k)
+    elif mode == "pointwise":
+        reranked = pointwise_rerank_documents(query, documents, top_k=top_k)
+    else:
+        query_embedding = None
+        if any(doc.metadata.get("values") is not None for doc in documents):
+            # El embedding de la consulta ya está en la caché de embeddings
+            query_embedding = get_embedding(query)
+        reranked = local_rerank(query, documents, top_k, query_embedding=query_embedding)
+    rerank_latency.update(mode, (time.perf_counter() - start) * 1000)
+    
+    # Solo se cachean rankings completos (sin documentos con puntuación de respaldo)
+    if reranked and all(doc.metadata.get("rerank_score") is not None and not doc.metadata.get("rerank_fallback")
+                        for doc in reranked):
+        rerank_cache.put(query, documents, mode, top_k, reranked)
+    return reranked
+
+def _score_document(query: str, doc: Document) -> int:
+    """
+    Puntúa un único documento (0-10) con una respuesta de un solo entero.
+    """
+    text = best_window(doc.page_content, query, POINTWISE_DOC_TOKENS)
+    response = pointwise_client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": POINTWISE_SYSTEM_MESSAGE},
+            {"role": "user", "content": f"Consulta: {query}\n\nDocumento:\n{text}"}
+        ],
+        temperature=0,
+        max_tokens=2
+    )
+    match = re.search(r"\d+", response.choices[0].message.content or "")
+    if match is None:
+        raise ValueError(f"Respuesta no numérica: {response.choices[0].message.content!r}")
+    return min(10, int(match.group()))
 
-def rerank_documents(query: str, documents: List[Document], top_k: int = 5) -> List[Document]:
+def pointwise_rerank_documents(query: str, documents: List[Document], top_k: int = 5) -> List[Document]:
+    """
+    Reordena los documentos puntuando cada uno en una solicitud concurrente independiente.
+
+    Se detiene en cuanto `top_k` documentos alcanzan POINTWISE_HIGH_SCORE (los
+    pendientes se cancelan). Si la evaluación de un documento falla o vence el
+    plazo, ese documento recibe una puntuación neutra y conserva su posición
+    relativa; el resto del ranking no se ve afectado.
+
+    El pool es compartido entre consultas: cada evaluación tiene su plazo
+    (POINTWISE_TIMEOUT, el timeout de `pointwise_client`) desde que empieza a
+    ejecutarse, no desde que se encola, de modo que las que esperan detrás de
+    otras consultas no fallan sin llegar a empezar. El conjunto queda acotado
+    por el plazo de la etapa de reranking.
+    """
+    if not documents:
+        return []
+    
+    start = time.perf_counter()
+    futures = {_pointwise_executor.submit(_score_document, query, doc): i for i, doc in enumerate(documents)}
+    scores: Dict[int, float] = {}
+    failed = set()
+    high = 0
+    pending = set(futures)
+    deadline = time.monotonic() + resilience.stage_timeout("rerank")
+    while pending and high < top_k:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            i = futures[future]
+            try:
+                scores[i] = future.result()
+            except Exception as e:
+                failed.add(i)
+                scores[i] = POINTWISE_FALLBACK_SCORE
+                print(f"pointwise_rerank: Falló la evaluación del documento {i+1}: {str(e)}")
+            if scores[i] >= POINTWISE_HIGH_SCORE:
+                high += 1
+    for future in pending:
+        future.cancel()
+    # Para el circuit breaker, la etapa solo falla si no se pudo evaluar ningún documento
+    breaker = resilience.get_breaker("rerank")
+    if len(failed) == len(scores) and (failed or pending):
+        breaker.record_failure()
+    elif len(failed) < len(scores):
+        breaker.record_success()
+    
+    # Sin puntuación (cancelados o fuera de plazo): después de los evaluados
+    ranking = sorted(
+        range(len(documents)),
+        key=lambda i: (-scores.get(i, -1), i)
+    )[:top_k]
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"pointwise_rerank: {len(scores)}/{len(documents)} evaluados ({len(failed)} fallidos, "
+          f"{len(pending)} cancelados) en {elapsed_ms:.0f} ms")
+    reranked = []
+    for rank, i in enumerate(ranking):
+        doc = documents[i]
+        score = scores.get(i)
+        print(f"  {rank+1}. Puntuación: {score if score is not None else '-'}/10 - Fuente: {doc.metadata.get('source', 'Desconocido')}")
+        metadata = {**doc.metadata, "rerank_score": score}
+        if i in failed:
+            metadata["rerank_fallback"] = True
+        reranked.append(Document(page_content=doc.page_content, metadata=metadata))
+    return reranked
+
+def llm_rerank_documents(query: str, documents: List[Document], top_k: int = 5) -> List[Document]:
     """
     Reordena los documentos según su relevancia para la consulta utilizando OpenAI.
     
@@ -36,11 +290,10 @@ def rerank_documents(query: str, documents: List[Document], top_k: int = 5) -> L
     print(f"Reranking {len(documents)} documentos...")
     
     # Preparar los documentos para evaluación
-    doc_texts = []
-    for i, doc in enumerate(documents):
-        # Limitar el tamaño del texto para evitar tokens excesivos
-        text = doc.page_content[:1000] + "..." if len(doc.page_content) > 1000 else doc.page_content
-        doc_texts.append(f"Documento {i+1}:\n{text}")
+    # Repartir el presupuesto de tokens y quedarse con la parte más relevante de cada documento
+    texts = fit_to_budget([doc.page_content for doc in documents], query, RERANK_TOKEN_BUDGET,
+                          minimum=RERANK_MIN_DOC_TOKENS)
+    doc_texts = [f"Documento {i+1}:\n{text}" for i, text in enumerate(texts)]
     
     # Crear el prompt para evaluar la relevancia
     system_message = """Eres un experto en derecho tributario colombiano. Tu tarea es evaluar la relevancia de varios documentos para responder a una consulta específica.
@@ -62,15 +315,20 @@ Proporciona tu evaluación en formato JSON con la siguiente estructura:
     user_message = "Consulta: " + query + "\n\nDocumentos a evaluar:\n" + "\n\n".join(doc_texts) + "\n\nEvalúa la relevancia de cada documento para responder a la consulta. Proporciona tu evaluación en formato JSON."
     
     try:
-        # Llamar a la API de OpenAI
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.2
+        # Llamar a la API de OpenAI (con plazo, reintentos y duplicado tras el p95)
+        response = resilience.call(
+            "rerank",
+            lambda timeout: client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": user_message}
+                ],
+                response_format={"type": "json_object"},
+                temperature=0.2,
+                timeout=timeout
+            ),
+            hedge=True
         )
         
         # Extraer las evaluaciones
@@ -100,7 +358,11 @@ Proporciona tu evaluación en formato JSON con la siguiente estructura:
             print(f"     Justificación: {item['justification']}")
         
         # Devolver los documentos reordenados
-        return [item["document"] for item in scored_docs[:top_k]]
+        return [
+            Document(page_content=item["document"].page_content,
+                     metadata={**item["document"].metadata, "rerank_score": item["score"]})
+            for item in scored_docs[:top_k]
+        ]
     
     except Exception as e:
         print(f"Error en el reranking: {str(e)}")
@@ -108,6 +370,14 @@ Proporciona tu evaluación en formato JSON con la siguiente estructura:
         return documents[:top_k]
 
 # Función para integrar el reranking en el flujo de recuperación
+def _select(documents: List[Document], top_k: int) -> List[Document]:
+    """
+    Reduce el pool a `top_k` documentos, con selección diversa si está activada.
+    """
+    if DIVERSITY:
+        return diversify(documents, top_k)
+    return documents[:top_k]
+
 def retrieve_with_reranking(query: str, retriever_func, top_k: int = 5, **kwargs):
     """
     Recupera documentos y aplica reranking para mejorar la relevancia.
@@ -121,10 +391,35 @@ def retrieve_with_reranking(query: str, retriever_func, top_k: int = 5, **kwargs
     Returns:
         Lista de documentos más relevantes después del reranking
     """
+    mode = (kwargs.pop("rerank_mode", None) or RERANK_MODE).lower()
+    pool_k = int(top_k * DIVERSITY_POOL + 0.5) if DIVERSITY else top_k
+    if mode == "local" or DIVERSITY:
+        # El reranking local y la selección diversa usan los vectores de los candidatos
+        kwargs.setdefault("include_values", True)
+    
     # Recuperar más documentos de los necesarios para tener un mejor pool para reranking
-    initial_docs = retriever_func(query, top_k=top_k*2, **kwargs)
+    initial_docs = retriever_func(query, top_k=top_k*RERANK_OVERFETCH, **kwargs)
+    
+    # Si la búsqueda léxica encontró la norma citada en la consulta, el orden de
+    # la fusión ya es fiable y no hace falta el reranking (un número suelto no basta)
+    if extract_references(query) and any(doc.metadata.get("exact_reference") for doc in initial_docs):
+        print("retrieve_with_reranking: Referencia exacta encontrada, se omite el reranking")
+        return strip_values(initial_docs[:top_k])
+    
+    if ADAPTIVE_RERANK:
+        decision = rerank_decision(initial_docs, top_k)
+        if decision.startswith("skip"):
+            saved = rerank_latency.estimate(mode)
+            saved_text = f"~{saved:.0f} ms ahorrados" if saved is not None else "sin estimación de ahorro"
+            print(f"retrieve_with_reranking: Decisión '{decision}', se omite el reranking ({mode}, {saved_text})")
+            return strip_values(_select(_top_by_score(initial_docs, pool_k), top_k))
+        if decision == "widen":
+            print(f"retrieve_with_reranking: Decisión 'widen', puntuaciones planas: se amplía el pool a {top_k*RERANK_WIDE_OVERFETCH}")
+            initial_docs = retriever_func(query, top_k=top_k*RERANK_WIDE_OVERFETCH, **kwargs)
+        else:
+            print("retrieve_with_reranking: Decisión 'rerank'")
     
     # Aplicar reranking
-    reranked_docs = rerank_documents(query, initial_docs, top_k=top_k)
+    reranked_docs = rerank_documents(query, initial_docs, top_k=pool_k, mode=mode)
     
-    return reranked_docs 
\ No newline at end of file
+    return strip_values(_select(reranked_docs, top_k)) 
\ No newline at end of file
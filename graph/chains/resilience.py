@@ -0,0 +1,417 @@
+"""
+Plazos, reintentos, solicitudes de cobertura (hedging) y circuit breakers para
+las llamadas externas (OpenAI y Pinecone).
+
+- Plazos: cada consulta del usuario tiene un presupuesto total de latencia
+  (`start_request`) y cada etapa un tope propio (STAGE_TIMEOUTS); una etapa
+  recibe el menor de los dos. Sin consulta en curso se aplica solo el tope.
+- Reintentos: solo ante errores transitorios (tiempo agotado, conexión, 429 o
+  5xx), con backoff exponencial con jitter y sin pasar del plazo de la etapa.
+- Hedging: para llamadas cortas e idempotentes (embeddings, reranking,
+  calificadores) se lanza un duplicado si la primera no respondió tras el p95
+  de latencia observado en la etapa; gana la primera respuesta.
+- Circuit breaker: tras varios fallos seguidos la etapa queda abierta durante
+  un tiempo y las llamadas van directamente a su ruta degradada (`fallback`),
+  por ejemplo reranking local en lugar del LLM.
+
+`acall` aplica la misma política a las llamadas asíncronas: los intentos son
+tareas del event loop, que sí se cancelan al vencer el plazo.
+"""
+
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import httpx
+import numpy as np
+import openai
+
+T = TypeVar("T")
+
+# Presupuesto total de latencia de una consulta (segundos)
+REQUEST_LATENCY_BUDGET = float(os.environ.get("REQUEST_LATENCY_BUDGET", "60"))
+# Tope por etapa (segundos)
+STAGE_TIMEOUTS: Dict[str, float] = {
+    "embeddings": float(os.environ.get("EMBEDDINGS_TIMEOUT", "8")),
+    "pinecone": float(os.environ.get("PINECONE_TIMEOUT", "8")),
+    "rerank": float(os.environ.get("RERANK_STAGE_TIMEOUT", "12")),
+    "generation": float(os.environ.get("GENERATION_TIMEOUT", "45")),
+    "graders": float(os.environ.get("GRADERS_TIMEOUT", "15")),
+}
+DEFAULT_STAGE_TIMEOUT = 10.0
+# Reintentos tras el primer intento y backoff (con jitter completo)
+RETRY_ATTEMPTS = int(os.environ.get("RESILIENCE_RETRIES", "2"))
+RETRY_BASE_DELAY = 0.25
+RETRY_MAX_DELAY = 2.0
+# Hedging: percentil de latencia tras el cual se lanza el duplicado
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.05
+# Retraso mientras no hay suficientes muestras
+HEDGE_DEFAULT_DELAYS: Dict[str, float] = {"embeddings": 1.0, "rerank": 3.0, "graders": 4.0}
+HEDGING = os.environ.get("HEDGING", "true").lower() == "true"
+# Circuit breaker: fallos seguidos para abrir y segundos hasta volver a probar
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", "5"))
+BREAKER_RESET = float(os.environ.get("BREAKER_RESET", "30"))
+RESILIENCE_MAX_WORKERS = int(os.environ.get("RESILIENCE_MAX_WORKERS", "16"))
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    El plazo de la etapa (o de la consulta) venció antes de obtener respuesta.
+    """
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    El circuit breaker de la etapa está abierto.
+    """
+
+
+class RequestBudget:
+    """
+    Presupuesto de latencia de una consulta del usuario.
+    """
+
+    def __init__(self, budget: float = REQUEST_LATENCY_BUDGET):
+        self.budget = budget
+        self.started = time.monotonic()
+
+    def remaining(self) -> float:
+        return self.budget - (time.monotonic() - self.started)
+
+
+_current_budget: contextvars.ContextVar = contextvars.ContextVar("request_budget", default=None)
+
+
+def start_request(budget: float = REQUEST_LATENCY_BUDGET) -> RequestBudget:
+    """
+    Inicia el presupuesto de latencia de una nueva consulta en el contexto actual.
+    """
+    request_budget = RequestBudget(budget)
+    _current_budget.set(request_budget)
+    return request_budget
+
+
+def stage_timeout(stage: str) -> float:
+    """
+    Segundos disponibles para una etapa: su tope, limitado por lo que quede del presupuesto de la consulta.
+    """
+    cap = STAGE_TIMEOUTS.get(stage, DEFAULT_STAGE_TIMEOUT)
+    request_budget = _current_budget.get()
+    if request_budget is None:
+        return cap
+    return max(0.0, min(cap, request_budget.remaining()))
+
+
+class LatencyTracker:
+    """
+    Latencias recientes de las llamadas exitosas por etapa, para calcular percentiles.
+    """
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, stage: str, q: float) -> Optional[float]:
+        with self._lock:
+            samples = list(self._samples.get(stage, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return float(np.percentile(samples, q))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker de tres estados (cerrado, abierto, semiabierto) por etapa.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURES, reset_timeout: float = BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Indica si se puede llamar a la etapa; pasado `reset_timeout` deja pasar llamadas de prueba.
+        """
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = "half_open"
+                print(f"CircuitBreaker: '{self.name}' semiabierto, probando de nuevo")
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                print(f"CircuitBreaker: '{self.name}' cerrado")
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                print(f"CircuitBreaker: '{self.name}' abierto tras {self.failures} fallos")
+
+
+latency_tracker = LatencyTracker()
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=RESILIENCE_MAX_WORKERS, thread_name_prefix="resilience")
+
+
+def get_breaker(stage: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if stage not in _breakers:
+            _breakers[stage] = CircuitBreaker(stage)
+        return _breakers[stage]
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Errores transitorios: tiempo agotado, fallo de conexión, 429 o 5xx.
+    """
+    if isinstance(error, (TimeoutError, ConnectionError, httpx.TransportError, openai.APIConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+
+def hedge_delay(stage: str) -> float:
+    """
+    Espera antes de lanzar el duplicado: el p95 de la etapa, o un valor por defecto sin muestras suficientes.
+    """
+    observed = latency_tracker.percentile(stage, HEDGE_PERCENTILE)
+    if observed is None:
+        return HEDGE_DEFAULT_DELAYS.get(stage, STAGE_TIMEOUTS.get(stage, DEFAULT_STAGE_TIMEOUT) / 2)
+    return max(HEDGE_MIN_DELAY, observed)
+
+
+def _attempt(stage: str, fn: Callable[[float], T], timeout: float, hedge: bool) -> T:
+    """
+    Un intento (con duplicado opcional) acotado a `timeout` segundos.
+    """
+    start = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    futures = [_executor.submit(fn, timeout)]
+    if hedge:
+        done, _ = wait(futures, timeout=min(hedge_delay(stage), timeout))
+        remaining = deadline - time.monotonic()
+        if not done and remaining > 0:
+            print(f"resilience: '{stage}' sin respuesta tras {time.perf_counter() - start:.2f} s, se lanza un duplicado")
+            futures.append(_executor.submit(fn, remaining))
+    errors = []
+    pending = set(futures)
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                errors.append(e)
+                continue
+            for other in pending:
+                other.cancel()
+            latency_tracker.record(stage, time.perf_counter() - start)
+            return result
+    for future in pending:
+        future.cancel()
+    if errors and not pending:
+        raise errors[-1]
+    raise DeadlineExceeded(f"'{stage}' sin respuesta en {timeout:.1f} s")
+
+
+def call(stage: str, fn: Callable[[float], T], hedge: bool = False, retries: int = RETRY_ATTEMPTS,
+         fallback: Optional[Callable[[Exception], T]] = None) -> T:
+    """
+    Ejecuta `fn(timeout)` con el plazo, los reintentos, el hedging y el circuit breaker de la etapa.
+
+    `fn` recibe los segundos disponibles para el intento (para pasarlos como
+    timeout al cliente). Si la etapa falla o su circuito está abierto se usa
+    `fallback(error)` cuando se indica; si no, se propaga el error.
+    """
+    breaker = get_breaker(stage)
+    if not breaker.allow():
+        error = CircuitOpenError(f"Circuito abierto para '{stage}'")
+        if fallback is None:
+            raise error
+        print(f"resilience: circuito abierto para '{stage}', se usa la ruta degradada")
+        return fallback(error)
+
+    stage_deadline = time.monotonic() + stage_timeout(stage)
+    last_error: Exception = DeadlineExceeded(f"'{stage}' sin tiempo disponible en el presupuesto de la consulta")
+    for attempt in range(retries + 1):
+        remaining = stage_deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            result = _attempt(stage, fn, remaining, hedge and HEDGING)
+        except Exception as e:
+            last_error = e
+            if not is_retryable(e):
+                break
+            breaker.record_failure()
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+            if attempt == retries or not breaker.allow() or delay >= stage_deadline - time.monotonic():
+                break
+            print(f"resilience: '{stage}' falló ({type(e).__name__}), reintento {attempt + 1} en {delay:.2f} s")
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
+
+    if fallback is None:
+        raise last_error
+    print(f"resilience: '{stage}' falló ({type(last_error).__name__}: {last_error}), se usa la ruta degradada")
+    return fallback(last_error)
+
+
+async def _aattempt(stage: str, fn: Callable[[float], Awaitable[T]], timeout: float, hedge: bool) -> T:
+    """
+    Versión asíncrona de `_attempt`: los intentos pendientes se cancelan al terminar.
+    """
+    start = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    tasks = [asyncio.ensure_future(fn(timeout))]
+    if hedge:
+        done, _ = await asyncio.wait(tasks, timeout=min(hedge_delay(stage), timeout))
+        remaining = deadline - time.monotonic()
+        if not done and remaining > 0:
+            print(f"resilience: '{stage}' sin respuesta tras {time.perf_counter() - start:.2f} s, se lanza un duplicado")
+            tasks.append(asyncio.ensure_future(fn(remaining)))
+    errors = []
+    pending = set(tasks)
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    errors.append(task.exception())
+                    continue
+                latency_tracker.record(stage, time.perf_counter() - start)
+                return task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+    if errors and not pending:
+        raise errors[-1]
+    raise DeadlineExceeded(f"'{stage}' sin respuesta en {timeout:.1f} s")
+
+
+async def acall(stage: str, fn: Callable[[float], Awaitable[T]], hedge: bool = False, retries: int = RETRY_ATTEMPTS,
+                fallback: Optional[Callable[[Exception], T]] = None) -> T:
+    """
+    Versión asíncrona de `call`: `fn(timeout)` devuelve un awaitable.
+
+    Comparte con `call` los plazos, el circuit breaker y las latencias de la
+    etapa; las esperas entre reintentos no bloquean el event loop.
+    """
+    breaker = get_breaker(stage)
+    if not breaker.allow():
+        error = CircuitOpenError(f"Circuito abierto para '{stage}'")
+        if fallback is None:
+            raise error
+        print(f"resilience: circuito abierto para '{stage}', se usa la ruta degradada")
+        return fallback(error)
+
+    stage_deadline = time.monotonic() + stage_timeout(stage)
+    last_error: Exception = DeadlineExceeded(f"'{stage}' sin tiempo disponible en el presupuesto de la consulta")
+    for attempt in range(retries + 1):
+        remaining = stage_deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            result = await _aattempt(stage, fn, remaining, hedge and HEDGING)
+        except Exception as e:
+            last_error = e
+            if not is_retryable(e):
+                break
+            breaker.record_failure()
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+            if attempt == retries or not breaker.allow() or delay >= stage_deadline - time.monotonic():
+                break
+            print(f"resilience: '{stage}' falló ({type(e).__name__}), reintento {attempt + 1} en {delay:.2f} s")
+            await asyncio.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
+
+    if fallback is None:
+        raise last_error
+    print(f"resilience: '{stage}' falló ({type(last_error).__name__}: {last_error}), se usa la ruta degradada")
+    return fallback(last_error)
+
+
+def with_timeout(runnable, timeout: float):
+    """
+    Copia del Runnable cuyas llamadas a modelos de chat llevan `timeout` (segundos) como plazo HTTP.
+
+    Recorre las secuencias (`prompt | llm.with_structured_output(...)`) y enlaza
+    `timeout` en cada modelo de chat, de modo que la solicitud termina en el plazo
+    del intento en lugar de seguir ocupando un hilo del pool.
+    """
+    from langchain_core.language_models import BaseChatModel
+    from langchain_core.runnables import RunnableBinding, RunnableSequence
+
+    if isinstance(runnable, RunnableSequence):
+        return RunnableSequence(*(with_timeout(step, timeout) for step in runnable.steps))
+    if isinstance(runnable, BaseChatModel) or (
+            isinstance(runnable, RunnableBinding) and isinstance(runnable.bound, BaseChatModel)):
+        return runnable.bind(timeout=timeout)
+    return runnable
+
+
+def resilient_runnable(stage: str, runnable, hedge: bool = True, fallback: Optional[Callable[[Any], Any]] = None):
+    """
+    Envuelve un Runnable de LangChain para que `invoke` pase por `call`.
+
+    Cada intento usa su plazo como timeout de la solicitud (ver `with_timeout`).
+    `fallback(inputs)` produce la salida degradada si la etapa falla.
+    """
+    from langchain_core.runnables import RunnableLambda
+
+    def invoke(inputs):
+        return call(stage, lambda timeout: with_timeout(runnable, timeout).invoke(inputs), hedge=hedge,
+                    fallback=(lambda error: fallback(inputs)) if fallback is not None else None)
+
+    return RunnableLambda(invoke, name=f"resilient_{stage}")
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Estado de los circuit breakers y p95 de latencia por etapa.
+    """
+    return {
+        stage: {
+            "state": breaker.state,
+            "failures": breaker.failures,
+            "p95_s": latency_tracker.percentile(stage, HEDGE_PERCENTILE),
+        }
+        for stage, breaker in list(_breakers.items())
+    }
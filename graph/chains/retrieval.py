@@ -1,10 +1,21 @@
+import asyncio
 import os
-from typing import List
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, NamedTuple, Optional, Sequence
 from dotenv import load_dotenv
-import pinecone
-from openai import OpenAI
 from langchain_core.documents import Document
 from langchain_openai import OpenAIEmbeddings
+import numpy as np
+
+from graph.chains.clients import openai_clients
+from graph.chains.embedding_cache import EmbeddingCache
+from graph.chains.fusion import reciprocal_rank_fusion
+from graph.chains.lexical import get_lexical_index
+from graph.chains.pinecone_pool import pinecone_pool
+from graph.chains import resilience
+from graph.chains.semantic_cache import semantic_cache
+from graph.chains.tokens import count_tokens, truncate_to_tokens
+from graph.chains.vectorstores import get_vector_backend
 
 # Cargar variables de entorno
 load_dotenv()
@@ -16,6 +27,16 @@ OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 EMBEDDING_MODEL = "text-embedding-3-large"
 TOP_K = 5  # Número de resultados a recuperar
 
+# Límites del endpoint de embeddings de OpenAI para solicitudes por lotes
+EMBEDDING_BATCH_MAX_INPUTS = 2048  # Textos por solicitud
+EMBEDDING_BATCH_MAX_TOKENS = 300000  # Tokens sumados por solicitud
+EMBEDDING_MAX_INPUT_TOKENS = 8191  # Tokens por texto
+EMBEDDING_MAX_WORKERS = int(os.environ.get("EMBEDDING_MAX_WORKERS", "4"))
+
+# Recuperación híbrida (BM25 + densa) cuando hay snapshot local del namespace
+HYBRID_RETRIEVAL = os.environ.get("HYBRID_RETRIEVAL", "true").lower() == "true"
+HYBRID_MAX_EXACT = 3  # Fragmentos con referencia exacta que se priorizan
+
 # Configuración específica para Renta
 RENTA_INDEX_NAME = "renta"
 RENTA_NAMESPACE = "renta"
@@ -55,230 +76,575 @@ CAMBIARIO_INDEX_NAME = "cambiario"
 CAMBIARIO_NAMESPACE = "cambiario"
 CAMBIARIO_TOP_K = 8  # Valor específico para Cambiario
 
-# Inicializar cliente de OpenAI
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Clientes de OpenAI (síncrono y asíncrono) sobre el pool compartido; el de
+# consultas deja los reintentos a la capa de resiliencia, el de lotes los conserva
+client = openai_clients.openai("embeddings", max_retries=0)
+batch_client = openai_clients.openai("embeddings_batch")
+async_client = openai_clients.async_openai("embeddings")
+
+# Caché de embeddings de consultas (memoria + disco), ligada al modelo de embeddings
+embedding_cache = EmbeddingCache(EMBEDDING_MODEL)
 
 def get_embedding(text: str) -> List[float]:
     """
-    Obtiene el embedding para un texto usando OpenAI.
+    Obtiene el embedding para un texto usando OpenAI, consultando primero la caché.
     """
-    response = client.embeddings.create(
-        input=[text],
+    cached = embedding_cache.get(text)
+    if cached is not None:
+        return cached
+    # Llamada corta e idempotente: con plazo, reintentos y duplicado tras el p95
+    response = resilience.call(
+        "embeddings",
+        lambda timeout: client.embeddings.create(input=[text], model=EMBEDDING_MODEL, timeout=timeout),
+        hedge=True
+    )
+    embedding = response.data[0].embedding
+    embedding_cache.put(text, embedding)
+    return embedding
+
+async def aget_embedding(text: str) -> List[float]:
+    """
+    Versión asíncrona de get_embedding, con la misma caché.
+    """
+    cached = embedding_cache.get(text)
+    if cached is not None:
+        return cached
+    # Misma política que get_embedding: plazo, reintentos, circuit breaker y duplicado tras el p95
+    response = await resilience.acall(
+        "embeddings",
+        lambda timeout: async_client.embeddings.create(input=[text], model=EMBEDDING_MODEL, timeout=timeout),
+        hedge=True
+    )
+    embedding = response.data[0].embedding
+    embedding_cache.put(text, embedding)
+    return embedding
+
+def _embedding_batches(texts: List[str]) -> List[List[str]]:
+    """
+    Agrupa textos en lotes que respetan los límites de textos y tokens por solicitud.
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for text in texts:
+        tokens = min(count_tokens(text, EMBEDDING_MODEL), EMBEDDING_MAX_INPUT_TOKENS)
+        if current and (len(current) >= EMBEDDING_BATCH_MAX_INPUTS
+                        or current_tokens + tokens > EMBEDDING_BATCH_MAX_TOKENS):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def _embed_batch(texts: List[str]) -> List[List[float]]:
+    """
+    Obtiene los embeddings de un lote en una sola solicitud, en el orden de entrada.
+    """
+    response = batch_client.embeddings.create(
+        input=[truncate_to_tokens(text, EMBEDDING_MAX_INPUT_TOKENS, EMBEDDING_MODEL) for text in texts],
         model=EMBEDDING_MODEL
     )
-    return response.data[0].embedding
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+def get_embeddings(texts: List[str], max_workers: int = EMBEDDING_MAX_WORKERS) -> List[List[float]]:
+    """
+    Obtiene los embeddings de varios textos con una solicitud por lote.
+
+    Los textos ya cacheados no se envían, los duplicados exactos se envían una
+    sola vez y los lotes se procesan en paralelo con un número acotado de
+    hilos. A diferencia de las consultas, aquí no se normaliza: fragmentos que
+    sólo difieren en mayúsculas o espacios reciben embeddings propios. El
+    resultado conserva el orden de `texts`.
+    """
+    results: List[List[float]] = [None] * len(texts)
+    pending: Dict[str, List[int]] = {}
+    unique_texts = []
+    for position, text in enumerate(texts):
+        cached = embedding_cache.get(text, exact=True)
+        if cached is not None:
+            results[position] = cached
+            continue
+        if text not in pending:
+            pending[text] = []
+            unique_texts.append(text)
+        pending[text].append(position)
+
+    if not unique_texts:
+        return results
+
+    batches = _embedding_batches(unique_texts)
+    print(f"get_embeddings: {len(unique_texts)} textos nuevos en {len(batches)} lotes "
+          f"({len(texts) - len(unique_texts)} desde caché o duplicados)")
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+        for batch, embeddings in zip(batches, executor.map(_embed_batch, batches)):
+            for text, embedding in zip(batch, embeddings):
+                embedding_cache.put(text, embedding, exact=True)
+                for position in pending[text]:
+                    results[position] = embedding
+    return results
 
 def initialize_pinecone(index_name):
     """
-    Inicializa la conexión con Pinecone para un índice específico.
+    Obtiene el handle de Pinecone para un índice específico desde el registro compartido.
     """
     try:
-        print(f"initialize_pinecone: Inicializando Pinecone con API_KEY={PINECONE_API_KEY[:4]}... y ENVIRONMENT={PINECONE_ENVIRONMENT}")
-        # Usar la API de Pinecone v6.x
-        pc = pinecone.Pinecone(api_key=PINECONE_API_KEY)
-        
-        # Verificar si el índice existe
-        indexes = pc.list_indexes()
-        existing_indexes = [index.name for index in indexes]
-        print(f"initialize_pinecone: Índices existentes: {existing_indexes}")
-        
-        if index_name not in existing_indexes:
-            print(f"initialize_pinecone: El índice {index_name} no existe.")
-            return None
-        
-        print(f"initialize_pinecone: Conectando al índice {index_name}")
-        return pc.Index(index_name)
+        # El registro reutiliza el cliente, el handle del índice y el listado de índices
+        return pinecone_pool.get_index(index_name)
     except Exception as e:
         print(f"Error al inicializar Pinecone: {str(e)}")
         import traceback
         traceback.print_exc()
         return None
 
-def query_pinecone(query: str, index_name=RENTA_INDEX_NAME, namespace=RENTA_NAMESPACE, top_k: int = TOP_K):
+def _matches_to_documents(matches, index_name: str, namespace: str) -> List[Document]:
     """
-    Consulta Pinecone para obtener documentos relevantes.
+    Convierte los resultados de Pinecone en documentos de Langchain.
     """
-    print(f"query_pinecone: Consultando Pinecone para: '{query}' en índice {index_name}, namespace {namespace}")
-    # Inicializar Pinecone
-    index = initialize_pinecone(index_name)
-    if not index:
-        print(f"query_pinecone: No se pudo inicializar Pinecone para el índice {index_name}")
-        return []
+    print(f"query_pinecone: Resultados obtenidos: {len(matches)}")
+    
+    # Imprimir información sobre los resultados
+    for i, match in enumerate(matches):
+        print(f"  Resultado {i+1}: score={match.score}, source={match.metadata.get('source', 'N/A')}")
     
+    # Determinar el prefijo según el namespace
+    if namespace == RENTA_NAMESPACE:
+        prefix = "pinecone_renta"
+    elif namespace == TIMBRE_NAMESPACE:
+        prefix = "pinecone_timbre"
+    elif namespace == DIANFULL_NAMESPACE:
+        prefix = "pinecone_dianfull"
+    else:
+        prefix = "pinecone_docs"
+    
+    documents = []
+    for i, match in enumerate(matches):
+        # Crear una fuente que sea claramente de Pinecone
+        original_source = match.metadata.get('source', f'Documento-Pinecone-{i+1}')
+            
+        # Reemplazar cualquier referencia a legal_docs con el prefijo correspondiente
+        if 'legal_docs' in original_source:
+            source = original_source.replace('legal_docs', prefix)
+        else:
+            source = f"{prefix}/{original_source}"
+            
+        doc = Document(
+            page_content=match.metadata.get('text', ''),
+            metadata={
+                'source': source,
+                'score': match.score,
+                'page': match.metadata.get('page', 0),
+                'id': match.id,
+                'index_name': index_name,
+                'namespace': namespace
+            }
+        )
+        values = getattr(match, 'values', None)
+        if values is not None and len(values):
+            # Vector del fragmento para el reranking local (ver graph/chains/local_rerank.py)
+            doc.metadata['values'] = np.asarray(values, dtype=np.float32)
+        documents.append(doc)
+    
+    print(f"query_pinecone: Documentos convertidos: {len(documents)}")
+    return documents
+
+def strip_values(documents: List[Document]) -> List[Document]:
+    """
+    Devuelve copias de los documentos sin el vector `metadata["values"]`.
+
+    Los vectores solo se usan durante el reranking; no se guardan en cachés ni
+    llegan a la generación.
+    """
+    if not any('values' in doc.metadata for doc in documents):
+        return documents
+    return [
+        Document(page_content=doc.page_content,
+                 metadata={key: value for key, value in doc.metadata.items() if key != 'values'})
+        for doc in documents
+    ]
+
+def _on_query_error(index_name: str, error: Exception) -> List[Document]:
+    """
+    Registra un error de consulta y devuelve una lista vacía.
+    """
+    print(f"Error al consultar el índice {index_name}: {str(error)}")
+    import traceback
+    traceback.print_exc()
+    return []
+
+def query_pinecone(query: str, index_name=RENTA_INDEX_NAME, namespace=RENTA_NAMESPACE, top_k: int = TOP_K,
+                   query_embedding: Optional[List[float]] = None, include_values: bool = False):
+    """
+    Consulta Pinecone para obtener documentos relevantes.
+
+    La búsqueda la resuelve el backend configurado (Pinecone o snapshots locales,
+    ver graph/chains/vectorstores.py). Si se pasa `query_embedding` se reutiliza
+    en lugar de calcularlo de nuevo. Con `include_values` cada documento lleva su
+    vector en `metadata["values"]` (salvo los servidos por la caché semántica).
+    """
+    backend = get_vector_backend()
+    print(f"query_pinecone: Consultando {backend.name} para: '{query}' en índice {index_name}, namespace {namespace}")
     try:
         # Obtener embedding para la consulta
-        print("query_pinecone: Obteniendo embedding para la consulta")
-        query_embedding = get_embedding(query)
-        
-        # Consultar Pinecone
-        print(f"query_pinecone: Consultando índice {index_name}, namespace '{namespace}'")
-        results = index.query(
-            vector=query_embedding,
-            top_k=top_k,
-            namespace=namespace,
-            include_metadata=True
-        )
-        
-        print(f"query_pinecone: Resultados obtenidos: {len(results.matches)}")
+        if query_embedding is None:
+            query_embedding = get_embedding(query)
         
-        # Imprimir información sobre los resultados
-        for i, match in enumerate(results.matches):
-            print(f"  Resultado {i+1}: score={match.score}, source={match.metadata.get('source', 'N/A')}")
-        
-        # Convertir resultados a documentos de Langchain
-        documents = []
-        for i, match in enumerate(results.matches):
-            # Crear una fuente que sea claramente de Pinecone
-            original_source = match.metadata.get('source', f'Documento-Pinecone-{i+1}')
-            
-            # Determinar el prefijo según el namespace
-            if namespace == RENTA_NAMESPACE:
-                prefix = "pinecone_renta"
-            elif namespace == TIMBRE_NAMESPACE:
-                prefix = "pinecone_timbre"
-            elif namespace == DIANFULL_NAMESPACE:
-                prefix = "pinecone_dianfull"
-            else:
-                prefix = "pinecone_docs"
-                
-            # Reemplazar cualquier referencia a legal_docs con el prefijo correspondiente
-            if 'legal_docs' in original_source:
-                source = original_source.replace('legal_docs', prefix)
-            else:
-                source = f"{prefix}/{original_source}"
-                
-            doc = Document(
-                page_content=match.metadata.get('text', ''),
-                metadata={
-                    'source': source,
-                    'score': match.score,
-                    'page': match.metadata.get('page', 0)
-                }
-            )
-            documents.append(doc)
+        # Responder desde la caché semántica si ya se hizo una consulta equivalente
+        cache_key = f"{index_name}/{namespace}"
+        cached = semantic_cache.lookup(cache_key, query_embedding, top_k)
+        if cached is not None:
+            return cached
         
-        print(f"query_pinecone: Documentos convertidos: {len(documents)}")
+        # Consultar el índice (con plazo y reintentos; el circuito abierto deja solo la búsqueda léxica)
+        matches = resilience.call(
+            "pinecone",
+            lambda timeout: backend.query(index_name, namespace, query_embedding, top_k, include_values, timeout=timeout)
+        )
+        documents = _matches_to_documents(matches, index_name, namespace)
+        if documents:
+            semantic_cache.store(cache_key, query_embedding, top_k, strip_values(documents))
         return documents
     except Exception as e:
-        print(f"Error al consultar Pinecone: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return []
+        return _on_query_error(index_name, e)
+
+async def aquery_pinecone(query: str, index_name=RENTA_INDEX_NAME, namespace=RENTA_NAMESPACE, top_k: int = TOP_K,
+                          query_embedding: Optional[List[float]] = None, include_values: bool = False):
+    """
+    Versión asíncrona de query_pinecone.
 
-def query_timbre(query: str, top_k: int = TIMBRE_TOP_K):
+    El embedding usa AsyncOpenAI y la consulta al backend se hace con su `aquery`
+    (Pinecone, con cliente bloqueante, se ejecuta en un hilo), de modo que el
+    event loop puede atender otras preguntas. Ambas llamadas usan los mismos
+    plazos, reintentos y circuit breakers que la versión síncrona (`resilience.acall`).
+    """
+    backend = get_vector_backend()
+    print(f"aquery_pinecone: Consultando {backend.name} para: '{query}' en índice {index_name}, namespace {namespace}")
+    try:
+        if query_embedding is None:
+            query_embedding = await aget_embedding(query)
+        cache_key = f"{index_name}/{namespace}"
+        cached = semantic_cache.lookup(cache_key, query_embedding, top_k)
+        if cached is not None:
+            return cached
+        matches = await resilience.acall(
+            "pinecone",
+            lambda timeout: backend.aquery(index_name, namespace, query_embedding, top_k, include_values, timeout=timeout)
+        )
+        documents = _matches_to_documents(matches, index_name, namespace)
+        if documents:
+            semantic_cache.store(cache_key, query_embedding, top_k, strip_values(documents))
+        return documents
+    except Exception as e:
+        return _on_query_error(index_name, e)
+
+def _lexical_plan(query: str, index_name: str, namespace: str, top_k: int):
+    """
+    Ejecuta la búsqueda léxica (si hay snapshot) y decide el top_k de la búsqueda densa.
+
+    Si algún fragmento contiene exactamente las referencias numéricas de la
+    consulta (o pertenece a una norma citada, según el índice de citas), la
+    búsqueda densa se reduce a la mitad.
+    """
+    lexical = get_lexical_index(index_name, namespace) if HYBRID_RETRIEVAL else None
+    if lexical is None:
+        return None, top_k
+    hits = lexical.search(query, top_k)
+    exact = sum(1 for hit in hits if hit.exact_reference)
+    cited = sum(1 for hit in hits if hit.origin == "citation")
+    dense_top_k = max(1, top_k // 2) if exact else top_k
+    print(f"query_hybrid: {len(hits)} resultados léxicos ({cited} por índice de citas, "
+          f"{exact} con referencia exacta), top_k denso = {dense_top_k}")
+    return hits, dense_top_k
+
+def _fuse_hybrid(dense: List[Document], hits, index_name: str, namespace: str, top_k: int) -> List[Document]:
+    """
+    Fusiona resultados densos y léxicos con RRF, priorizando las referencias exactas.
+    """
+    lexical_docs = _matches_to_documents([hit.match for hit in hits], index_name, namespace)
+    dense_values = {doc.metadata['id']: doc.metadata['values'] for doc in dense if 'values' in doc.metadata}
+    exact_docs = []
+    for doc, hit in zip(lexical_docs, hits):
+        if doc.metadata['id'] in dense_values:
+            doc.metadata['values'] = dense_values[doc.metadata['id']]
+        doc.metadata['retrieval'] = 'citation' if hit.origin == "citation" else 'lexical'
+        doc.metadata['lexical_score'] = hit.match.score
+        if hit.exact_reference and len(exact_docs) < HYBRID_MAX_EXACT:
+            doc.metadata['exact_reference'] = True
+            exact_docs.append(doc)
+    # Las referencias exactas forman una lista propia para que encabecen la fusión
+    return reciprocal_rank_fusion([exact_docs, dense, lexical_docs], top_k=top_k)
+
+def query_hybrid(query: str, index_name=RENTA_INDEX_NAME, namespace=RENTA_NAMESPACE, top_k: int = TOP_K,
+                 query_embedding: Optional[List[float]] = None, include_values: bool = False):
+    """
+    Búsqueda híbrida: BM25 sobre el snapshot local fusionado con query_pinecone.
+
+    Si el namespace no tiene snapshot local (o HYBRID_RETRIEVAL está desactivado)
+    equivale a query_pinecone. Los fragmentos con referencia exacta quedan
+    marcados con `metadata["exact_reference"]`.
+    """
+    hits, dense_top_k = _lexical_plan(query, index_name, namespace, top_k)
+    dense = query_pinecone(query, index_name=index_name, namespace=namespace, top_k=dense_top_k,
+                           query_embedding=query_embedding, include_values=include_values)
+    if not hits:
+        return dense
+    return _fuse_hybrid(dense, hits, index_name, namespace, top_k)
+
+async def aquery_hybrid(query: str, index_name=RENTA_INDEX_NAME, namespace=RENTA_NAMESPACE, top_k: int = TOP_K,
+                        query_embedding: Optional[List[float]] = None, include_values: bool = False):
+    """
+    Versión asíncrona de query_hybrid.
+
+    La búsqueda léxica (lectura del snapshot y construcción del índice BM25 en el
+    primer uso) es bloqueante y se ejecuta en un hilo para no detener el event loop.
+    """
+    hits, dense_top_k = await asyncio.to_thread(_lexical_plan, query, index_name, namespace, top_k)
+    dense = await aquery_pinecone(query, index_name=index_name, namespace=namespace, top_k=dense_top_k,
+                                  query_embedding=query_embedding, include_values=include_values)
+    if not hits:
+        return dense
+    return _fuse_hybrid(dense, hits, index_name, namespace, top_k)
+
+def query_renta(query: str, top_k: int = TOP_K, **kwargs):
+    """
+    Consulta específica para documentos de Renta.
+    """
+    return query_hybrid(query, index_name=RENTA_INDEX_NAME, namespace=RENTA_NAMESPACE, top_k=top_k, **kwargs)
+
+def query_timbre(query: str, top_k: int = TIMBRE_TOP_K, **kwargs):
     """
     Consulta específica para documentos de Timbre.
     """
-    return query_pinecone(query, index_name=TIMBRE_INDEX_NAME, namespace=TIMBRE_NAMESPACE, top_k=top_k)
+    return query_hybrid(query, index_name=TIMBRE_INDEX_NAME, namespace=TIMBRE_NAMESPACE, top_k=top_k, **kwargs)
 
-def query_dianfull(query: str, top_k: int = TOP_K):
+def query_dianfull(query: str, top_k: int = TOP_K, **kwargs):
     """
     Consulta específica para documentos de Dian Full.
     """
-    return query_pinecone(query, index_name=DIANFULL_INDEX_NAME, namespace=DIANFULL_NAMESPACE, top_k=top_k)
+    return query_hybrid(query, index_name=DIANFULL_INDEX_NAME, namespace=DIANFULL_NAMESPACE, top_k=top_k, **kwargs)
 
-def query_retencion(query: str, top_k: int = RETENCION_TOP_K):
+def query_retencion(query: str, top_k: int = RETENCION_TOP_K, **kwargs):
     """
     Consulta específica para documentos de Retención.
     """
-    return query_pinecone(query, index_name=RETENCION_INDEX_NAME, namespace=RETENCION_NAMESPACE, top_k=top_k)
+    return query_hybrid(query, index_name=RETENCION_INDEX_NAME, namespace=RETENCION_NAMESPACE, top_k=top_k, **kwargs)
 
-def query_iva(query: str, top_k: int = IVA_TOP_K):
+def query_iva(query: str, top_k: int = IVA_TOP_K, **kwargs):
     """
     Consulta específica para documentos de IVA.
     """
-    return query_pinecone(query, index_name=IVA_INDEX_NAME, namespace=IVA_NAMESPACE, top_k=top_k)
+    return query_hybrid(query, index_name=IVA_INDEX_NAME, namespace=IVA_NAMESPACE, top_k=top_k, **kwargs)
 
-def query_ipoconsumo(query: str, top_k: int = IPOCONSUMO_TOP_K):
+def query_ipoconsumo(query: str, top_k: int = IPOCONSUMO_TOP_K, **kwargs):
     """
     Consulta específica para documentos de Impuesto al Consumo.
     """
-    return query_pinecone(query, index_name=IPOCONSUMO_INDEX_NAME, namespace=IPOCONSUMO_NAMESPACE, top_k=top_k)
+    return query_hybrid(query, index_name=IPOCONSUMO_INDEX_NAME, namespace=IPOCONSUMO_NAMESPACE, top_k=top_k, **kwargs)
 
-def query_aduanas(query: str, top_k: int = ADUANAS_TOP_K):
+def query_aduanas(query: str, top_k: int = ADUANAS_TOP_K, **kwargs):
     """
     Consulta específica para documentos de Aduanas.
     """
-    return query_pinecone(query, index_name=ADUANAS_INDEX_NAME, namespace=ADUANAS_NAMESPACE, top_k=top_k)
+    return query_hybrid(query, index_name=ADUANAS_INDEX_NAME, namespace=ADUANAS_NAMESPACE, top_k=top_k, **kwargs)
 
-def query_cambiario(query: str, top_k: int = CAMBIARIO_TOP_K):
+def query_cambiario(query: str, top_k: int = CAMBIARIO_TOP_K, **kwargs):
     """
     Consulta específica para documentos de Cambiario.
     """
-    return query_pinecone(query, index_name=CAMBIARIO_INDEX_NAME, namespace=CAMBIARIO_NAMESPACE, top_k=top_k)
+    return query_hybrid(query, index_name=CAMBIARIO_INDEX_NAME, namespace=CAMBIARIO_NAMESPACE, top_k=top_k, **kwargs)
+
+async def aquery_renta(query: str, top_k: int = TOP_K, **kwargs):
+    """
+    Versión asíncrona de query_renta.
+    """
+    return await aquery_hybrid(query, index_name=RENTA_INDEX_NAME, namespace=RENTA_NAMESPACE, top_k=top_k, **kwargs)
+
+async def aquery_timbre(query: str, top_k: int = TIMBRE_TOP_K, **kwargs):
+    """
+    Versión asíncrona de query_timbre.
+    """
+    return await aquery_hybrid(query, index_name=TIMBRE_INDEX_NAME, namespace=TIMBRE_NAMESPACE, top_k=top_k, **kwargs)
+
+async def aquery_dianfull(query: str, top_k: int = TOP_K, **kwargs):
+    """
+    Versión asíncrona de query_dianfull.
+    """
+    return await aquery_hybrid(query, index_name=DIANFULL_INDEX_NAME, namespace=DIANFULL_NAMESPACE, top_k=top_k, **kwargs)
+
+async def aquery_retencion(query: str, top_k: int = RETENCION_TOP_K, **kwargs):
+    """
+    Versión asíncrona de query_retencion.
+    """
+    return await aquery_hybrid(query, index_name=RETENCION_INDEX_NAME, namespace=RETENCION_NAMESPACE, top_k=top_k, **kwargs)
+
+async def aquery_iva(query: str, top_k: int = IVA_TOP_K, **kwargs):
+    """
+    Versión asíncrona de query_iva.
+    """
+    return await aquery_hybrid(query, index_name=IVA_INDEX_NAME, namespace=IVA_NAMESPACE, top_k=top_k, **kwargs)
+
+async def aquery_ipoconsumo(query: str, top_k: int = IPOCONSUMO_TOP_K, **kwargs):
+    """
+    Versión asíncrona de query_ipoconsumo.
+    """
+    return await aquery_hybrid(query, index_name=IPOCONSUMO_INDEX_NAME, namespace=IPOCONSUMO_NAMESPACE, top_k=top_k, **kwargs)
+
+async def aquery_aduanas(query: str, top_k: int = ADUANAS_TOP_K, **kwargs):
+    """
+    Versión asíncrona de query_aduanas.
+    """
+    return await aquery_hybrid(query, index_name=ADUANAS_INDEX_NAME, namespace=ADUANAS_NAMESPACE, top_k=top_k, **kwargs)
+
+async def aquery_cambiario(query: str, top_k: int = CAMBIARIO_TOP_K, **kwargs):
+    """
+    Versión asíncrona de query_cambiario.
+    """
+    return await aquery_hybrid(query, index_name=CAMBIARIO_INDEX_NAME, namespace=CAMBIARIO_NAMESPACE, top_k=top_k, **kwargs)
+
+class TopicIndex(NamedTuple):
+    """
+    Índice y namespace de Pinecone asociados a un tema.
+    """
+    index_name: str
+    namespace: str
+    top_k: int
+
+# Registro de temas: nombre del tema -> índice de Pinecone.
+# Para añadir un tema basta con agregar una entrada aquí.
+TOPIC_REGISTRY: Dict[str, TopicIndex] = {
+    "Renta": TopicIndex(RENTA_INDEX_NAME, RENTA_NAMESPACE, TOP_K),
+    "Timbre": TopicIndex(TIMBRE_INDEX_NAME, TIMBRE_NAMESPACE, TIMBRE_TOP_K),
+    "Dian Full": TopicIndex(DIANFULL_INDEX_NAME, DIANFULL_NAMESPACE, TOP_K),
+    "Retención": TopicIndex(RETENCION_INDEX_NAME, RETENCION_NAMESPACE, RETENCION_TOP_K),
+    "IVA": TopicIndex(IVA_INDEX_NAME, IVA_NAMESPACE, IVA_TOP_K),
+    "Impuesto al Consumo": TopicIndex(IPOCONSUMO_INDEX_NAME, IPOCONSUMO_NAMESPACE, IPOCONSUMO_TOP_K),
+    "Aduanas": TopicIndex(ADUANAS_INDEX_NAME, ADUANAS_NAMESPACE, ADUANAS_TOP_K),
+    "Cambiario": TopicIndex(CAMBIARIO_INDEX_NAME, CAMBIARIO_NAMESPACE, CAMBIARIO_TOP_K),
+}
+
+# Índice usado cuando el tema no se especifica o no está registrado
+GENERAL_TOPIC = TopicIndex(RENTA_INDEX_NAME, RENTA_NAMESPACE, TOP_K)
+
+def resolve_topic(topic: Optional[str]) -> TopicIndex:
+    """
+    Devuelve el índice registrado para un tema, o el índice general si no está registrado.
+    """
+    if topic is not None and topic.strip() in TOPIC_REGISTRY:
+        return TOPIC_REGISTRY[topic.strip()]
+    return GENERAL_TOPIC
 
 class MultiRetriever:
     """
     Retriever que puede consultar diferentes fuentes según el tema.
     """
-    def invoke(self, query: str, topic: str = None):
+    def invoke(self, query: str, topic=None):
         """
         Invoca el retriever adecuado según el tema.
+
+        Si `topic` es una lista de temas se consultan todos en paralelo (ver fan_out).
         """
+        if isinstance(topic, (list, tuple)):
+            return self.fan_out(query, topic)
         print(f"MultiRetriever: Tema seleccionado = '{topic}'")
-        
-        # Asegurarnos de que topic es una cadena y hacer una comparación exacta
-        if topic is not None:
-            if topic.strip() == "Renta":
-                # Usar Pinecone para consultas de Renta
-                print("MultiRetriever: Usando Pinecone para consultas de Renta")
-                docs = query_pinecone(query)
-                print(f"MultiRetriever: Recuperados {len(docs)} documentos de Pinecone (Renta)")
-                return docs
-            elif topic.strip() == "Timbre":
-                # Usar Pinecone para consultas de Timbre
-                print("MultiRetriever: Usando Pinecone para consultas de Timbre")
-                docs = query_timbre(query)
-                print(f"MultiRetriever: Recuperados {len(docs)} documentos de Pinecone (Timbre)")
-                return docs
-            elif topic.strip() == "Dian Full":
-                # Usar Pinecone para consultas de Dian Full
-                print("MultiRetriever: Usando Pinecone para consultas de Dian Full")
-                docs = query_dianfull(query)
-                print(f"MultiRetriever: Recuperados {len(docs)} documentos de Pinecone (Dian Full)")
-                return docs
-            elif topic.strip() == "Retención":
-                # Usar Pinecone para consultas de Retención
-                print("MultiRetriever: Usando Pinecone para consultas de Retención")
-                docs = query_retencion(query)
-                print(f"MultiRetriever: Recuperados {len(docs)} documentos de Pinecone (Retención)")
-                return docs
-            elif topic.strip() == "IVA":
-                # Usar Pinecone para consultas de IVA
-                print("MultiRetriever: Usando Pinecone para consultas de IVA")
-                docs = query_iva(query)
-                print(f"MultiRetriever: Recuperados {len(docs)} documentos de Pinecone (IVA)")
-                return docs
-            elif topic.strip() == "Impuesto al Consumo":
-                # Usar Pinecone para consultas de Impuesto al Consumo
-                print("MultiRetriever: Usando Pinecone para consultas de Impuesto al Consumo")
-                docs = query_ipoconsumo(query)
-                print(f"MultiRetriever: Recuperados {len(docs)} documentos de Pinecone (Impuesto al Consumo)")
-                return docs
-            elif topic.strip() == "Aduanas":
-                # Usar Pinecone para consultas de Aduanas
-                print("MultiRetriever: Usando Pinecone para consultas de Aduanas")
-                docs = query_aduanas(query)
-                print(f"MultiRetriever: Recuperados {len(docs)} documentos de Pinecone (Aduanas)")
-                return docs
-            elif topic.strip() == "Cambiario":
-                # Usar Pinecone para consultas de Cambiario
-                print("MultiRetriever: Usando Pinecone para consultas de Cambiario")
-                docs = query_cambiario(query)
-                print(f"MultiRetriever: Recuperados {len(docs)} documentos de Pinecone (Cambiario)")
-                return docs
+        config = resolve_topic(topic)
+        label = topic.strip() if config is not GENERAL_TOPIC else "General"
+        if config is GENERAL_TOPIC:
+            print("MultiRetriever: Tema no reconocido o no especificado, usando Pinecone con índice general")
+        docs = query_hybrid(query, index_name=config.index_name, namespace=config.namespace, top_k=config.top_k)
+        print(f"MultiRetriever: Recuperados {len(docs)} documentos de Pinecone ({label})")
+        return docs
+
+    async def ainvoke(self, query: str, topic=None):
+        """
+        Versión asíncrona de invoke.
+        """
+        if isinstance(topic, (list, tuple)):
+            return await self.afan_out(query, topic)
+        print(f"MultiRetriever: Tema seleccionado = '{topic}' (async)")
+        config = resolve_topic(topic)
+        label = topic.strip() if config is not GENERAL_TOPIC else "General"
+        if config is GENERAL_TOPIC:
+            print("MultiRetriever: Tema no reconocido o no especificado, usando Pinecone con índice general")
+        docs = await aquery_hybrid(query, index_name=config.index_name, namespace=config.namespace, top_k=config.top_k)
+        print(f"MultiRetriever: Recuperados {len(docs)} documentos de Pinecone ({label})")
+        return docs
+
+    def fan_out(self, query: str, topics: Sequence[str], top_k: Optional[int] = None,
+                timeout: Optional[float] = None) -> List[Document]:
+        """
+        Consulta varios temas en paralelo y fusiona los resultados.
+
+        El embedding de la consulta se calcula una sola vez y se reutiliza en
+        todos los índices; la latencia total es la del índice más lento (o
+        `timeout`, un único plazo para todos, descartando los que no respondan a
+        tiempo). Los resultados se combinan con Reciprocal Rank Fusion y se
+        eliminan las fuentes duplicadas.
+        """
+        configs = list(dict.fromkeys(resolve_topic(topic) for topic in topics))
+        if not configs:
+            return []
+        if top_k is None:
+            top_k = max(config.top_k for config in configs)
+        print(f"MultiRetriever: Fan-out a {len(configs)} índices: {[config.index_name for config in configs]}")
+        query_embedding = get_embedding(query)
+
+        executor = ThreadPoolExecutor(max_workers=len(configs))
+        try:
+            futures = [
+                executor.submit(query_hybrid, query, config.index_name, config.namespace,
+                                config.top_k, query_embedding)
+                for config in configs
+            ]
+            # Un solo plazo para todos los índices (no uno por índice)
+            done, _ = wait(futures, timeout=timeout)
+            ranked_lists = []
+            for config, future in zip(configs, futures):
+                if future not in done:
+                    print(f"MultiRetriever: Se descarta el índice {config.index_name}: sin respuesta en {timeout} s")
+                    continue
+                try:
+                    ranked_lists.append(future.result())
+                except Exception as e:
+                    print(f"MultiRetriever: Se descarta el índice {config.index_name}: {str(e) or type(e).__name__}")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        docs = reciprocal_rank_fusion(ranked_lists, top_k=top_k)
+        print(f"MultiRetriever: Recuperados {len(docs)} documentos fusionados de {len(ranked_lists)} índices")
+        return docs
+
+    async def afan_out(self, query: str, topics: Sequence[str], top_k: Optional[int] = None,
+                       timeout: Optional[float] = None) -> List[Document]:
+        """
+        Versión asíncrona de fan_out.
+        """
+        configs = list(dict.fromkeys(resolve_topic(topic) for topic in topics))
+        if not configs:
+            return []
+        if top_k is None:
+            top_k = max(config.top_k for config in configs)
+        print(f"MultiRetriever: Fan-out a {len(configs)} índices: {[config.index_name for config in configs]} (async)")
+        query_embedding = await aget_embedding(query)
+
+        async def run(config: TopicIndex):
+            return await asyncio.wait_for(
+                aquery_hybrid(query, config.index_name, config.namespace, config.top_k, query_embedding),
+                timeout=timeout,
+            )
+
+        results = await asyncio.gather(*(run(config) for config in configs), return_exceptions=True)
+        ranked_lists = []
+        for config, result in zip(configs, results):
+            if isinstance(result, BaseException):
+                print(f"MultiRetriever: Se descarta el índice {config.index_name}: {str(result) or type(result).__name__}")
             else:
-                # Para otros temas usar Pinecone con el índice general
-                print("MultiRetriever: Tema no reconocido, usando Pinecone con índice general")
-                docs = query_pinecone(query)
-                print(f"MultiRetriever: Recuperados {len(docs)} documentos de Pinecone (General)")
-                return docs
-        else:
-            # Si no se especifica tema, usar Pinecone con el índice general
-            print("MultiRetriever: No se especificó tema, usando Pinecone con índice general")
-            docs = query_pinecone(query)
-            print(f"MultiRetriever: Recuperados {len(docs)} documentos de Pinecone (General)")
-            return docs
+                ranked_lists.append(result)
+
+        docs = reciprocal_rank_fusion(ranked_lists, top_k=top_k)
+        print(f"MultiRetriever: Recuperados {len(docs)} documentos fusionados de {len(ranked_lists)} índices")
+        return docs
 
 # Crear un retriever basado en MultiRetriever
 retriever = MultiRetriever() 
@@ -1,7 +1,8 @@
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
-from langchain_core.runnables import RunnableSequence
-from langchain_openai import ChatOpenAI
+from langchain_core.runnables import Runnable
+from graph.chains.clients import openai_clients
+from graph.chains.resilience import resilient_runnable
 import os
 from dotenv import load_dotenv
 
@@ -16,7 +17,7 @@ if not openai_api_key:
 class GradeDocuments(BaseModel):
     binary_score: bool = Field(description="Documents are helpful for answering the query, 'yes' or 'no'")
 
-llm = ChatOpenAI(temperature=0, model="gpt-3.5-turbo", api_key=openai_api_key)
+llm = openai_clients.chat("retrieval_grader", model="gpt-3.5-turbo", temperature=0, max_retries=0)
 structured_llm_grader = llm.with_structured_output(GradeDocuments, method="function_calling")
 
 system = """You are a grader assessing whether a set of documents are helpful for answering a question. \n 
@@ -28,4 +29,7 @@ retrieval_prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-retrieval_grader: RunnableSequence = retrieval_prompt | structured_llm_grader
+# Si el calificador no responde a tiempo (o su circuito está abierto) se conservan los documentos
+retrieval_grader: Runnable = resilient_runnable(
+    "graders", retrieval_prompt | structured_llm_grader, fallback=lambda inputs: GradeDocuments(binary_score=True)
+)
@@ -1,7 +1,8 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from pydantic import BaseModel, Field
-from langchain_openai import ChatOpenAI
+from graph.chains.clients import openai_clients
+from graph.chains.resilience import resilient_runnable
 import os
 from dotenv import load_dotenv
 
@@ -16,7 +17,7 @@ if not openai_api_key:
 class RouteQuery(BaseModel):
     destination: str = Field(description="The final topic the query is about")
 
-llm = ChatOpenAI(temperature=0, model="gpt-3.5-turbo", api_key=openai_api_key)
+llm = openai_clients.chat("router", model="gpt-3.5-turbo", temperature=0, max_retries=0)
 structured_llm_router = llm.with_structured_output(RouteQuery, method="function_calling")
 
 system = """You are a routing assistant for a tax consultation firm.
@@ -31,4 +32,7 @@ router_prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-router = router_prompt | structured_llm_router
+# Si el router no responde a tiempo se usa la ruta general
+router = resilient_runnable(
+    "graders", router_prompt | structured_llm_router, fallback=lambda inputs: RouteQuery(destination="general")
+)
@@ -0,0 +1,158 @@
+"""
+Caché semántica de resultados de Pinecone.
+
+Guarda los embeddings de las consultas recientes en una matriz NumPy contigua por
+namespace y responde desde la caché cuando una consulta nueva tiene una similitud
+coseno con alguna anterior por encima del umbral configurado. Así, preguntas que
+solo cambian la redacción no repiten la consulta a Pinecone.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "512"))
+SEMANTIC_CACHE_TTL = float(os.environ.get("SEMANTIC_CACHE_TTL", "3600"))
+# Filas reservadas inicialmente por namespace; la matriz se duplica hasta el máximo
+INITIAL_CAPACITY = 64
+
+
+def _copy_documents(documents: List[Document]) -> List[Document]:
+    return [Document(page_content=doc.page_content, metadata=dict(doc.metadata)) for doc in documents]
+
+
+class _NamespaceEntries:
+    """
+    Entradas de un namespace: matriz de embeddings normalizados y datos por fila.
+    """
+
+    def __init__(self, dim: int, capacity: int):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.valid = np.zeros(capacity, dtype=bool)
+        self.stored_at = np.zeros(capacity, dtype=np.float64)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.top_k = np.zeros(capacity, dtype=np.int32)
+        self.documents: List[Optional[List[Document]]] = [None] * capacity
+
+    @property
+    def capacity(self) -> int:
+        return self.vectors.shape[0]
+
+    def grow(self, capacity: int):
+        extra = capacity - self.capacity
+        self.vectors = np.vstack([self.vectors, np.zeros((extra, self.vectors.shape[1]), dtype=np.float32)])
+        self.valid = np.concatenate([self.valid, np.zeros(extra, dtype=bool)])
+        self.stored_at = np.concatenate([self.stored_at, np.zeros(extra)])
+        self.last_used = np.concatenate([self.last_used, np.zeros(extra)])
+        self.top_k = np.concatenate([self.top_k, np.zeros(extra, dtype=np.int32)])
+        self.documents.extend([None] * extra)
+
+
+class SemanticQueryCache:
+    """
+    Caché de resultados por similitud de consulta, con límite por namespace, LRU y TTL.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES, ttl: float = SEMANTIC_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._namespaces: Dict[str, _NamespaceEntries] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(embedding) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        return vector / norm
+
+    def lookup(self, namespace: str, embedding, top_k: int) -> Optional[List[Document]]:
+        """
+        Devuelve los documentos de la consulta cacheada más parecida, o None si ninguna supera el umbral.
+
+        Solo se consideran entradas que guardaron al menos `top_k` resultados.
+        """
+        if self.max_entries <= 0:
+            return None
+        vector = self._normalize(embedding)
+        with self._lock:
+            entries = self._namespaces.get(namespace)
+            if vector is None or entries is None or entries.vectors.shape[1] != vector.shape[0]:
+                self.misses += 1
+                return None
+            now = time.monotonic()
+            entries.valid &= (now - entries.stored_at) <= self.ttl
+            similarities = entries.vectors @ vector
+            usable = entries.valid & (entries.top_k >= top_k)
+            similarities = np.where(usable, similarities, -np.inf)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            entries.last_used[best] = now
+            self.hits += 1
+            print(f"SemanticQueryCache: Acierto en {namespace} (similitud {similarities[best]:.3f})")
+            return _copy_documents(entries.documents[best][:top_k])
+
+    def store(self, namespace: str, embedding, top_k: int, documents: List[Document]):
+        """
+        Guarda los documentos recuperados para una consulta, desalojando la entrada menos usada si hace falta.
+        """
+        if self.max_entries <= 0:
+            return
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+        with self._lock:
+            entries = self._namespaces.get(namespace)
+            if entries is None or entries.vectors.shape[1] != vector.shape[0]:
+                entries = _NamespaceEntries(vector.shape[0], min(INITIAL_CAPACITY, self.max_entries))
+                self._namespaces[namespace] = entries
+            free = np.flatnonzero(~entries.valid)
+            if free.size:
+                slot = int(free[0])
+            elif entries.capacity < self.max_entries:
+                slot = entries.capacity
+                entries.grow(min(entries.capacity * 2, self.max_entries))
+            else:
+                slot = int(np.argmin(entries.last_used))
+            now = time.monotonic()
+            entries.vectors[slot] = vector
+            entries.valid[slot] = True
+            entries.stored_at[slot] = now
+            entries.last_used[slot] = now
+            entries.top_k[slot] = top_k
+            entries.documents[slot] = _copy_documents(documents)
+
+    def invalidate(self, namespace: Optional[str] = None):
+        """
+        Descarta las entradas de un namespace, o de todos si no se indica.
+        """
+        with self._lock:
+            if namespace is None:
+                self._namespaces.clear()
+            else:
+                self._namespaces.pop(namespace, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": int(sum(entries.valid.sum() for entries in self._namespaces.values())),
+                "namespaces": len(self._namespaces),
+            }
+
+
+# Caché compartida por query_pinecone y aquery_pinecone
+semantic_cache = SemanticQueryCache()
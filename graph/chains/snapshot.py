@@ -0,0 +1,304 @@
+"""
+Exporta y sincroniza snapshots locales de namespaces de Pinecone.
+
+El snapshot (ver graph/chains/vectorstores.py) contiene los vectores en un
+bloque `.npy`, los metadatos (`text`, `source`, `page` y el JSON completo) en una
+tabla SQLite, el índice de referencias normativas (ver graph/chains/legal_refs.py)
+y un manifiesto versionado. La versión es un hash del contenido,
+así que solo cambia cuando cambian los vectores o los metadatos, y las cachés
+que la usan como clave se invalidan correctamente.
+
+Uso:
+    python -m graph.chains.snapshot export --index iva
+    python -m graph.chains.snapshot export --index iva --full --dtype float16
+    python -m graph.chains.snapshot export --all
+    python -m graph.chains.snapshot info --index iva
+
+Por defecto la sincronización es incremental: se listan los ids del namespace y
+solo se descargan los nuevos (los eliminados se quitan). Con `--full` se
+descargan todos y se comparan los hashes para detectar también actualizaciones.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from graph.chains.legal_refs import CITATIONS_FILE, CitationIndex
+from graph.chains.pinecone_pool import pinecone_pool
+from graph.chains.vectorstores import (
+    MANIFEST_FILE,
+    METADATA_FILE,
+    VECTOR_STORE_DIR,
+    VECTORS_FILE,
+    read_manifest,
+    snapshot_data_path,
+    snapshot_path,
+)
+
+FETCH_BATCH_SIZE = 100
+
+
+def content_hash(values: List[float], metadata: Dict[str, Any]) -> str:
+    """
+    Hash estable del contenido de un vector (valores en float32 y metadatos).
+    """
+    digest = hashlib.sha256()
+    digest.update(np.asarray(values, dtype=np.float32).tobytes())
+    digest.update(json.dumps(metadata, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def snapshot_content_version(hashes: Dict[str, str]) -> str:
+    """
+    Versión del snapshot: hash de los pares (id, hash) ordenados por id.
+    """
+    digest = hashlib.sha256()
+    for chunk_id in sorted(hashes):
+        digest.update(f"{chunk_id}:{hashes[chunk_id]}\n".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def list_ids(index, namespace: str) -> List[str]:
+    """
+    Lista todos los ids del namespace, página por página.
+    """
+    ids = []
+    for page in index.list(namespace=namespace):
+        ids.extend(page)
+    return ids
+
+
+def fetch_vectors(index, namespace: str, ids: List[str],
+                  batch_size: int = FETCH_BATCH_SIZE) -> Dict[str, Tuple[List[float], Dict[str, Any]]]:
+    """
+    Descarga valores y metadatos de los ids indicados, en lotes.
+    """
+    fetched = {}
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        response = index.fetch(ids=batch, namespace=namespace)
+        for chunk_id, vector in response.vectors.items():
+            fetched[chunk_id] = (list(vector.values), dict(vector.metadata or {}))
+        print(f"snapshot: Descargados {min(start + batch_size, len(ids))}/{len(ids)} vectores")
+    return fetched
+
+
+def _read_manifest_file(path: str) -> Optional[Dict[str, Any]]:
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_snapshot(path: str) -> Dict[str, Tuple[np.ndarray, Dict[str, Any], str]]:
+    """
+    Carga un snapshot existente como {id: (vector, metadata, hash)}.
+    """
+    manifest = _read_manifest_file(path)
+    if manifest is None:
+        return {}
+    data_path = snapshot_data_path(path, manifest)
+    vectors = np.load(os.path.join(data_path, VECTORS_FILE), mmap_mode="r")
+    conn = sqlite3.connect(os.path.join(data_path, METADATA_FILE))
+    try:
+        rows = conn.execute("SELECT row, id, metadata, hash FROM chunks").fetchall()
+    finally:
+        conn.close()
+    return {
+        chunk_id: (np.asarray(vectors[row], dtype=np.float32), json.loads(metadata or "{}"), chunk_hash)
+        for row, chunk_id, metadata, chunk_hash in rows
+    }
+
+
+def write_snapshot(path: str, entries: Dict[str, Tuple[Any, Dict[str, Any], str]],
+                   manifest: Dict[str, Any], dtype: str = "float32"):
+    """
+    Escribe el snapshot en un subdirectorio nuevo y lo publica reemplazando el manifiesto.
+
+    Los datos (vectores, metadatos e índice de citas) van a un directorio propio
+    de esta escritura, que nadie lee hasta que el manifiesto apunta a él
+    (`data_dir`); el manifiesto se publica con un único `os.replace`, así que un
+    lector ve la versión anterior completa o la nueva completa. Se conserva el
+    directorio de la versión anterior (los lectores que ya leyeron su manifiesto
+    aún pueden abrirlo) y se eliminan los más antiguos.
+    """
+    os.makedirs(path, exist_ok=True)
+    previous = _read_manifest_file(path)
+    staging = tempfile.mkdtemp(prefix=f"{manifest.get('version', 'snapshot')}-", dir=path)
+    # mkdtemp crea el directorio solo para su dueño; los lectores pueden ser otro usuario
+    os.chmod(staging, 0o755)
+
+    ids = sorted(entries)
+    dim = manifest["dim"]
+    matrix = np.zeros((len(ids), dim), dtype=dtype)
+    for row, chunk_id in enumerate(ids):
+        matrix[row] = entries[chunk_id][0]
+    np.save(os.path.join(staging, VECTORS_FILE), matrix)
+
+    conn = sqlite3.connect(os.path.join(staging, METADATA_FILE))
+    try:
+        conn.execute(
+            "CREATE TABLE chunks (row INTEGER PRIMARY KEY, id TEXT UNIQUE, text TEXT, "
+            "source TEXT, page INTEGER, metadata TEXT, hash TEXT)"
+        )
+        conn.executemany(
+            "INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    row,
+                    chunk_id,
+                    entries[chunk_id][1].get("text", ""),
+                    entries[chunk_id][1].get("source", ""),
+                    entries[chunk_id][1].get("page", 0),
+                    json.dumps(entries[chunk_id][1], ensure_ascii=False, default=str),
+                    entries[chunk_id][2],
+                )
+                for row, chunk_id in enumerate(ids)
+            ],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    # Índice de referencias normativas precalculado para la búsqueda directa
+    CitationIndex.build(
+        ((row, entries[chunk_id][1].get("text", ""), entries[chunk_id][1].get("source", ""))
+         for row, chunk_id in enumerate(ids)),
+        version=manifest.get("version"),
+    ).save(staging)
+
+    manifest["data_dir"] = os.path.basename(staging)
+    manifest_tmp = os.path.join(path, MANIFEST_FILE + ".tmp")
+    with open(manifest_tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(manifest_tmp, os.path.join(path, MANIFEST_FILE))
+
+    # Limpieza: se conservan la versión nueva y la anterior
+    keep = {manifest["data_dir"], (previous or {}).get("data_dir")}
+    for name in os.listdir(path):
+        full = os.path.join(path, name)
+        if os.path.isdir(full) and name not in keep:
+            shutil.rmtree(full, ignore_errors=True)
+    if previous is not None and previous.get("data_dir"):
+        # Archivos del formato anterior (datos junto al manifiesto), ya sin lectores
+        for name in (VECTORS_FILE, METADATA_FILE, CITATIONS_FILE):
+            if os.path.exists(os.path.join(path, name)):
+                os.remove(os.path.join(path, name))
+
+
+def index_metric(index_name: str) -> str:
+    """
+    Métrica del índice en Pinecone (cosine por defecto si no se puede consultar).
+    """
+    try:
+        return pinecone_pool.client().describe_index(index_name).metric
+    except Exception as e:
+        print(f"snapshot: No se pudo obtener la métrica de {index_name}, se asume cosine: {str(e)}")
+        return "cosine"
+
+
+def export_namespace(index_name: str, namespace: str, root: Optional[str] = None, dtype: str = "float32",
+                     full: bool = False, index=None, metric: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Exporta o sincroniza el snapshot local de un namespace y devuelve su manifiesto.
+    """
+    path = snapshot_path(index_name, namespace, root)
+    if index is None:
+        index = pinecone_pool.get_index(index_name)
+        if index is None:
+            raise ValueError(f"El índice {index_name} no existe")
+
+    previous = read_manifest(index_name, namespace, root)
+    existing = load_snapshot(path)
+    remote_ids = list_ids(index, namespace)
+    remote_set = set(remote_ids)
+    to_fetch = remote_ids if full else [chunk_id for chunk_id in remote_ids if chunk_id not in existing]
+    print(f"snapshot: {index_name}/{namespace}: {len(remote_ids)} ids remotos, "
+          f"{len(existing)} locales, {len(to_fetch)} por descargar")
+
+    entries = {chunk_id: entry for chunk_id, entry in existing.items() if chunk_id in remote_set}
+    removed = len(existing) - len(entries)
+    added = updated = 0
+    for chunk_id, (values, metadata) in fetch_vectors(index, namespace, to_fetch).items():
+        chunk_hash = content_hash(values, metadata)
+        if chunk_id not in entries:
+            added += 1
+        elif entries[chunk_id][2] != chunk_hash:
+            updated += 1
+        else:
+            continue
+        entries[chunk_id] = (np.asarray(values, dtype=np.float32), metadata, chunk_hash)
+
+    version = snapshot_content_version({chunk_id: entry[2] for chunk_id, entry in entries.items()})
+    if previous is not None and previous.get("version") == version and previous.get("dtype") == dtype:
+        print(f"snapshot: {index_name}/{namespace} sin cambios (versión {version})")
+        return previous
+
+    dim = len(next(iter(entries.values()))[0]) if entries else (previous or {}).get("dim", 0)
+    manifest = {
+        "version": version,
+        "previous_version": previous.get("version") if previous else None,
+        "index_name": index_name,
+        "namespace": namespace,
+        "count": len(entries),
+        "dim": dim,
+        "dtype": dtype,
+        "metric": metric or (previous or {}).get("metric") or index_metric(index_name),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "changes": {"added": added, "updated": updated, "removed": removed},
+    }
+    write_snapshot(path, entries, manifest, dtype)
+    print(f"snapshot: {index_name}/{namespace} versión {version} "
+          f"(+{added} ~{updated} -{removed}, {len(entries)} vectores)")
+    return manifest
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Snapshots locales de namespaces de Pinecone")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Exporta o sincroniza un namespace")
+    export_parser.add_argument("--index", help="Nombre del índice")
+    export_parser.add_argument("--namespace", help="Namespace (por defecto, el nombre del índice)")
+    export_parser.add_argument("--all", action="store_true", help="Exporta todos los temas registrados")
+    export_parser.add_argument("--out", default=VECTOR_STORE_DIR, help="Directorio raíz de los snapshots")
+    export_parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    export_parser.add_argument("--full", action="store_true",
+                               help="Descarga todos los vectores para detectar actualizaciones")
+
+    info_parser = subparsers.add_parser("info", help="Muestra el manifiesto de un snapshot")
+    info_parser.add_argument("--index", required=True)
+    info_parser.add_argument("--namespace")
+    info_parser.add_argument("--out", default=VECTOR_STORE_DIR)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        manifest = read_manifest(args.index, args.namespace or args.index, args.out)
+        print(json.dumps(manifest, ensure_ascii=False, indent=2) if manifest else "Sin snapshot local")
+        return
+
+    if args.all:
+        # Importación diferida: el registro de temas vive junto a los clientes de retrieval
+        from graph.chains.retrieval import TOPIC_REGISTRY
+        targets = sorted({(config.index_name, config.namespace) for config in TOPIC_REGISTRY.values()})
+    elif args.index:
+        targets = [(args.index, args.namespace or args.index)]
+    else:
+        parser.error("Indica --index o --all")
+
+    for index_name, namespace in targets:
+        export_namespace(index_name, namespace, root=args.out, dtype=args.dtype, full=args.full)
+
+
+if __name__ == "__main__":
+    main()
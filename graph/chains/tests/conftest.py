@@ -0,0 +1,7 @@
+import os
+
+# Las cadenas crean sus clientes al importarse: las pruebas usan una clave ficticia,
+# nunca llaman a la red y no escriben cachés en disco
+os.environ.setdefault("OPENAI_API_KEY", "test")
+for variable in ("ANSWER_CACHE_PATH", "EMBEDDING_CACHE_PATH", "RERANK_CACHE_PATH"):
+    os.environ.setdefault(variable, "")
@@ -0,0 +1,176 @@
+from langchain_core.documents import Document
+
+from graph.chains import semantic_cache
+from graph.chains.cache import LRUCache, SQLiteStore
+from graph.chains.embedding_cache import EmbeddingCache, normalize_query
+from graph.chains.semantic_cache import SemanticQueryCache
+
+
+def test_lru_cache_respects_byte_budget() -> None:
+    cache = LRUCache(max_bytes=10)
+    cache.put("a", b"12345")
+    cache.put("b", b"12345")
+    assert cache.get("a") == b"12345"
+    cache.put("c", b"12345")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"12345"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_sqlite_store_prunes_least_recently_used(tmp_path) -> None:
+    store = SQLiteStore(str(tmp_path / "store.sqlite"))
+    for key in ("a", "b", "c"):
+        store.put(key, key.encode())
+    store.get("a")
+
+    assert store.prune(max_entries=2) == 1
+    assert store.get("a") == b"a"
+    assert len(store) == 2
+
+
+def test_normalize_query() -> None:
+    assert normalize_query("  ¿Tarifa   de IVA?\n") == "¿tarifa de iva?"
+
+
+def test_embedding_cache_survives_restart(tmp_path) -> None:
+    path = str(tmp_path / "embeddings.sqlite")
+    cache = EmbeddingCache("model-a", path=path)
+    cache.put("¿Tarifa de IVA?", [0.5, -0.25, 1.0])
+
+    reopened = EmbeddingCache("model-a", path=path)
+    assert reopened.get("  ¿tarifa de iva? ") == [0.5, -0.25, 1.0]
+    assert reopened.stats()["disk_hits"] == 1
+
+
+def test_embedding_cache_invalidated_by_model_change(tmp_path) -> None:
+    path = str(tmp_path / "embeddings.sqlite")
+    EmbeddingCache("model-a", path=path).put("consulta", [1.0, 2.0])
+
+    other = EmbeddingCache("model-b", path=path)
+    assert other.get("consulta") is None
+    assert other.stats()["disk_entries"] == 0
+
+
+def test_rerank_cache_keys_on_candidates_and_snapshot(tmp_path, monkeypatch) -> None:
+    from langchain_core.documents import Document
+
+    from graph.chains import rerank_cache as module
+
+    versions = {"iva/iva": "v1"}
+    monkeypatch.setattr(module, "snapshot_version", lambda index, namespace: versions[f"{index}/{namespace}"])
+    cache = module.RerankCache(path=str(tmp_path / "rerank.sqlite"))
+    documents = [
+        Document(page_content=f"texto {i}", metadata={"source": f"{i}.pdf", "page": 1, "index_name": "iva", "namespace": "iva"})
+        for i in range(3)
+    ]
+    reranked = [Document(page_content=doc.page_content, metadata={**doc.metadata, "rerank_score": 0.5})
+                for doc in documents[::-1][:2]]
+    cache.put("Tarifa del IVA", documents, "local", 2, reranked)
+    cache.put("Tarifa del IVA", documents, "llm", 2, reranked)
+
+    hit = cache.get("  tarifa del iva ", list(reversed(documents)), "local", 2)
+    assert [doc.metadata["source"] for doc in hit] == ["2.pdf", "1.pdf"]
+    assert cache.get("tarifa del iva", documents[:2], "local", 2) is None
+
+    # El reranking local solo se guarda en memoria; los modos con LLM también en disco
+    reopened = module.RerankCache(path=str(tmp_path / "rerank.sqlite"))
+    assert reopened.stats()["disk_entries"] == 1
+    assert reopened.get("tarifa del iva", documents, "local", 2) is None
+    assert reopened.get("tarifa del iva", documents, "llm", 2) is not None
+
+    versions["iva/iva"] = "v2"
+    assert cache.get("tarifa del iva", documents, "local", 2) is None
+
+
+def test_answer_cache_survives_restart_and_invalidates_on_versions(tmp_path, monkeypatch) -> None:
+    from langchain_core.documents import Document
+
+    from graph.chains import answer_cache as module
+
+    versions = {"corpus": "iva/iva@v1", "prompt": "2-full"}
+    monkeypatch.setattr(module, "corpus_version", lambda topic: versions["corpus"])
+    monkeypatch.setattr(module, "prompt_version", lambda: versions["prompt"])
+    path = str(tmp_path / "answers.sqlite")
+    citations = [{"document_title": "1.pdf (Pág. 2)", "cited_text": "texto", "document_index": 0, "page": 2}]
+    module.AnswerCache(path=path).put("IVA", "Tarifa del IVA", "La tarifa es del 19% [1].", citations,
+                                      [Document(page_content="texto", metadata={"source": "1.pdf", "page": 2, "values": [0.1]})])
+
+    cache = module.AnswerCache(path=path)
+    hit = cache.get("IVA", "  tarifa del iva ")
+    assert hit["text"] == "La tarifa es del 19% [1]."
+    assert hit["citations"] == citations
+    assert hit["documents"][0].metadata == {"source": "1.pdf", "page": 2}
+    assert cache.get("Renta", "tarifa del iva") is None
+
+    versions["corpus"] = "iva/iva@v2"
+    assert cache.get("IVA", "tarifa del iva") is None
+    versions["corpus"], versions["prompt"] = "iva/iva@v1", "3-full"
+    assert cache.get("IVA", "tarifa del iva") is None
+
+
+
+def test_put_verified_grades_in_background_and_stores_only_useful(monkeypatch) -> None:
+    import threading
+
+    from graph.chains import answer_cache as module
+    from graph.chains import generation_grader
+
+    monkeypatch.setattr(module, "corpus_version", lambda topic: "iva/iva@v1")
+    release = threading.Event()
+
+    def verified_useful(question, documents, generation):
+        release.wait(5)
+        return "útil" in generation
+
+    monkeypatch.setattr(generation_grader, "verified_useful", verified_useful)
+    cache = module.AnswerCache(path=None)
+    documents = [Document(page_content="texto", metadata={"source": "1.pdf"})]
+
+    useful = cache.put_verified("IVA", "Tarifa del IVA", "Respuesta útil [1].", [], documents)
+    rejected = cache.put_verified("IVA", "Base del IVA", "Respuesta vaga [1].", [], documents)
+    # put_verified vuelve de inmediato; la calificación sigue en segundo plano
+    assert not useful.done() and cache.get("IVA", "Tarifa del IVA") is None
+
+    release.set()
+    assert useful.result(timeout=5) is True and rejected.result(timeout=5) is False
+    assert cache.get("IVA", "Tarifa del IVA")["text"] == "Respuesta útil [1]."
+    assert cache.get("IVA", "Base del IVA") is None
+
+def results(name, count=3):
+    return [Document(page_content=f"{name} {i}", metadata={"source": f"{name}_{i}.pdf"}) for i in range(count)]
+
+
+def test_semantic_cache_threshold_and_top_k() -> None:
+    cache = SemanticQueryCache(threshold=0.95, max_entries=4, ttl=60)
+    cache.store("iva", [1.0, 0.0], top_k=3, documents=results("tarifa"))
+
+    hit = cache.lookup("iva", [0.99, 0.05], top_k=2)
+    assert [doc.page_content for doc in hit] == ["tarifa 0", "tarifa 1"]
+    # Redacción distinta por debajo del umbral, más resultados de los guardados u otro namespace
+    assert cache.lookup("iva", [0.8, 0.6], top_k=2) is None
+    assert cache.lookup("iva", [1.0, 0.0], top_k=5) is None
+    assert cache.lookup("renta", [1.0, 0.0], top_k=2) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 3
+
+
+def test_semantic_cache_expires_and_evicts_least_recently_used(monkeypatch) -> None:
+    now = [100.0]
+    monkeypatch.setattr(semantic_cache.time, "monotonic", lambda: now[0])
+    cache = SemanticQueryCache(threshold=0.95, max_entries=2, ttl=60)
+
+    cache.store("iva", [1.0, 0.0, 0.0], top_k=3, documents=results("a"))
+    now[0] += 1
+    cache.store("iva", [0.0, 1.0, 0.0], top_k=3, documents=results("b"))
+    now[0] += 1
+    assert cache.lookup("iva", [1.0, 0.0, 0.0], top_k=1) is not None
+    now[0] += 1
+    cache.store("iva", [0.0, 0.0, 1.0], top_k=3, documents=results("c"))
+
+    assert cache.lookup("iva", [0.0, 1.0, 0.0], top_k=1) is None
+    assert cache.lookup("iva", [1.0, 0.0, 0.0], top_k=1)[0].page_content == "a 0"
+    assert cache.stats()["entries"] == 2
+
+    now[0] += 61
+    assert cache.lookup("iva", [0.0, 0.0, 1.0], top_k=1) is None
+    assert cache.stats()["entries"] == 0
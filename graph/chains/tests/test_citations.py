@@ -0,0 +1,37 @@
+from langchain_core.documents import Document
+
+from graph.chains.citations import CitationStream
+
+DOCUMENTS = [
+    Document(page_content="Tarifa general del IVA.", metadata={"source": "pinecone_docs/2024_12_concepto_1163(010470)", "page": 2}),
+    Document(page_content="Exclusiones del IVA.", metadata={"source": "pinecone_docs/2023_05_oficio_907", "page": 0}),
+]
+
+ANSWER = (
+    "4. CONCLUSIÓN\n\nLa tarifa es del 19% [1].\n\n"
+    "5. ANÁLISIS\n\n5.1. Marco Normativo Vigente: ver [2][1] y [9].\n\nCierre del análisis."
+)
+
+
+def test_citations_split_across_chunks() -> None:
+    stream = CitationStream(DOCUMENTS)
+    emitted = []
+    for chunk in ["La tarifa [", "1", "] y [2", "]. Otra vez [1]"]:
+        emitted.extend(index for index, _ in stream.feed(chunk))
+
+    assert emitted == [1, 2]
+    assert stream.citations[0]["document_title"] == "Pinecone: 2024_12_concepto_1163(010470) (Pág. 2)"
+
+
+def test_section_inserted_in_single_pass_regardless_of_chunking() -> None:
+    whole = CitationStream(DOCUMENTS)
+    whole.feed(ANSWER)
+    chunked = CitationStream(DOCUMENTS)
+    for start in range(0, len(ANSWER), 3):
+        chunked.feed(ANSWER[start:start + 3])
+
+    text = whole.finish()
+    assert chunked.finish() == text
+    assert text.endswith("\n\nCierre del análisis.")
+    assert "6. Citas\n\n   ○  6.1. 2024_12_concepto_1163(010470).\n   ○  6.2. 2023_05_oficio_907.\n" in text
+
@@ -0,0 +1,37 @@
+import asyncio
+
+import httpx
+
+from graph.chains.clients import STAGE_HEADER, OpenAIClients, _take_stage
+
+
+def test_stage_header_is_stripped_and_recorded() -> None:
+    clients = OpenAIClients(api_key="test")
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings", headers={STAGE_HEADER: "embeddings"})
+
+    _take_stage(request)
+    clients._record(httpx.Response(200, request=request))
+    clients._record(httpx.Response(429, request=request))
+
+    assert STAGE_HEADER not in request.headers
+    stats = clients.stats()["embeddings"]
+    assert stats["calls"] == 2
+    assert stats["errors"] == 1
+    assert clients.openai("rerank") is not clients.openai("generation")
+    assert clients.openai("rerank")._client is clients.http_client()
+
+
+def test_close_releases_sync_and_async_pools() -> None:
+    clients = OpenAIClients(api_key="test")
+    http_client, async_http_client = clients.http_client(), clients.async_http_client()
+
+    clients.close()
+    assert http_client.is_closed and async_http_client.is_closed
+    assert clients.async_http_client() is not async_http_client
+
+    async def close_inside_loop():
+        pool = clients.async_http_client()
+        await clients.aclose()
+        return pool
+
+    assert asyncio.run(close_inside_loop()).is_closed
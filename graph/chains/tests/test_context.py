@@ -0,0 +1,43 @@
+from langchain_core.documents import Document
+
+from graph.chains.citations import CitationStream
+from graph.chains.context import build_context
+
+PASSAGE = ("El impuesto sobre las ventas se causa en la venta de bienes corporales muebles "
+           "y en la prestación de servicios en el territorio nacional.")
+
+
+def test_duplicates_removed_and_adjacent_pages_merged() -> None:
+    documents = [
+        Document(page_content="Página cuatro del concepto.", metadata={"source": "concepto_1163", "page": 4}),
+        Document(page_content=PASSAGE, metadata={"source": "oficio_907", "page": 1}),
+        Document(page_content=PASSAGE.replace("  ", " ") + " ", metadata={"source": "ley_1819", "page": 9}),
+        Document(page_content=PASSAGE + " Vigente.", metadata={"source": "ley_2010", "page": 2}),
+        Document(page_content="Página tres del concepto.", metadata={"source": "concepto_1163", "page": 3.0}),
+    ]
+
+    context = build_context(documents, "impuesto ventas")
+
+    assert context.duplicates == 2
+    assert context.merged == 1
+    assert [doc.metadata["source"] for doc in context.documents] == ["concepto_1163", "oficio_907"]
+    assert context.documents[0].metadata["pages"] == [3, 4]
+    assert context.documents[0].page_content == "Página tres del concepto.\nPágina cuatro del concepto."
+    assert "DOCUMENTO [2]: oficio_907" in context.text
+
+
+def test_budget_truncates_and_citations_follow_manifest() -> None:
+    documents = [
+        Document(page_content=PASSAGE, metadata={"source": "oficio_907", "page": 1}),
+        Document(page_content="Régimen de aduanas. " * 200, metadata={"source": "decreto_1165", "page": 7}),
+        Document(page_content="No cabe.", metadata={"source": "ley_2277", "page": 1}),
+    ]
+
+    context = build_context(documents, "aduanas", budget=300)
+
+    assert context.tokens <= 300
+    assert [entry.truncated for entry in context.entries] == [False, True]
+    assert context.dropped == 1
+    stream = CitationStream(context.documents)
+    stream.feed("Ver [2] y [3].")
+    assert [citation["document_title"] for citation in stream.citations] == ["decreto_1165 (Pág. 7)"]
@@ -0,0 +1,111 @@
+import time
+from types import SimpleNamespace
+
+import httpx
+
+from langchain_core.documents import Document
+
+from graph.chains import openai_generation, resilience
+
+DOCUMENTS = [
+    Document(page_content="La tarifa general del IVA es del 19%.", metadata={"source": "pinecone_docs/2023_05_concepto_900", "page": 1}),
+]
+
+
+def chunk(text=None, usage=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=text))] if text is not None else []
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+class FakeStream:
+    def __init__(self, chunks, delay=0.0, error=None):
+        self.chunks = chunks
+        self.delay = delay
+        self.error = error
+        self.closed = False
+
+    def __iter__(self):
+        for item in self.chunks:
+            time.sleep(self.delay)
+            yield item
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+def stub_client(monkeypatch, stream, requests=None):
+    def create(**kwargs):
+        if requests is not None:
+            requests.append(kwargs)
+        return stream
+
+    completions = SimpleNamespace(create=create)
+    monkeypatch.setattr(openai_generation, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+
+def test_stream_cut_at_deadline_is_marked_truncated(monkeypatch) -> None:
+    monkeypatch.setitem(resilience.STAGE_TIMEOUTS, "generation", 0.2)
+    stream = FakeStream([chunk("La tarifa "), chunk("es del 19% [1]."), chunk(" Fin.")], delay=0.15)
+    stub_client(monkeypatch, stream)
+
+    events = list(openai_generation.stream_with_openai("¿Tarifa del IVA?", DOCUMENTS))
+
+    assert [event["text"] for event in events if event["type"] == "delta"] == ["La tarifa "]
+    assert events[-1]["type"] == "done"
+    assert events[-1]["truncated"] is True
+    assert stream.closed
+
+
+def test_stream_events_in_order(monkeypatch) -> None:
+    usage = SimpleNamespace(prompt_tokens=1200, completion_tokens=12,
+                            prompt_tokens_details=SimpleNamespace(cached_tokens=1024))
+    # La cita [1] llega partida entre dos fragmentos y se repite después
+    stream = FakeStream([chunk("La tarifa es del 19% ["), chunk("1]. Se reitera [1]."), chunk(usage=usage)])
+    stub_client(monkeypatch, stream)
+
+    events = list(openai_generation.stream_with_openai("¿Tarifa del IVA?", DOCUMENTS))
+
+    assert [event["type"] for event in events] == ["delta", "delta", "citation", "done"]
+    assert events[2]["index"] == 1
+    done = events[-1]
+    assert done["text"].startswith("La tarifa es del 19% [1]. Se reitera [1].")
+    assert len(done["citations"]) == 1
+    assert done["documents"] == DOCUMENTS
+    assert done["usage"] is usage
+    assert done["truncated"] is False
+
+
+def test_stream_error_ends_with_error_done_event(monkeypatch) -> None:
+    def create(**kwargs):
+        raise ValueError("solicitud inválida")
+
+    completions = SimpleNamespace(create=create)
+    monkeypatch.setattr(openai_generation, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+    events = list(openai_generation.stream_with_openai("¿Tarifa del IVA?", DOCUMENTS))
+
+    assert len(events) == 1
+    assert events[0]["type"] == "done"
+    assert "solicitud inválida" in events[0]["text"]
+    assert events[0]["citations"] == [] and events[0]["truncated"] is False
+    assert events[0]["documents"] == DOCUMENTS
+
+    result = openai_generation.generate_with_openai("¿Tarifa del IVA?", DOCUMENTS)
+    assert result["citations"] == [] and result["documents"] == DOCUMENTS
+
+
+def test_stalled_stream_is_cut_by_the_read_timeout(monkeypatch) -> None:
+    monkeypatch.setattr(openai_generation, "STREAM_IDLE_TIMEOUT", 5.0)
+    stream = FakeStream([chunk("La tarifa es del 19% [1].")], error=httpx.ReadTimeout("sin datos"))
+    requests = []
+    stub_client(monkeypatch, stream, requests)
+
+    events = list(openai_generation.stream_with_openai("¿Tarifa del IVA?", DOCUMENTS))
+
+    assert requests[0]["timeout"].read == 5.0
+    assert [event["type"] for event in events] == ["delta", "citation", "done"]
+    assert events[-1]["text"].startswith("La tarifa es del 19% [1].")
+    assert events[-1]["truncated"] is True
+    assert stream.closed
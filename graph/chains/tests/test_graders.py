@@ -0,0 +1,97 @@
+import time
+
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+
+from graph.chains import generation_grader as grader
+from graph.chains import resilience
+
+DOCUMENTS = [
+    Document(page_content="Tarifa general del IVA.", metadata={"source": "pinecone_docs/2024_12_concepto_1163(010470)", "page": 2}),
+    Document(page_content="Exclusiones del IVA.", metadata={"source": "pinecone_docs/2023_05_oficio_907", "page": 0}),
+]
+
+ANSWER = (
+    "4. CONCLUSIÓN\n\nLa tarifa es del 19% [1].\n\n"
+    "5. ANÁLISIS\n\n5.1. Marco Normativo Vigente: ver [2][1] y [9].\n\nCierre del análisis."
+)
+
+
+def test_grader_receives_cited_spans_only() -> None:
+    documents = DOCUMENTS + [Document(page_content="Régimen sancionatorio. " * 100, metadata={"source": "ley_1819"})]
+    generation = grader.strip_citations_section(ANSWER + "\n\n6. Citas\n\n   ○  6.1. x.")
+
+    compact = grader.compact_documents(documents, generation)
+
+    assert "6. Citas" not in generation
+    assert compact.splitlines()[0] == "[1] 2024_12_concepto_1163(010470) (Pág. 2): Tarifa general del IVA."
+    assert compact.splitlines()[1] == "[2] 2023_05_oficio_907: Exclusiones del IVA."
+    assert len(compact.splitlines()[2]) < 400
+
+
+def test_grade_generation_with_stubbed_llm(monkeypatch) -> None:
+    received = []
+
+    def llm(inputs):
+        received.append(inputs)
+        return grader.GradeGeneration(grounded=True, addresses_question=False)
+
+    monkeypatch.setattr(grader, "generation_grader", RunnableLambda(llm))
+
+    grade = grader.grade_generation("¿Tarifa del IVA?", DOCUMENTS, ANSWER + "\n\n6. Citas\n\n   ○  6.1. x.")
+
+    assert (grade.grounded, grade.addresses_question) == (True, False)
+    assert received[0]["question"] == "¿Tarifa del IVA?"
+    assert "6. Citas" not in received[0]["generation"]
+    assert received[0]["documents"].startswith("[1] 2024_12_concepto_1163(010470)")
+
+
+def test_verify_result() -> None:
+    assert grader.verify_result({"grounded": True, "addresses_question": True}) == "useful"
+    assert grader.verify_result({"grounded": True, "addresses_question": False}) == "not_useful"
+    assert grader.verify_result({"grounded": False, "addresses_question": None}) == "not_supported"
+    assert grader.verify_result({"grounded": None, "addresses_question": True}) == "unverified"
+    assert grader.verify_result({"grounded": True}) == "unverified"
+
+
+def test_open_breaker_leaves_answer_unverified(monkeypatch) -> None:
+    breaker = resilience.get_breaker("graders")
+    monkeypatch.setattr(breaker, "state", "open")
+    monkeypatch.setattr(breaker, "opened_at", time.monotonic())
+
+    assert grader.grade_generation("¿Tarifa del IVA?", DOCUMENTS, ANSWER) is None
+    assert grader.is_grounded(DOCUMENTS, ANSWER) is None
+    assert grader.addresses_question("¿Tarifa del IVA?", ANSWER) is None
+
+
+def test_parallel_verify_in_topic_graph(monkeypatch) -> None:
+    import importlib
+
+    import graph.verification
+    import graph.topics.iva.graph as iva_graph
+    import graph.topics.iva.nodes as iva_nodes
+
+    stored = []
+    monkeypatch.setattr(grader, "VERIFY_MODE", "parallel")
+    monkeypatch.setattr(iva_nodes, "retrieve_documents", lambda state: {"documents": DOCUMENTS, "topic": "IVA"})
+    monkeypatch.setattr(iva_nodes, "generate_response", lambda state: {"generation": ANSWER, "citations": []})
+    monkeypatch.setattr(iva_nodes.answer_cache, "get", lambda topic, question: None)
+    monkeypatch.setattr(iva_nodes.answer_cache, "put", lambda topic, question, *args: stored.append(question))
+    monkeypatch.setattr(graph.verification, "is_grounded", lambda documents, generation: True)
+    verdicts = iter([True, None])
+    monkeypatch.setattr(graph.verification, "addresses_question", lambda question, generation: next(verdicts))
+    try:
+        app = importlib.reload(iva_graph).app
+        assert {"grade_grounding", "grade_answer", "verify"} <= set(app.get_graph().nodes)
+
+        useful = app.invoke({"question": "¿Tarifa del IVA?"})
+        assert useful["grades"] == {"grounded": True, "addresses_question": True}
+        assert useful["verify_result"] == "useful"
+        assert stored == ["¿Tarifa del IVA?"]
+
+        unverified = app.invoke({"question": "¿Bienes excluidos?"})
+        assert unverified["verify_result"] == "unverified"
+        assert stored == ["¿Tarifa del IVA?"]
+    finally:
+        monkeypatch.undo()
+        importlib.reload(iva_graph)
@@ -0,0 +1,54 @@
+from graph.chains.legal_refs import CitationIndex, extract_references
+from graph.chains.lexical import BM25Index, numeric_tokens, reference_numbers, tokenize
+
+
+def test_tokenize_folds_accents_and_normalizes_numbers() -> None:
+    assert tokenize("Artículo 240 del Decreto 1.625 de 2016, Concepto 010470") == [
+        "articulo", "240", "decreto", "1625", "2016", "concepto", "10470",
+    ]
+
+
+def test_numeric_tokens() -> None:
+    assert numeric_tokens("Ley 2277 de 2022, numeral 3") == {"2277", "2022"}
+
+
+def test_reference_numbers_ignore_bare_numbers() -> None:
+    assert reference_numbers("¿La tarifa del 19% aplica en 2024?") == set()
+    assert reference_numbers("artículo 240-1 de la Ley 2277 de 2022") == {"240", "1", "2277", "2022"}
+
+
+def test_bm25_ranks_exact_reference_first() -> None:
+    index = BM25Index([
+        "La tarifa general del IVA es del 19 por ciento.",
+        "El artículo 240 del Estatuto Tributario fija la tarifa de renta.",
+        "Retención en la fuente por honorarios y comisiones.",
+    ])
+
+    hits = index.search("¿Qué establece el artículo 240 del ET?", top_k=3)
+    assert hits[0][0] == 1
+    assert all(score > 0 for _, score in hits)
+
+
+def test_extract_references_normalizes_keys() -> None:
+    references = extract_references(
+        "Según el art. 240-1 del E.T., el Decreto 1.625 de 2016 y el Concepto DIAN 010470"
+    )
+    assert [key for reference in references for key in reference.keys()] == [
+        "articulo:240-1", "decreto:1625:2016", "decreto:1625", "concepto:10470",
+    ]
+    # El punto de la abreviatura es opcional ("Art 437" es frecuente en las preguntas)
+    for query in ("Art 437 del E.T.", "Art. 437", "artículo 437", "arts 437"):
+        assert extract_references(query)[0].keys() == ["articulo:437"]
+    assert extract_references("parte 437 del arte 12") == []
+
+
+def test_citation_index_prefers_the_cited_document() -> None:
+    index = CitationIndex.build([
+        (0, "La tarifa general del IVA es del 19 por ciento.", "2023_05_concepto_900(000900).pdf"),
+        (1, "Como se indicó en el Concepto 1163 de 2024, ...", "2024_10_concepto_77(012000).pdf"),
+        (2, "Problema jurídico: retención sobre pagos al exterior.", "2024_12_concepto_1163(010470).pdf"),
+    ])
+
+    assert index.lookup("¿Qué dice el concepto 1163?") == [2, 1]
+    assert index.lookup("concepto 010470") == [2]
+    assert index.lookup("tarifa del IVA") == []
@@ -0,0 +1,37 @@
+from types import SimpleNamespace
+
+from graph.chains import prompts
+from graph.chains.prompts import PromptUsageStats, build_generation_messages, prompt_version, resolve_variant
+
+
+def test_resolve_variant(monkeypatch) -> None:
+    monkeypatch.setattr(prompts, "PROMPT_VARIANT", "lean")
+    assert resolve_variant() == "lean"
+    assert resolve_variant("FULL") == "full"
+    assert resolve_variant("corto") == "full"
+    assert prompt_version() == f"{prompts.PROMPT_REVISION}-lean"
+
+
+def test_static_prefix_is_identical_across_questions() -> None:
+    first = build_generation_messages("¿Tarifa del IVA?", "[1] Documento A", "lean")
+    second = build_generation_messages("¿Retención en la fuente?", "[1] Documento B", "lean")
+
+    assert first[0] == second[0]
+    assert first[0]["content"] == prompts.SYSTEM_PROMPT_LEAN
+    assert first[1]["content"].endswith("Pregunta: ¿Tarifa del IVA?")
+
+
+def test_prompt_usage_stats_by_variant() -> None:
+    stats = PromptUsageStats()
+    usage = SimpleNamespace(prompt_tokens=2000, completion_tokens=300,
+                            prompt_tokens_details=SimpleNamespace(cached_tokens=1500))
+
+    assert stats.record(None, "full") == {}
+    assert stats.record(usage, "full")["cached_tokens"] == 1500
+    stats.record(SimpleNamespace(prompt_tokens=1000, completion_tokens=100, prompt_tokens_details=None), "FULL")
+    stats.record(usage, "lean")
+
+    totals = stats.stats()
+    assert totals["full"] == {"calls": 2, "prompt_tokens": 3000, "cached_tokens": 1500,
+                              "completion_tokens": 400, "cached_ratio": 0.5}
+    assert totals["lean"]["calls"] == 1
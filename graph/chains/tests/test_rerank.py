@@ -0,0 +1,180 @@
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from graph.chains.local_rerank import local_rerank
+
+
+def candidate(text, source, values=None, **metadata):
+    metadata = {"source": source, "page": 1, **metadata}
+    if values is not None:
+        metadata["values"] = np.asarray(values, dtype=np.float32)
+    return Document(page_content=text, metadata=metadata)
+
+
+def test_local_rerank_orders_by_vector_similarity() -> None:
+    documents = [
+        candidate("Régimen de retención en la fuente.", "a.pdf", [0.0, 1.0]),
+        candidate("Tarifa general del IVA.", "b.pdf", [1.0, 0.1]),
+        candidate("Impuesto de timbre.", "c.pdf", [0.5, 0.5]),
+    ]
+
+    reranked = local_rerank("tarifa del IVA", documents, top_k=2, query_embedding=[1.0, 0.0])
+    assert [doc.metadata["source"] for doc in reranked] == ["b.pdf", "c.pdf"]
+    assert reranked[0].metadata["rerank_score"] >= reranked[1].metadata["rerank_score"]
+
+
+def test_local_rerank_promotes_cited_document_without_vectors() -> None:
+    documents = [
+        candidate("Retención sobre pagos al exterior.", "pinecone_docs/2020_01_concepto_15(000015).pdf", score=0.82),
+        candidate("Retención sobre pagos al exterior.", "pinecone_docs/2024_12_concepto_1163(010470).pdf",
+                  score=0.2, retrieval="citation", exact_reference=True),
+    ]
+
+    reranked = local_rerank("¿Qué dice el Concepto 1163 de 2024?", documents, top_k=1)
+    assert reranked[0].metadata["source"].endswith("concepto_1163(010470).pdf")
+
+
+def test_diversify_caps_chunks_per_source() -> None:
+    from graph.chains.diversity import diversify
+
+    documents = [
+        candidate("Concepto sobre IVA, página 1.", "pinecone_docs/concepto_1.pdf", [1.0, 0.0], rerank_score=0.9),
+        candidate("Concepto sobre IVA, página 2.", "pinecone_docs/concepto_1.pdf", [0.99, 0.05], rerank_score=0.85),
+        candidate("Concepto sobre IVA, página 3.", "pinecone_docs/concepto_1.pdf", [0.98, 0.1], rerank_score=0.8),
+        candidate("Oficio sobre exclusiones de IVA.", "pinecone_docs/oficio_2.pdf", [0.6, 0.8], rerank_score=0.6),
+    ]
+
+    selected = diversify(documents, top_k=3, max_per_source=2)
+    assert [doc.page_content for doc in selected][0] == "Concepto sobre IVA, página 1."
+    assert sum(doc.metadata["source"].endswith("oficio_2.pdf") for doc in selected) == 1
+    assert len(selected) == 3
+
+
+
+def test_diversify_does_not_compare_dense_and_lexical_scores() -> None:
+    from graph.chains.diversity import diversify, relevance_scores
+
+    dense = candidate("Tarifa general del IVA.", "pinecone_docs/concepto_1.pdf", [1.0, 0.0], score=0.82)
+    lexical = candidate("Artículo 468 del Estatuto.", "pinecone_docs/oficio_2.pdf", [0.0, 1.0],
+                        score=1.0, retrieval="lexical")
+
+    # Sin reranking ni fusión manda el orden recibido, no el BM25 normalizado frente al coseno
+    assert [doc.metadata["source"] for doc in diversify([dense, lexical], top_k=1)] == ["pinecone_docs/concepto_1.pdf"]
+
+    dense.metadata["fusion_score"], lexical.metadata["fusion_score"] = 1 / 61, 1 / 62
+    assert relevance_scores([lexical, dense]).tolist() == [0.0, 1.0]
+    assert diversify([lexical, dense], top_k=1)[0] is dense
+
+def test_token_budget_keeps_relevant_window() -> None:
+    from graph.chains.tokens import allocate_budget, best_window
+
+    assert allocate_budget([10, 500, 300, 50], total_tokens=400, minimum=20) == [10, 170, 170, 50]
+
+    text = ("La renta líquida se determina así. " * 20) + "La tarifa general del IVA es del 19%. " + ("Otro tema. " * 20)
+    window = best_window(text, "tarifa del IVA", max_tokens=30)
+    assert "tarifa general del IVA" in window
+    assert window.startswith("...")
+
+
+
+def test_failed_encoding_load_is_retried_not_cached(monkeypatch) -> None:
+    from graph.chains import tokens
+
+    now = [100.0]
+    loads = []
+    encoding = object()
+    monkeypatch.setattr(tokens, "_encodings", {})
+    monkeypatch.setattr(tokens, "_encoding_failures", {})
+    monkeypatch.setattr(tokens.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(tokens, "_load_encoding", lambda model: loads.append(model) or (encoding if len(loads) > 1 else None))
+
+    assert tokens.get_encoding("modelo") is None
+    assert tokens.get_encoding("modelo") is None
+    assert len(loads) == 1
+
+    now[0] += tokens.ENCODING_RETRY_INTERVAL
+    assert tokens.get_encoding("modelo") is encoding
+    assert tokens.get_encoding("modelo") is encoding
+    assert len(loads) == 2
+
+def test_bare_number_does_not_skip_reranking(monkeypatch) -> None:
+    from graph.chains import reranking
+
+    documents = [candidate(f"La tarifa del {i} y del 19 por ciento.", f"{i}.pdf", score=0.5 - i / 100) for i in range(10)]
+    documents[0].metadata["exact_reference"] = True
+    reranked = []
+    monkeypatch.setattr(reranking, "ADAPTIVE_RERANK", False)
+    monkeypatch.setattr(reranking, "DIVERSITY", False)
+    monkeypatch.setattr(reranking, "rerank_documents",
+                        lambda query, docs, top_k, mode: reranked.append(query) or docs[::-1][:top_k])
+
+    result = reranking.retrieve_with_reranking("tarifa del 19", lambda query, top_k, **kwargs: documents, top_k=3)
+
+    assert reranked == ["tarifa del 19"]
+    assert [doc.metadata["source"] for doc in result] == ["9.pdf", "8.pdf", "7.pdf"]
+
+
+def test_rerank_decision_table() -> None:
+    from graph.chains.reranking import rerank_decision
+
+    def scored(*scores, retrieval=None):
+        extra = {"retrieval": retrieval} if retrieval else {}
+        return [candidate(f"Fragmento {score}.", f"{score}.pdf", score=score, **extra) for score in scores]
+
+    cases = [
+        (scored(0.9, 0.8, 0.5), "skip_gap"),
+        (scored(0.7, 0.68, 0.66), "skip_confident"),
+        (scored(0.41, 0.405, 0.40), "widen"),
+        (scored(0.5, 0.48, 0.46, 0.3), "rerank"),
+        (scored(0.9, 0.5), "rerank"),
+        # Las puntuaciones léxicas y de citas no cuentan para la decisión
+        (scored(0.99, retrieval="citation") + scored(0.5, 0.48, 0.46, 0.3), "rerank"),
+    ]
+    for documents, expected in cases:
+        assert rerank_decision(documents, top_k=2) == expected
+
+
+def test_skip_keeps_lexical_and_citation_candidates(monkeypatch) -> None:
+    from graph.chains import reranking
+
+    documents = [
+        candidate("Concepto citado en la consulta.", "cita.pdf", score=1.0, retrieval="citation"),
+        candidate("Tarifa general.", "a.pdf", score=0.9),
+        candidate("Tarifa diferencial.", "b.pdf", score=0.8),
+        candidate("Tema lejano.", "c.pdf", score=0.5),
+    ]
+    monkeypatch.setattr(reranking, "DIVERSITY", False)
+    monkeypatch.setattr(reranking, "rerank_documents", lambda *args, **kwargs: pytest.fail("no debe reordenar"))
+
+    result = reranking.retrieve_with_reranking("tarifa", lambda query, top_k, **kwargs: documents, top_k=2)
+
+    assert [doc.metadata["source"] for doc in result] == ["cita.pdf", "a.pdf"]
+
+
+def test_pointwise_jobs_queued_behind_others_are_still_scored(monkeypatch) -> None:
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    from graph.chains import reranking
+
+    documents = [candidate(f"Fragmento {i}.", f"{i}.pdf") for i in range(25)]
+
+    def score_document(query, doc):
+        time.sleep(0.05)
+        number = int(doc.metadata["source"].split(".")[0])
+        if number == 3:
+            raise TimeoutError("sin respuesta")
+        return number % 7
+
+    # Un solo hilo: los trabajos esperan en cola más que POINTWISE_TIMEOUT + 1
+    monkeypatch.setattr(reranking, "_pointwise_executor", ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(reranking, "POINTWISE_TIMEOUT", 0.1)
+    monkeypatch.setattr(reranking, "_score_document", score_document)
+
+    reranked = reranking.pointwise_rerank_documents("tarifa", documents, top_k=25)
+
+    assert all(doc.metadata["rerank_score"] is not None for doc in reranked)
+    assert [doc.metadata["source"] for doc in reranked[:3]] == ["6.pdf", "13.pdf", "20.pdf"]
+    fallback = next(doc for doc in reranked if doc.metadata["source"] == "3.pdf")
+    assert fallback.metadata["rerank_fallback"] and fallback.metadata["rerank_score"] == reranking.POINTWISE_FALLBACK_SCORE
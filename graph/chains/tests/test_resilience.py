@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import pytest
+
+from graph.chains import resilience
+
+
+def test_hedged_duplicate_wins_when_first_call_is_slow(monkeypatch) -> None:
+    monkeypatch.setitem(resilience.HEDGE_DEFAULT_DELAYS, "test_hedge", 0.05)
+    calls = []
+
+    def fn(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            time.sleep(0.5)
+            return "lenta"
+        return "duplicado"
+
+    start = time.perf_counter()
+    assert resilience.call("test_hedge", fn, hedge=True) == "duplicado"
+    assert time.perf_counter() - start < 0.4
+    assert len(calls) == 2
+
+
+def test_retries_then_breaker_opens_and_uses_fallback(monkeypatch) -> None:
+    monkeypatch.setattr(resilience, "RETRY_BASE_DELAY", 0.001)
+    breaker = resilience.get_breaker("test_breaker")
+    breaker.failure_threshold = 3
+    attempts = []
+
+    def failing(timeout):
+        attempts.append(timeout)
+        raise ConnectionError("sin conexión")
+
+    assert resilience.call("test_breaker", failing, retries=1, fallback=lambda error: "degradada") == "degradada"
+    assert len(attempts) == 2
+    with pytest.raises(ConnectionError):
+        resilience.call("test_breaker", failing, retries=0)
+    assert breaker.state == "open"
+
+    assert resilience.call("test_breaker", failing, fallback=lambda error: type(error).__name__) == "CircuitOpenError"
+    assert len(attempts) == 3
+    with pytest.raises(ValueError):
+        resilience.call("test_other", lambda timeout: int("x"), retries=3)
+
+
+def test_resilient_runnable_passes_attempt_timeout_to_the_model(monkeypatch) -> None:
+    import httpx
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_openai import ChatOpenAI
+
+    timeouts = []
+
+    def handler(request):
+        timeouts.append(request.extensions["timeout"]["read"])
+        return httpx.Response(200, json={
+            "id": "x", "object": "chat.completion", "created": 0, "model": "gpt-3.5-turbo",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "general"}}],
+        })
+
+    monkeypatch.setitem(resilience.STAGE_TIMEOUTS, "test_timeout", 3.0)
+    llm = ChatOpenAI(api_key="test", http_client=httpx.Client(transport=httpx.MockTransport(handler)), max_retries=0)
+    runnable = resilience.resilient_runnable("test_timeout", ChatPromptTemplate.from_messages([("human", "{q}")]) | llm)
+
+    assert runnable.invoke({"q": "hola"}).content == "general"
+    assert 0 < timeouts[0] <= 3.0
+
+
+def test_acall_retries_transient_errors_and_hedges(monkeypatch) -> None:
+    monkeypatch.setattr(resilience, "RETRY_BASE_DELAY", 0.001)
+    monkeypatch.setitem(resilience.HEDGE_DEFAULT_DELAYS, "test_ahedge", 0.05)
+    attempts = []
+
+    async def flaky(timeout):
+        attempts.append(timeout)
+        if len(attempts) == 1:
+            raise ConnectionError("429")
+        return "ok"
+
+    assert asyncio.run(resilience.acall("test_aretry", flaky)) == "ok"
+    assert len(attempts) == 2
+
+    calls = []
+
+    async def slow_first(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            await asyncio.sleep(0.5)
+            return "lenta"
+        return "duplicado"
+
+    start = time.perf_counter()
+    assert asyncio.run(resilience.acall("test_ahedge", slow_first, hedge=True)) == "duplicado"
+    assert time.perf_counter() - start < 0.4
+
+    async def failing(timeout):
+        raise ConnectionError("sin conexión")
+
+    breaker = resilience.get_breaker("test_abreaker")
+    breaker.failure_threshold = 2
+    assert asyncio.run(resilience.acall("test_abreaker", failing, retries=1, fallback=lambda error: "degradada")) == "degradada"
+    assert breaker.state == "open"
@@ -0,0 +1,176 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from langchain_core.documents import Document
+
+from graph.chains import retrieval
+from graph.chains.embedding_cache import EmbeddingCache
+from graph.chains.fusion import reciprocal_rank_fusion
+from graph.chains.semantic_cache import SemanticQueryCache
+from graph.chains.vectorstores import VectorMatch
+
+
+def doc(text, source, page=1):
+    return Document(page_content=text, metadata={"source": source, "page": page})
+
+
+def test_reciprocal_rank_fusion_merges_duplicates_across_indexes() -> None:
+    shared = "Tarifa general del IVA."
+    iva = [doc(shared, "pinecone_docs/concepto_1.pdf"), doc("Exclusiones.", "pinecone_docs/oficio_2.pdf")]
+    renta = [doc("Renta líquida.", "pinecone_renta/concepto_3.pdf"), doc(shared, "pinecone_renta/concepto_1.pdf")]
+
+    fused = reciprocal_rank_fusion([iva, renta], top_k=3)
+
+    assert [item.page_content for item in fused] == [shared, "Renta líquida.", "Exclusiones."]
+    assert fused[0].metadata["source"] == "pinecone_docs/concepto_1.pdf"
+    assert fused[0].metadata["fusion_score"] == 1 / 61 + 1 / 62
+    assert reciprocal_rank_fusion([]) == []
+
+
+def test_fan_out_uses_one_deadline_and_drops_slow_indexes(monkeypatch) -> None:
+    def query_hybrid(query, index_name, namespace, top_k, query_embedding):
+        if index_name != "iva":
+            time.sleep(2.0)
+        return [doc(f"Fragmento de {index_name}.", f"{index_name}.pdf")]
+
+    monkeypatch.setattr(retrieval, "get_embedding", lambda query: [1.0, 0.0])
+    monkeypatch.setattr(retrieval, "query_hybrid", query_hybrid)
+
+    start = time.perf_counter()
+    docs = retrieval.retriever.fan_out("tarifa", ["IVA", "Timbre", "Aduanas", "Cambiario", "IVA"],
+                                      top_k=5, timeout=0.3)
+
+    # Con un plazo por índice serían 0.9 s (tres índices lentos)
+    assert time.perf_counter() - start < 0.75
+    assert [item.metadata["source"] for item in docs] == ["iva.pdf"]
+    assert retrieval.retriever.fan_out("tarifa", []) == []
+
+
+def test_get_embeddings_batches_and_dedups_exact_texts(monkeypatch) -> None:
+    sent = []
+
+    def embed_batch(texts):
+        sent.append(list(texts))
+        return [[float(len(text)), float(sum(map(ord, text)))] for text in texts]
+
+    monkeypatch.setattr(retrieval, "embedding_cache", EmbeddingCache("test-model", path=None))
+    monkeypatch.setattr(retrieval, "_embed_batch", embed_batch)
+    monkeypatch.setattr(retrieval, "EMBEDDING_BATCH_MAX_INPUTS", 2)
+    texts = ["Artículo 240.", "ARTÍCULO 240.", "Artículo 240.", "Artículo  240.", "Parágrafo."]
+
+    embeddings = retrieval.get_embeddings(texts)
+
+    # Los duplicados exactos viajan una vez; las variantes de mayúsculas o espacios no se fusionan
+    assert sorted(text for batch in sent for text in batch) == sorted(set(texts))
+    assert all(len(batch) <= 2 for batch in sent)
+    assert embeddings[0] == embeddings[2]
+    assert embeddings[0] != embeddings[1] and embeddings[0] != embeddings[3]
+
+    sent.clear()
+    assert retrieval.get_embeddings(texts) == embeddings
+    assert sent == []
+
+
+class AsyncEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    async def create(self, input, model, timeout=None):
+        self.calls.append((list(input), timeout))
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[1.0, 0.0])])
+
+
+class AsyncBackend:
+    name = "fake"
+
+    def __init__(self):
+        self.calls = []
+
+    async def aquery(self, index_name, namespace, vector, top_k, include_values=False, timeout=None):
+        self.calls.append((index_name, namespace, top_k, timeout))
+        return [VectorMatch(id="a", score=0.9, metadata={"text": "Tarifa general.", "source": "concepto_1.pdf"})]
+
+
+def test_aquery_pinecone_embeds_queries_and_caches_results(monkeypatch) -> None:
+    embeddings = AsyncEmbeddings()
+    backend = AsyncBackend()
+    monkeypatch.setattr(retrieval, "async_client", SimpleNamespace(embeddings=embeddings))
+    monkeypatch.setattr(retrieval, "embedding_cache", EmbeddingCache("test-model", path=None))
+    monkeypatch.setattr(retrieval, "semantic_cache", SemanticQueryCache(threshold=0.95, max_entries=8, ttl=60))
+    monkeypatch.setattr(retrieval, "get_vector_backend", lambda: backend)
+
+    async def run():
+        first = await retrieval.aquery_pinecone("Tarifa de IVA", index_name="iva", namespace="iva", top_k=3)
+        second = await retrieval.aquery_pinecone("tarifa de  IVA", index_name="iva", namespace="iva", top_k=3)
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert [item.page_content for item in first] == ["Tarifa general."]
+    assert first[0].metadata["source"] == "pinecone_docs/concepto_1.pdf"
+    assert [item.page_content for item in second] == ["Tarifa general."]
+    # La segunda consulta sale de las cachés de embeddings y semántica
+    assert len(embeddings.calls) == 1 and embeddings.calls[0][1] is not None
+    assert len(backend.calls) == 1 and backend.calls[0][3] is not None
+
+
+def test_afan_out_embeds_once_and_drops_slow_or_failing_indexes(monkeypatch) -> None:
+    embedded = []
+
+    async def aget_embedding(query):
+        embedded.append(query)
+        return [1.0, 0.0]
+
+    async def aquery_hybrid(query, index_name, namespace, top_k, query_embedding):
+        assert query_embedding == [1.0, 0.0]
+        if index_name == "timbre":
+            await asyncio.sleep(2.0)
+        if index_name == "aduanas":
+            raise ConnectionError("índice no disponible")
+        return [doc(f"Fragmento de {index_name}.", f"{index_name}.pdf")]
+
+    monkeypatch.setattr(retrieval, "aget_embedding", aget_embedding)
+    monkeypatch.setattr(retrieval, "aquery_hybrid", aquery_hybrid)
+    topics = {"IVA": "iva", "Timbre": "timbre", "Aduanas": "aduanas"}
+    for topic, index_name in topics.items():
+        config = retrieval.TOPIC_REGISTRY[topic]
+        monkeypatch.setitem(retrieval.TOPIC_REGISTRY, topic, config._replace(index_name=index_name))
+
+    start = time.perf_counter()
+    docs = asyncio.run(retrieval.retriever.afan_out("tarifa", list(topics), top_k=5, timeout=0.3))
+
+    assert time.perf_counter() - start < 1.0
+    assert embedded == ["tarifa"]
+    assert [item.page_content for item in docs] == ["Fragmento de iva."]
+    assert asyncio.run(retrieval.retriever.afan_out("tarifa", [])) == []
+
+
+def test_query_renta_uses_hybrid_search_on_renta_index(monkeypatch) -> None:
+    calls = []
+    monkeypatch.setattr(retrieval, "query_hybrid", lambda query, **kwargs: calls.append(kwargs) or [])
+
+    retrieval.query_renta("Art 240 tarifa", top_k=4)
+
+    assert calls == [{"index_name": retrieval.RENTA_INDEX_NAME, "namespace": retrieval.RENTA_NAMESPACE, "top_k": 4}]
+
+
+def test_aquery_hybrid_runs_lexical_search_off_the_event_loop(monkeypatch) -> None:
+    threads = []
+
+    def lexical_plan(query, index_name, namespace, top_k):
+        threads.append(threading.get_ident())
+        return [], top_k
+
+    async def aquery_pinecone(query, **kwargs):
+        threads.append(threading.get_ident())
+        return [doc("Tarifa general.", "concepto_1.pdf")]
+
+    monkeypatch.setattr(retrieval, "_lexical_plan", lexical_plan)
+    monkeypatch.setattr(retrieval, "aquery_pinecone", aquery_pinecone)
+
+    docs = asyncio.run(retrieval.aquery_hybrid("tarifa", index_name="iva", namespace="iva", top_k=3))
+
+    assert [item.page_content for item in docs] == ["Tarifa general."]
+    assert threads[0] != threads[1]
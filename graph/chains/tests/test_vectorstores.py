@@ -0,0 +1,174 @@
+from types import SimpleNamespace
+
+from graph.chains.snapshot import export_namespace
+from graph.chains import vectorstores
+from graph.chains.vectorstores import LocalVectorBackend, PineconeBackend, snapshot_version
+
+
+class FakeIndex:
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.fetched = []
+        self.queries = []
+
+    def list(self, namespace=None):
+        ids = sorted(self.vectors)
+        yield ids[:2]
+        if ids[2:]:
+            yield ids[2:]
+
+    def fetch(self, ids, namespace=None):
+        self.fetched.extend(ids)
+        return SimpleNamespace(vectors={
+            chunk_id: SimpleNamespace(values=self.vectors[chunk_id][0], metadata=self.vectors[chunk_id][1])
+            for chunk_id in ids
+        })
+
+
+    def query(self, **kwargs):
+        self.queries.append(kwargs)
+        return SimpleNamespace(matches=[])
+
+
+def chunk(values, source, page=1):
+    return (values, {"text": f"texto de {source}", "source": source, "page": page})
+
+
+def test_export_and_local_query(tmp_path) -> None:
+    index = FakeIndex({
+        "a": chunk([1.0, 0.0, 0.0], "concepto_1.pdf"),
+        "b": chunk([0.0, 1.0, 0.0], "concepto_2.pdf"),
+        "c": chunk([0.0, 0.0, 1.0], "concepto_3.pdf"),
+    })
+    manifest = export_namespace("iva", "iva", root=str(tmp_path), index=index, metric="cosine")
+    assert manifest["count"] == 3
+
+    matches = LocalVectorBackend(str(tmp_path)).query("iva", "iva", [0.1, 0.9, 0.0], top_k=2)
+    assert [match.id for match in matches] == ["b", "a"]
+    assert matches[0].metadata["source"] == "concepto_2.pdf"
+
+
+def test_incremental_sync_only_fetches_new_ids(tmp_path) -> None:
+    vectors = {
+        "a": chunk([1.0, 0.0], "concepto_1.pdf"),
+        "b": chunk([0.0, 1.0], "concepto_2.pdf"),
+    }
+    first = export_namespace("iva", "iva", root=str(tmp_path), index=FakeIndex(vectors), metric="cosine")
+
+    unchanged = FakeIndex(vectors)
+    again = export_namespace("iva", "iva", root=str(tmp_path), index=unchanged, metric="cosine")
+    assert unchanged.fetched == []
+    assert again["version"] == first["version"]
+
+    vectors = {"b": vectors["b"], "c": chunk([0.5, 0.5], "concepto_3.pdf")}
+    grown = FakeIndex(vectors)
+    synced = export_namespace("iva", "iva", root=str(tmp_path), index=grown, metric="cosine")
+    assert grown.fetched == ["c"]
+    assert synced["changes"] == {"added": 1, "updated": 0, "removed": 1}
+    assert snapshot_version("iva", "iva", str(tmp_path)) == synced["version"] != first["version"]
+
+
+def test_pinecone_query_carries_request_timeout(monkeypatch) -> None:
+    index = FakeIndex({})
+    monkeypatch.setattr(vectorstores.pinecone_pool, "get_index", lambda index_name: index)
+
+    assert PineconeBackend().query("iva", "iva", [1.0, 0.0], top_k=3, timeout=2.5) == []
+    assert index.queries[0]["_request_timeout"] == 2.5
+
+
+def test_reload_keeps_old_handle_usable(tmp_path) -> None:
+    vectors = {
+        "a": chunk([1.0, 0.0], "concepto_1.pdf"),
+        "b": chunk([0.0, 1.0], "concepto_2.pdf"),
+    }
+    export_namespace("iva", "iva", root=str(tmp_path), index=FakeIndex(vectors), metric="cosine")
+    backend = LocalVectorBackend(str(tmp_path))
+    old = backend.namespace("iva", "iva")
+
+    vectors = {"c": chunk([0.0, 1.0], "concepto_3.pdf")}
+    export_namespace("iva", "iva", root=str(tmp_path), index=FakeIndex(vectors), metric="cosine")
+    new = backend.namespace("iva", "iva")
+
+    # Una búsqueda que ya tenía el handle anterior sigue funcionando tras la recarga
+    assert new is not old
+    assert [match.id for match in old.search([0.0, 1.0], top_k=1)] == ["b"]
+    assert [match.id for match in new.search([0.0, 1.0], top_k=1)] == ["c"]
+
+
+def test_snapshot_version_rereads_manifest_only_when_it_changes(tmp_path, monkeypatch) -> None:
+    vectors = {"a": chunk([1.0, 0.0], "concepto_1.pdf")}
+    first = export_namespace("iva", "iva", root=str(tmp_path), index=FakeIndex(vectors), metric="cosine")
+    assert snapshot_version("iva", "iva", str(tmp_path)) == first["version"]
+
+    reads = []
+    read_manifest = vectorstores.read_manifest
+    monkeypatch.setattr(vectorstores, "read_manifest", lambda *args: reads.append(args) or read_manifest(*args))
+    assert snapshot_version("iva", "iva", str(tmp_path)) == first["version"]
+    assert reads == []
+
+    vectors["b"] = chunk([0.0, 1.0], "concepto_2.pdf")
+    second = export_namespace("iva", "iva", root=str(tmp_path), index=FakeIndex(vectors), metric="cosine")
+    assert snapshot_version("iva", "iva", str(tmp_path)) == second["version"] != first["version"]
+    assert len(reads) == 1
+
+
+def test_snapshot_publishes_each_version_in_its_own_directory(tmp_path) -> None:
+    import json
+    import os
+    import shutil
+
+    path = vectorstores.snapshot_path("iva", "iva", str(tmp_path))
+    vectors = {"a": chunk([1.0, 0.0], "concepto_1.pdf")}
+    first = export_namespace("iva", "iva", root=str(tmp_path), index=FakeIndex(vectors), metric="cosine")
+
+    # Formato anterior: datos junto al manifiesto y sin data_dir
+    for name in os.listdir(os.path.join(path, first["data_dir"])):
+        shutil.move(os.path.join(path, first["data_dir"], name), os.path.join(path, name))
+    os.rmdir(os.path.join(path, first["data_dir"]))
+    legacy = {key: value for key, value in first.items() if key != "data_dir"}
+    with open(os.path.join(path, vectorstores.MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(legacy, f)
+    assert [match.id for match in LocalVectorBackend(str(tmp_path)).query("iva", "iva", [1.0, 0.0], top_k=1)] == ["a"]
+
+    published = []
+    for chunk_id in ("b", "c"):
+        vectors[chunk_id] = chunk([0.0, 1.0], f"{chunk_id}.pdf")
+        published.append(export_namespace("iva", "iva", root=str(tmp_path), index=FakeIndex(vectors), metric="cosine"))
+        subdirs = {name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name))}
+        assert subdirs == {manifest["data_dir"] for manifest in published[-2:]}
+        matches = LocalVectorBackend(str(tmp_path)).query("iva", "iva", [0.0, 1.0], top_k=3)
+        assert {match.id for match in matches} == set(vectors)
+
+    # Los archivos del formato anterior se conservan una versión y luego se eliminan
+    assert not os.path.exists(os.path.join(path, vectorstores.VECTORS_FILE))
+
+
+def test_local_query_checks_version_without_reading_manifest(tmp_path, monkeypatch) -> None:
+    export_namespace("iva", "iva", root=str(tmp_path), index=FakeIndex({"a": chunk([1.0, 0.0], "concepto_1.pdf")}),
+                     metric="cosine")
+    backend = LocalVectorBackend(str(tmp_path))
+    assert [match.id for match in backend.query("iva", "iva", [1.0, 0.0], top_k=1)] == ["a"]
+
+    def read_manifest(*args):
+        raise AssertionError("el manifiesto no cambió")
+
+    monkeypatch.setattr(vectorstores, "read_manifest", read_manifest)
+    assert [match.id for match in backend.query("iva", "iva", [1.0, 0.0], top_k=1)] == ["a"]
+
+
+def test_local_search_supports_euclidean_and_rejects_unknown_metrics(tmp_path) -> None:
+    import pytest
+
+    index = FakeIndex({
+        "near": chunk([1.0, 1.0], "concepto_1.pdf"),
+        "far_but_long": chunk([10.0, 10.0], "concepto_2.pdf"),
+    })
+    export_namespace("iva", "iva", root=str(tmp_path), index=index, metric="euclidean")
+    matches = LocalVectorBackend(str(tmp_path)).query("iva", "iva", [1.5, 1.0], top_k=2)
+    # Con producto punto ganaría el vector largo; en euclidean gana el más cercano
+    assert [match.id for match in matches] == ["near", "far_but_long"]
+    assert matches[0].score == pytest.approx(0.25)
+
+    export_namespace("renta", "renta", root=str(tmp_path), index=index, metric="manhattan")
+    with pytest.raises(ValueError):
+        LocalVectorBackend(str(tmp_path)).query("renta", "renta", [1.0, 1.0], top_k=1)
@@ -0,0 +1,210 @@
+"""
+Utilidades de conteo de tokens basadas en tiktoken.
+
+El codificador de cada modelo se carga una sola vez por proceso. Si tiktoken no
+puede cargarlo (por ejemplo, sin acceso a red para descargar el BPE), se usa una
+aproximación por caracteres para no interrumpir el flujo y la carga se vuelve a
+intentar pasados ENCODING_RETRY_INTERVAL segundos.
+
+Incluye también el reparto de un presupuesto de tokens entre varios textos y
+recortes que respetan oraciones y párrafos o eligen la ventana más relevante
+para la consulta.
+"""
+
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import tiktoken
+
+from graph.chains.lexical import tokenize
+
+DEFAULT_MODEL = "gpt-4o-mini"
+# Aproximación usada cuando no hay codificador disponible
+CHARS_PER_TOKEN = 4
+# Segundos antes de reintentar la carga de un codificador que falló
+ENCODING_RETRY_INTERVAL = 60.0
+
+# Solo se guardan las cargas exitosas; los fallos, con su hora, para espaciar los reintentos
+_encodings: Dict[str, "tiktoken.Encoding"] = {}
+_encoding_failures: Dict[str, float] = {}
+_encodings_lock = threading.Lock()
+
+
+def _load_encoding(model: str) -> Optional["tiktoken.Encoding"]:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception as e:
+        print(f"tokens: No se pudo cargar el codificador para {model}: {str(e)}")
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"tokens: No se pudo cargar el codificador cl100k_base: {str(e)}")
+        return None
+
+
+def get_encoding(model: str = DEFAULT_MODEL) -> Optional["tiktoken.Encoding"]:
+    """
+    Devuelve el codificador de tiktoken para un modelo (cacheado), o None si no se puede cargar.
+
+    Un fallo no se cachea: tras ENCODING_RETRY_INTERVAL segundos se vuelve a intentar.
+    """
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+    with _encodings_lock:
+        if model in _encodings:
+            return _encodings[model]
+        failed_at = _encoding_failures.get(model)
+        if failed_at is not None and time.monotonic() - failed_at < ENCODING_RETRY_INTERVAL:
+            return None
+        encoding = _load_encoding(model)
+        if encoding is None:
+            _encoding_failures[model] = time.monotonic()
+            return None
+        _encoding_failures.pop(model, None)
+        _encodings[model] = encoding
+        return encoding
+
+
+def count_tokens(text: str, model: str = DEFAULT_MODEL) -> int:
+    """
+    Cuenta los tokens de un texto para el modelo indicado.
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = DEFAULT_MODEL) -> str:
+    """
+    Recorta un texto a como máximo `max_tokens` tokens.
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+# Fin de párrafo o de oración seguido de espacio (el separador queda con el segmento anterior)
+SEGMENT_BOUNDARY = re.compile(r"(?<=\n)\s*\n|(?<=[.;:!?])\s+(?=[A-ZÁÉÍÓÚÑ0-9¿¡(\"“-])")
+
+
+def split_segments(text: str) -> List[str]:
+    """
+    Divide un texto en oraciones y párrafos, conservando los separadores.
+    """
+    segments = []
+    start = 0
+    for match in SEGMENT_BOUNDARY.finditer(text):
+        segments.append(text[start:match.end()])
+        start = match.end()
+    if start < len(text):
+        segments.append(text[start:])
+    return [segment for segment in segments if segment.strip()]
+
+
+def truncate_at_boundary(text: str, max_tokens: int, model: str = DEFAULT_MODEL) -> str:
+    """
+    Recorta un texto a `max_tokens` tokens sin partir oraciones ni párrafos.
+
+    Si ni siquiera la primera oración cabe, se recorta por tokens.
+    """
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    kept = []
+    used = 0
+    for segment in split_segments(text):
+        tokens = count_tokens(segment, model)
+        if used + tokens > max_tokens:
+            break
+        kept.append(segment)
+        used += tokens
+    if not kept:
+        return truncate_to_tokens(text, max_tokens, model)
+    return "".join(kept).rstrip()
+
+
+def best_window(text: str, query: str, max_tokens: int, model: str = DEFAULT_MODEL) -> str:
+    """
+    Ventana de oraciones consecutivas de como máximo `max_tokens` tokens con más términos de la consulta.
+
+    Si el texto cabe entero se devuelve sin cambios; si ningún término aparece,
+    se usa el comienzo del texto.
+    """
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    segments = split_segments(text)
+    lengths = [count_tokens(segment, model) for segment in segments]
+    terms = set(tokenize(query))
+    hits = [len(terms & set(tokenize(segment))) for segment in segments]
+
+    best_start, best_end, best_hits = 0, 0, -1
+    end = 0
+    used = 0
+    window_hits = 0
+    # Ventana deslizante de dos punteros sobre las oraciones
+    for start in range(len(segments)):
+        while end < len(segments) and used + lengths[end] <= max_tokens:
+            used += lengths[end]
+            window_hits += hits[end]
+            end += 1
+        if end > start and window_hits > best_hits:
+            best_start, best_end, best_hits = start, end, window_hits
+        if end > start:
+            used -= lengths[start]
+            window_hits -= hits[start]
+        else:
+            end = start + 1
+    if best_hits <= 0:
+        return truncate_at_boundary(text, max_tokens, model)
+    window = "".join(segments[best_start:best_end]).strip()
+    prefix = "... " if best_start > 0 else ""
+    suffix = " ..." if best_end < len(segments) else ""
+    return prefix + window + suffix
+
+
+def allocate_budget(lengths: Sequence[int], total_tokens: int, minimum: int = 0) -> List[int]:
+    """
+    Reparte un presupuesto global de tokens entre varios textos.
+
+    Reparto equitativo con redistribución: los textos más cortos que su cuota
+    reciben solo lo que necesitan y el sobrante se reparte entre los demás.
+    Cada texto recibe al menos `minimum` tokens (o su longitud, si es menor).
+    """
+    allocation = [0] * len(lengths)
+    pending = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    remaining = total_tokens
+    while pending:
+        share = max(minimum, remaining // len(pending))
+        i = pending[0]
+        if lengths[i] <= share:
+            allocation[i] = lengths[i]
+            remaining -= lengths[i]
+            pending.pop(0)
+            continue
+        for i in pending:
+            allocation[i] = min(lengths[i], share)
+        break
+    return allocation
+
+
+def fit_to_budget(texts: Sequence[str], query: str, total_tokens: int, minimum: int = 64,
+                  model: str = DEFAULT_MODEL) -> List[str]:
+    """
+    Ajusta varios textos a un presupuesto global, eligiendo en cada uno la ventana más relevante para la consulta.
+    """
+    lengths = [count_tokens(text, model) for text in texts]
+    budgets = allocate_budget(lengths, total_tokens, minimum)
+    return [
+        text if budget >= length else best_window(text, query, budget, model)
+        for text, length, budget in zip(texts, lengths, budgets)
+    ]
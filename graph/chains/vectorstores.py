@@ -0,0 +1,304 @@
+"""
+Backends de búsqueda vectorial usados por query_pinecone.
+
+`PineconeBackend` consulta los índices remotos a través del registro compartido.
+`LocalVectorBackend` responde desde snapshots locales de cada namespace, con el
+siguiente formato en `VECTOR_STORE_DIR/<índice>/<namespace>/`:
+
+- `manifest.json`: versión del snapshot, dimensión, tipo, métrica, número de
+  vectores y `data_dir`, el subdirectorio con los datos de esa versión:
+- `<data_dir>/vectors.npy`: matriz float32 o float16 (una fila por fragmento), abierta con memory-map.
+- `<data_dir>/metadata.sqlite`: tabla `chunks(row, id, text, source, page, metadata, hash)`;
+  `row` es la fila correspondiente en `vectors.npy` y `metadata` el JSON original.
+
+Los lectores abren siempre los archivos a través del manifiesto, de modo que
+cambiar de versión es reemplazar un único archivo (ver `write_snapshot`). Los
+snapshots anteriores, sin `data_dir`, tienen los datos junto al manifiesto.
+
+El backend se elige con la variable de entorno `VECTOR_BACKEND` ("pinecone" o "local").
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from graph.chains.pinecone_pool import pinecone_pool
+
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "pinecone")
+VECTOR_STORE_DIR = os.environ.get("VECTOR_STORE_DIR", os.path.join("data", "vectors"))
+
+VECTORS_FILE = "vectors.npy"
+METADATA_FILE = "metadata.sqlite"
+MANIFEST_FILE = "manifest.json"
+# Métricas de Pinecone que sabe reproducir la búsqueda local
+METRICS = ("cosine", "dotproduct", "euclidean")
+
+
+class VectorMatch(NamedTuple):
+    """
+    Resultado de una búsqueda vectorial, con los mismos atributos que los de Pinecone.
+    """
+    id: str
+    score: float
+    metadata: Dict[str, Any]
+    values: Optional[List[float]] = None
+
+
+def snapshot_path(index_name: str, namespace: str, root: Optional[str] = None) -> str:
+    """
+    Directorio del snapshot local de un índice y namespace.
+    """
+    return os.path.join(root or VECTOR_STORE_DIR, index_name, namespace or "__default__")
+
+
+def snapshot_data_path(path: str, manifest: Dict[str, Any]) -> str:
+    """
+    Directorio con los datos de la versión descrita por el manifiesto.
+    """
+    return os.path.join(path, manifest.get("data_dir") or "")
+
+
+def read_manifest(index_name: str, namespace: str, root: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Lee el manifiesto del snapshot local, o devuelve None si no existe.
+    """
+    path = os.path.join(snapshot_path(index_name, namespace, root), MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Versión de cada manifiesto ya leído, con la firma (inodo, mtime, tamaño) con que se leyó
+_manifest_versions: Dict[str, Tuple[Tuple[int, int, int], Optional[str]]] = {}
+
+
+def snapshot_version(index_name: str, namespace: str, root: Optional[str] = None) -> Optional[str]:
+    """
+    Versión del snapshot local de un namespace, o None si no hay snapshot.
+
+    La versión cambia cada vez que cambia el contenido del namespace, por lo que
+    sirve como clave para invalidar cachés que dependen del corpus. El manifiesto
+    solo se vuelve a leer cuando cambia su `os.stat` (una sincronización lo reemplaza).
+    """
+    path = os.path.join(snapshot_path(index_name, namespace, root), MANIFEST_FILE)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    cached = _manifest_versions.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    manifest = read_manifest(index_name, namespace, root)
+    version = manifest.get("version") if manifest else None
+    _manifest_versions[path] = (signature, version)
+    return version
+
+
+class VectorStoreBackend:
+    """
+    Interfaz común de los backends de búsqueda vectorial.
+    """
+    name = "base"
+
+    def query(self, index_name: str, namespace: str, vector: List[float], top_k: int,
+              include_values: bool = False, timeout: Optional[float] = None) -> List[VectorMatch]:
+        """
+        Busca los `top_k` vectores más cercanos; `timeout` (segundos) acota la solicitud remota.
+        """
+        raise NotImplementedError
+
+    async def aquery(self, index_name: str, namespace: str, vector: List[float], top_k: int,
+                     include_values: bool = False, timeout: Optional[float] = None) -> List[VectorMatch]:
+        return await asyncio.to_thread(self.query, index_name, namespace, vector, top_k, include_values, timeout)
+
+
+class PineconeBackend(VectorStoreBackend):
+    """
+    Búsqueda en los índices remotos de Pinecone.
+    """
+    name = "pinecone"
+
+    def query(self, index_name, namespace, vector, top_k, include_values=False, timeout=None):
+        index = pinecone_pool.get_index(index_name)
+        if index is None:
+            print(f"PineconeBackend: No se pudo obtener el índice {index_name}")
+            return []
+        try:
+            results = index.query(
+                vector=vector,
+                top_k=top_k,
+                namespace=namespace,
+                include_metadata=True,
+                include_values=include_values,
+                # Sin plazo, un hilo bloqueado en Pinecone sobrevive al plazo de la etapa
+                **({"_request_timeout": timeout} if timeout is not None else {})
+            )
+        except Exception:
+            # Descartar el handle por si la conexión quedó inservible
+            pinecone_pool.discard(index_name)
+            raise
+        return [
+            VectorMatch(
+                id=match.id,
+                score=match.score,
+                metadata=match.metadata or {},
+                values=list(match.values) if include_values and match.values else None,
+            )
+            for match in results.matches
+        ]
+
+
+class LocalNamespace:
+    """
+    Snapshot local de un namespace cargado en memoria (vectores con memory-map).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.version = self.manifest.get("version")
+        data_path = snapshot_data_path(path, self.manifest)
+        self.vectors = np.load(os.path.join(data_path, VECTORS_FILE), mmap_mode="r")
+        if self.vectors.dtype != np.float32:
+            # NumPy no usa BLAS con float16: se convierte una vez a float32 en memoria
+            # (el snapshot en disco ocupa la mitad y la búsqueda sigue siendo de milisegundos)
+            self.vectors = np.asarray(self.vectors, dtype=np.float32)
+        self.metric = self.manifest.get("metric", "cosine")
+        if self.metric not in METRICS:
+            raise ValueError(f"Métrica no soportada en el snapshot {path}: {self.metric}")
+        self.inv_norms = None
+        self.sq_norms = None
+        if self.metric == "cosine":
+            norms = np.linalg.norm(np.asarray(self.vectors, dtype=np.float32), axis=1)
+            self.inv_norms = np.where(norms > 0, 1.0 / np.maximum(norms, 1e-12), 0.0).astype(np.float32)
+        elif self.metric == "euclidean":
+            self.sq_norms = np.einsum("ij,ij->i", self.vectors, self.vectors).astype(np.float32)
+        self._conn = sqlite3.connect(os.path.join(data_path, METADATA_FILE), check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def search(self, vector: List[float], top_k: int, include_values: bool = False) -> List[VectorMatch]:
+        if self.vectors.shape[0] == 0:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        if self.inv_norms is not None:
+            norm = np.linalg.norm(query)
+            if norm > 0:
+                query = query / norm
+        scores = self.vectors @ query
+        if self.inv_norms is not None:
+            scores = scores * self.inv_norms
+        # Orden de mayor a menor, salvo en euclidean (distancia: menor es mejor)
+        ranking = scores
+        if self.sq_norms is not None:
+            # Distancia euclídea al cuadrado, como la devuelve Pinecone: |v|² - 2 v·q + |q|²
+            scores = np.maximum(self.sq_norms - 2 * scores + float(query @ query), 0.0)
+            ranking = -scores
+        k = min(top_k, scores.shape[0])
+        top = np.argpartition(-ranking, k - 1)[:k]
+        top = top[np.argsort(-ranking[top])]
+        rows = self.metadata_for_rows([int(row) for row in top])
+        matches = []
+        for row in top:
+            chunk_id, metadata = rows.get(int(row), (str(row), {}))
+            values = np.asarray(self.vectors[row], dtype=np.float32).tolist() if include_values else None
+            matches.append(VectorMatch(id=chunk_id, score=float(scores[row]), metadata=metadata, values=values))
+        return matches
+
+    def metadata_for_rows(self, rows: List[int]) -> Dict[int, tuple]:
+        """
+        Devuelve {fila: (id, metadata)} para las filas indicadas.
+        """
+        if not rows:
+            return {}
+        placeholders = ",".join("?" for _ in rows)
+        with self._lock:
+            cursor = self._conn.execute(
+                f"SELECT row, id, metadata FROM chunks WHERE row IN ({placeholders})", rows
+            )
+            return {row: (chunk_id, json.loads(metadata or "{}")) for row, chunk_id, metadata in cursor}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class LocalVectorBackend(VectorStoreBackend):
+    """
+    Búsqueda exacta top-k sobre snapshots locales con productos punto vectorizados de NumPy.
+
+    Los snapshots se cargan en el primer uso y se recargan si cambia su versión;
+    las búsquedas en curso terminan sobre el handle que ya tenían.
+    """
+    name = "local"
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or VECTOR_STORE_DIR
+        self._namespaces: Dict[str, LocalNamespace] = {}
+        self._lock = threading.Lock()
+
+    def namespace(self, index_name: str, namespace: str) -> Optional[LocalNamespace]:
+        """
+        Devuelve el snapshot cargado de un namespace, o None si no existe.
+        """
+        # Versión con caché por os.stat: no se lee ni se parsea el manifiesto en cada consulta
+        version = snapshot_version(index_name, namespace, self.root)
+        if version is None:
+            return None
+        key = f"{index_name}/{namespace}"
+        with self._lock:
+            loaded = self._namespaces.get(key)
+            if loaded is None or loaded.version != version:
+                # El handle anterior no se cierra: otros hilos pueden estar buscando en él.
+                # Se reemplaza en el registro y se libera (conexión y memmap) al recolectarse;
+                # write_snapshot conserva el directorio de la versión anterior mientras tanto.
+                loaded = LocalNamespace(snapshot_path(index_name, namespace, self.root))
+                self._namespaces[key] = loaded
+                print(f"LocalVectorBackend: Cargado {key} ({loaded.vectors.shape[0]} vectores, versión {loaded.version})")
+            return loaded
+
+    def query(self, index_name, namespace, vector, top_k, include_values=False, timeout=None):
+        loaded = self.namespace(index_name, namespace)
+        if loaded is None:
+            print(f"LocalVectorBackend: No existe snapshot local para {index_name}/{namespace}")
+            return []
+        return loaded.search(vector, top_k, include_values)
+
+    async def aquery(self, index_name, namespace, vector, top_k, include_values=False, timeout=None):
+        # La búsqueda local tarda milisegundos; no compensa pasarla a un hilo
+        return self.query(index_name, namespace, vector, top_k, include_values)
+
+
+_backend: Optional[VectorStoreBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_vector_backend() -> VectorStoreBackend:
+    """
+    Devuelve el backend configurado en `VECTOR_BACKEND` (creado una vez por proceso).
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if VECTOR_BACKEND == "local":
+                _backend = LocalVectorBackend()
+            else:
+                _backend = PineconeBackend()
+            print(f"get_vector_backend: Usando backend '{_backend.name}'")
+        return _backend
+
+
+def set_vector_backend(backend: VectorStoreBackend):
+    """
+    Sustituye el backend activo (útil para pruebas y benchmarks).
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
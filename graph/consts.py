@@ -2,3 +2,6 @@ RETRIEVE = "retrieve"
 GRADE_DOCUMENTS = "grade_documents"
 GENERATE = "generate"
 WEBSEARCH = "websearch"
+GRADE_GROUNDING = "grade_grounding"
+GRADE_ANSWER = "grade_answer"
+VERIFY = "verify"
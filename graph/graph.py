@@ -2,11 +2,10 @@ from dotenv import load_dotenv
 
 from langgraph.graph import END, StateGraph
 
-from graph.chains.answer_grader import answer_grader
-from graph.chains.hallucination_grader import hallucination_grader
+from graph.chains.generation_grader import VERIFY_MODE, grade_generation
 from graph.chains.router import router, RouteQuery
-from graph.consts import RETRIEVE, GRADE_DOCUMENTS, GENERATE, WEBSEARCH
-from graph.nodes import generate, grade_documents, retrieve, web_search
+from graph.consts import RETRIEVE, GRADE_DOCUMENTS, GENERATE, WEBSEARCH, GRADE_GROUNDING, GRADE_ANSWER, VERIFY
+from graph.nodes import generate, grade_documents, retrieve, web_search, grade_grounding, grade_answer, join_grades
 from graph.state import GraphState
 
 load_dotenv()
@@ -59,15 +58,16 @@ def grade_generation_grounded_in_documents_and_question(state: GraphState) -> st
     # Imprimir las primeras 100 caracteres de la respuesta para depuración
     print(f"grade_generation: Primeros 100 caracteres de la respuesta: {generation[:100]}...")
 
-    score = hallucination_grader.invoke(
-        {"documents": documents, "generation": generation}
-    )
+    # Un solo calificador: fundamentación en los documentos y relevancia para la pregunta
+    grade = grade_generation(question, documents, generation)
 
-    if hallucination_grade := score.binary_score:
+    if grade is None:
+        debug_print("---DECISION: NO GRADER VERDICT, GENERATION IS UNVERIFIED---")
+        return "unverified"
+    if grade.grounded:
         debug_print("---DECISION: GENERATION IS GROUNDED IN DOCUMENTS---")
         debug_print("---GRADE GENERATION vs QUESTION---")
-        score = answer_grader.invoke({"question": question, "generation": generation})
-        if answer_grade := score.binary_score:
+        if grade.addresses_question:
             debug_print("---DECISION: GENERATION ADDRESSES QUESTION---")
             return "useful"
         else:
@@ -125,15 +125,36 @@ workflow.add_conditional_edges(
     },
 )
 
-workflow.add_conditional_edges(
-    GENERATE,
-    grade_generation_grounded_in_documents_and_question,
-    {
-        "not supported": GENERATE,
-        "useful": END,
-        "not useful": WEBSEARCH,
-    },
-)
+# Verificación: una sola llamada, o los dos calificadores en ramas paralelas
+# cuyas notas se combinan en VERIFY (espera a ambas ramas)
+if VERIFY_MODE == "parallel":
+    workflow.add_node(GRADE_GROUNDING, grade_grounding)
+    workflow.add_node(GRADE_ANSWER, grade_answer)
+    workflow.add_node(VERIFY, join_grades)
+    workflow.add_edge(GENERATE, GRADE_GROUNDING)
+    workflow.add_edge(GENERATE, GRADE_ANSWER)
+    workflow.add_edge([GRADE_GROUNDING, GRADE_ANSWER], VERIFY)
+    workflow.add_conditional_edges(
+        VERIFY,
+        lambda state: state["verify_result"],
+        {
+            "not_supported": GENERATE,
+            "useful": END,
+            "not_useful": WEBSEARCH,
+            "unverified": END,
+        },
+    )
+else:
+    workflow.add_conditional_edges(
+        GENERATE,
+        grade_generation_grounded_in_documents_and_question,
+        {
+            "not supported": GENERATE,
+            "useful": END,
+            "not useful": WEBSEARCH,
+            "unverified": END,
+        },
+    )
 workflow.add_edge(WEBSEARCH, GENERATE)
 workflow.add_edge(GENERATE, END)
 
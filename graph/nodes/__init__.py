@@ -1,6 +1,9 @@
 from graph.nodes.generate import generate
 from graph.nodes.grade_documents import grade_documents
 from graph.nodes.retrieve import retrieve
+from graph.nodes.verify_generation import grade_answer, grade_grounding, join_grades
 from graph.nodes.web_search import web_search
 
-__all__ = ["generate", "grade_documents", "retrieve", "web_search"]
+__all__ = [
+    "generate", "grade_documents", "retrieve", "web_search", "grade_grounding", "grade_answer", "join_grades",
+]
@@ -0,0 +1,4 @@
+from graph.verification import verification_nodes
+
+# Ramas paralelas de calificación y nodo que las une (VERIFY_MODE=parallel)
+grade_grounding, grade_answer, join_grades = verification_nodes()
@@ -1,4 +1,11 @@
-from typing import List, TypedDict, Dict, Any, Optional
+from typing import Annotated, List, TypedDict, Dict, Any, Optional
+
+
+def merge_grades(left: Optional[Dict[str, bool]], right: Optional[Dict[str, bool]]) -> Dict[str, bool]:
+    """
+    Reducer for the grades written by parallel grader branches: later values win per key.
+    """
+    return {**(left or {}), **(right or {})}
 
 
 class GraphState(TypedDict, total=False):
@@ -12,6 +19,10 @@ class GraphState(TypedDict, total=False):
         documents: list of documents
         citations: optional list of citations from Claude
         topic: optional topic for the query (e.g., "IVA", "Renta")
+        cache_hit: whether the answer was served from the answer cache
+        has_structure: whether the generation follows the expected sections
+        grades: verdicts from the grader branches ("grounded", "addresses_question")
+        verify_result: "useful", "not_useful", "not_supported" or "unverified"
     """
 
     question: str
@@ -20,3 +31,7 @@ class GraphState(TypedDict, total=False):
     documents: List[str]
     citations: Optional[List[Dict[str, Any]]]
     topic: Optional[str]
+    cache_hit: bool
+    has_structure: bool
+    grades: Annotated[Dict[str, bool], merge_grades]
+    verify_result: str
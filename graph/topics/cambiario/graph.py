@@ -9,10 +9,16 @@ la relevancia de los documentos recuperados.
 from dotenv import load_dotenv
 from langgraph.graph import END, StateGraph
 from graph.state import GraphState
+from graph.chains.generation_grader import VERIFY_MODE
 from graph.topics.cambiario.nodes import (
     retrieve_documents,
     generate_response,
-    verify_response
+    verify_response,
+    grade_grounding,
+    grade_answer,
+    join_grades,
+    lookup_answer,
+    store_answer
 )
 
 # Cargar variables de entorno
@@ -22,6 +28,10 @@ load_dotenv()
 RETRIEVE = "retrieve"
 GENERATE = "generate"
 VERIFY = "verify"
+LOOKUP = "lookup_cache"
+STORE = "store_cache"
+GRADE_GROUNDING = "grade_grounding"
+GRADE_ANSWER = "grade_answer"
 
 # Crear el grafo
 workflow = StateGraph(GraphState)
@@ -29,25 +39,48 @@ workflow = StateGraph(GraphState)
 # Agregar nodos
 workflow.add_node(RETRIEVE, retrieve_documents)
 workflow.add_node(GENERATE, generate_response)
-workflow.add_node(VERIFY, verify_response)
+workflow.add_node(LOOKUP, lookup_answer)
+workflow.add_node(STORE, store_answer)
 
-# Definir punto de entrada
-workflow.set_entry_point(RETRIEVE)
+# Definir punto de entrada: primero el caché de respuestas
+workflow.set_entry_point(LOOKUP)
+workflow.add_conditional_edges(
+    LOOKUP,
+    lambda state: "hit" if state.get("cache_hit") else "miss",
+    {
+        "hit": END,  # Respuesta servida desde el caché
+        "miss": RETRIEVE,
+    }
+)
 
 # Conectar los nodos
 workflow.add_edge(RETRIEVE, GENERATE)
-workflow.add_edge(GENERATE, VERIFY)
+
+# Verificación: una sola llamada, o los dos calificadores en ramas paralelas
+# cuyas notas se combinan en VERIFY (espera a ambas ramas)
+if VERIFY_MODE == "parallel":
+    workflow.add_node(GRADE_GROUNDING, grade_grounding)
+    workflow.add_node(GRADE_ANSWER, grade_answer)
+    workflow.add_node(VERIFY, join_grades)
+    workflow.add_edge(GENERATE, GRADE_GROUNDING)
+    workflow.add_edge(GENERATE, GRADE_ANSWER)
+    workflow.add_edge([GRADE_GROUNDING, GRADE_ANSWER], VERIFY)
+else:
+    workflow.add_node(VERIFY, verify_response)
+    workflow.add_edge(GENERATE, VERIFY)
 
 # Definir conexiones condicionales
 workflow.add_conditional_edges(
     VERIFY,
     lambda state: state["verify_result"],
     {
-        "useful": END,  # Si la respuesta es útil, finalizar
+        "useful": STORE,  # Si la respuesta es útil, guardarla en el caché y finalizar
         "not_useful": GENERATE,  # Si no aborda la pregunta, regenerar
         "not_supported": GENERATE,  # Si tiene alucinaciones, regenerar
+        "unverified": END,  # Sin veredicto de los calificadores: se entrega sin guardarla en el caché
     }
 )
+workflow.add_edge(STORE, END)
 
 # Compilar el grafo
 app = workflow.compile()
@@ -9,17 +9,47 @@ from graph.state import GraphState
 from graph.chains.retrieval import query_retencion
 from graph.chains.reranking import retrieve_with_reranking
 from graph.chains.openai_generation import generate_with_openai
-from graph.chains.hallucination_grader import hallucination_grader
-from graph.chains.answer_grader import answer_grader
+from graph.chains.generation_grader import grade_generation
+from graph.chains.answer_cache import answer_cache
+from graph.verification import verification_nodes
 
 # Variable global para depuración
 DEBUG = False
 
+# Tema en el caché de respuestas (el mismo que usa la página)
+CACHE_TOPIC = "Retención"
+
 def debug_print(message):
     """Imprime mensajes de depuración si DEBUG es True."""
     if DEBUG:
         print(message)
 
+def lookup_answer(state: GraphState) -> Dict[str, Any]:
+    """
+    Busca la respuesta completa en el caché antes de recuperar documentos.
+    """
+    debug_print("---RETENCION: LOOKUP ANSWER CACHE---")
+    cached = answer_cache.get(CACHE_TOPIC, state["question"])
+    if cached is None:
+        return {"cache_hit": False}
+    debug_print("---RESULTADO: RESPUESTA SERVIDA DESDE EL CACHÉ---")
+    return {
+        "generation": cached["text"],
+        "citations": cached["citations"],
+        "documents": cached["documents"],
+        "topic": "Retencion",
+        "cache_hit": True
+    }
+
+def store_answer(state: GraphState) -> Dict[str, Any]:
+    """
+    Guarda en el caché una respuesta verificada como útil.
+    """
+    debug_print("---RETENCION: STORE ANSWER CACHE---")
+    answer_cache.put(CACHE_TOPIC, state["question"], state["generation"],
+                     state.get("citations") or [], state["documents"])
+    return {}
+
 def retrieve_documents(state: GraphState) -> Dict[str, Any]:
     """
     Recupera documentos específicos de Retención en la Fuente usando reranking.
@@ -66,9 +96,11 @@ def generate_response(state: GraphState) -> Dict[str, Any]:
         has_structure = "REFERENCIA" in generation and "ANÁLISIS" in generation
         
         # Devolver un diccionario con la generación y las citas
+        # Los documentos del estado pasan a ser los enviados al modelo, numerados como las citas
         return {
             "generation": generation,
             "citations": citations,
+            "documents": openai_response.get("documents", documents),
             "has_structure": has_structure
         }
     except Exception as e:
@@ -84,25 +116,24 @@ def verify_response(state: GraphState) -> Dict[str, str]:
     documents = state["documents"]
     generation = state["generation"]
 
-    # Verificar si hay alucinaciones
-    hallucination_score = hallucination_grader.invoke(
-        {"documents": documents, "generation": generation}
-    )
+    # Un solo calificador: fundamentación en los documentos y relevancia para la pregunta
+    grade = grade_generation(question, documents, generation)
     
-    if hallucination_score.binary_score:
-        debug_print("---RESULTADO: LA RESPUESTA ESTÁ FUNDAMENTADA EN LOS DOCUMENTOS---")
-        
-        # Verificar si la respuesta aborda la pregunta
-        answer_score = answer_grader.invoke(
-            {"question": question, "generation": generation}
-        )
-        
-        if answer_score.binary_score:
-            debug_print("---RESULTADO: LA RESPUESTA ABORDA LA PREGUNTA---")
-            return {"verify_result": "useful"}
-        else:
-            debug_print("---RESULTADO: LA RESPUESTA NO ABORDA LA PREGUNTA---")
-            return {"verify_result": "not_useful"}
-    else:
+    if grade is None:
+        debug_print("---RESULTADO: SIN VEREDICTO DEL CALIFICADOR, LA RESPUESTA NO SE VERIFICA---")
+        return {"verify_result": "unverified"}
+    
+    if not grade.grounded:
         debug_print("---RESULTADO: LA RESPUESTA NO ESTÁ FUNDAMENTADA EN LOS DOCUMENTOS---")
-        return {"verify_result": "not_supported"} 
\ No newline at end of file
+        return {"verify_result": "not_supported"}
+    
+    debug_print("---RESULTADO: LA RESPUESTA ESTÁ FUNDAMENTADA EN LOS DOCUMENTOS---")
+    if grade.addresses_question:
+        debug_print("---RESULTADO: LA RESPUESTA ABORDA LA PREGUNTA---")
+        return {"verify_result": "useful"}
+    debug_print("---RESULTADO: LA RESPUESTA NO ABORDA LA PREGUNTA---")
+    return {"verify_result": "not_useful"}
+
+
+# Nodos de verificación en paralelo (VERIFY_MODE=parallel), compartidos con los demás grafos
+grade_grounding, grade_answer, join_grades = verification_nodes("RETENCION", debug_print)
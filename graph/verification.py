@@ -0,0 +1,55 @@
+"""
+Nodos de verificación en paralelo, compartidos por el grafo principal y los grafos de tema.
+
+Con VERIFY_MODE=parallel, GENERATE se abre en dos ramas (fundamentación y
+relevancia) que escriben su nota en `grades`; el reducer de GraphState combina
+ambas y `join_grades` produce `verify_result` cuando terminan las dos.
+
+Está fuera de graph/nodes para que los grafos de tema puedan usarlo sin cargar
+los nodos del grafo principal (generate descarga su prompt al importarse).
+"""
+
+from typing import Any, Callable, Dict, NamedTuple
+
+from graph.chains.generation_grader import addresses_question, is_grounded, verify_result
+from graph.state import GraphState
+
+
+class VerificationNodes(NamedTuple):
+    """
+    Nodos de las dos ramas de calificación y del nodo que las une.
+    """
+    grade_grounding: Callable[[GraphState], Dict[str, Any]]
+    grade_answer: Callable[[GraphState], Dict[str, Any]]
+    join_grades: Callable[[GraphState], Dict[str, Any]]
+
+
+def verification_nodes(label: str = "", log: Callable[[str], None] = print) -> VerificationNodes:
+    """
+    Crea los nodos de verificación en paralelo; `label` y `log` solo cambian los mensajes de depuración.
+    """
+    prefix = f"{label}: " if label else ""
+
+    def grade_grounding(state: GraphState) -> Dict[str, Any]:
+        """
+        Rama paralela: ¿la respuesta está fundamentada en los documentos?
+        """
+        log(f"---{prefix}GRADE GROUNDING---")
+        return {"grades": {"grounded": is_grounded(state["documents"], state["generation"])}}
+
+    def grade_answer(state: GraphState) -> Dict[str, Any]:
+        """
+        Rama paralela: ¿la respuesta aborda la pregunta?
+        """
+        log(f"---{prefix}GRADE ANSWER---")
+        return {"grades": {"addresses_question": addresses_question(state["question"], state["generation"])}}
+
+    def join_grades(state: GraphState) -> Dict[str, Any]:
+        """
+        Une las notas de las dos ramas en el resultado de la verificación.
+        """
+        result = verify_result(state["grades"])
+        log(f"---{prefix}RESULTADO DE LA VERIFICACIÓN: {result}---")
+        return {"verify_result": result}
+
+    return VerificationNodes(grade_grounding, grade_answer, join_grades)
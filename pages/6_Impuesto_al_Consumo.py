@@ -1,12 +1,13 @@
 import streamlit as st
 from dotenv import load_dotenv
 import os
-import time
 import re
 # Importar el grafo completo en lugar de solo los componentes individuales
 from graph.topics.ipoconsumo.graph import app as ipoconsumo_app
 from graph.chains.retrieval import query_ipoconsumo
-from graph.chains.openai_generation import generate_with_openai
+from graph.chains.openai_generation import stream_with_openai
+from graph.chains.answer_cache import answer_cache
+from graph.chains.resilience import start_request
 # Importar el módulo de reranking
 from graph.chains.reranking import retrieve_with_reranking
 
@@ -31,16 +32,15 @@ La base de conocimiento incluye conceptos de la Dian sobre impuesto al consumo d
 
 # Verificar si la colección existe
 try:
-    import pinecone
+    from graph.chains.pinecone_pool import pinecone_pool
     pinecone_api_key = os.environ.get("PINECONE_API_KEY")
     index_name = "ipoconsumo"  # Índice específico para impuesto al consumo
     
     if not pinecone_api_key:
         st.warning("No se ha configurado la API key de Pinecone. Por favor, configura la variable PINECONE_API_KEY en el archivo .env.")
     else:
-        # Inicializar Pinecone
-        pc = pinecone.Pinecone(api_key=pinecone_api_key)
-        existing_indexes = [index.name for index in pc.list_indexes()]
+        # Usar el registro compartido de Pinecone (listado de índices con caché)
+        existing_indexes = pinecone_pool.list_index_names()
         
         # Si no existe el índice específico de impuesto al consumo, usar el índice general
         if index_name not in existing_indexes:
@@ -112,6 +112,8 @@ try:
         
         # Procesar la consulta
         if query:
+            # Presupuesto de latencia de esta consulta: acota el plazo de cada etapa
+            start_request()
             # Agregar la consulta del usuario a los mensajes
             st.session_state.ipoconsumo_messages.append({
                 "role": "user", 
@@ -140,13 +142,10 @@ try:
                 
                 # Mostrar el flujo de procesamiento
                 update_flow(f"🔄 Iniciando procesamiento de la consulta sobre Impuesto al Consumo...")
-                time.sleep(0.5)
                 
                 update_flow("🧠 Analizando la consulta...")
-                time.sleep(0.5)
                 
                 update_flow("🔍 Ejecutando flujo RAG avanzado...")
-                time.sleep(1)
                 
                 # Consultar directamente a Pinecone para Impuesto al Consumo con reranking
                 try:
@@ -154,10 +153,15 @@ try:
                     print("Impuesto_al_Consumo.py: Consultando directamente a Pinecone (índice ipoconsumo)")
                     # Usar la función de reranking para mejorar la relevancia de los documentos
                     update_flow("🔍 Recuperando documentos iniciales de Pinecone...")
-                    time.sleep(0.5)
                     
-                    documents = retrieve_with_reranking(query, query_ipoconsumo, top_k=8)
-                    print(f"Impuesto_al_Consumo.py: Recuperados {len(documents)} documentos de Pinecone con reranking")
+                    # Respuesta completa en caché para esta pregunta (mismo corpus y misma versión del prompt)
+                    cached_answer = answer_cache.get("Impuesto al Consumo", query)
+                    if cached_answer is not None:
+                        update_flow("⚡ Respuesta recuperada del caché")
+                        documents = cached_answer["documents"]
+                    else:
+                        documents = retrieve_with_reranking(query, query_ipoconsumo, top_k=8)
+                        print(f"Impuesto_al_Consumo.py: Recuperados {len(documents)} documentos de Pinecone con reranking")
                     
                     # Verificar si se encontraron documentos
                     if not documents:
@@ -170,28 +174,45 @@ try:
                         documents = []
                     else:
                         update_flow(f"📝 Encontrados {len(documents)} documentos relevantes")
-                        time.sleep(0.5)
                         
                         update_flow("🔄 Aplicado reranking para mejorar la relevancia")
-                        time.sleep(0.5)
                         
                         update_flow("✍️ Generando respuesta especializada en Impuesto al Consumo...")
-                        time.sleep(0.5)
                         
-                        # Generar respuesta con OpenAI
-                        openai_response = generate_with_openai(query, documents)
+                        # Generar respuesta con OpenAI en streaming: el texto se muestra a medida que llega
+                        answer_placeholder = st.empty()
+                        streamed_text = ""
+                        rendered_chars = 0
+                        openai_response = cached_answer
+                        if openai_response is None:
+                            for event in stream_with_openai(query, documents):
+                                if event["type"] == "delta":
+                                    streamed_text += event["text"]
+                                    # Repintar cada ~80 caracteres para no reenviar el texto completo en cada token
+                                    if len(streamed_text) - rendered_chars >= 80:
+                                        answer_placeholder.markdown(streamed_text + "▌")
+                                        rendered_chars = len(streamed_text)
+                                elif event["type"] == "citation":
+                                    update_flow(f"📌 Cita [{event['index']}]: {event['citation']['document_title']}")
+                                elif event["type"] == "done":
+                                    openai_response = event
+                            # Guardar la respuesta para la próxima vez que se haga la misma pregunta, con la misma regla
+                            # que los grafos de tema: solo si está completa (no cortada por el plazo) y el calificador la da
+                            # por útil; la calificación corre en segundo plano y no retrasa la respuesta
+                            if openai_response.get("citations") and not openai_response.get("truncated"):
+                                answer_cache.put_verified("Impuesto al Consumo", query, openai_response["text"], openai_response["citations"],
+                                                          openai_response.get("documents", documents))
                         response = openai_response["text"]
                         citations = openai_response.get("citations", [])
+                        # Las fuentes se muestran con la misma numeración que las citas (sin duplicados ni páginas fusionadas)
+                        documents = openai_response.get("documents", documents)
                         
                         update_flow("🔎 Verificando que no haya alucinaciones...")
-                        time.sleep(0.5)
                         
                         update_flow("✅ Verificando que la respuesta aborde la consulta...")
-                        time.sleep(0.5)
                         
                         if citations:
                             update_flow(f"📌 Añadiendo {len(citations)} citas a la respuesta...")
-                            time.sleep(0.5)
                         
                         update_flow("✨ Respuesta sobre Impuesto al Consumo generada con éxito!")
                         
@@ -201,12 +222,12 @@ try:
                         # Limpiar el placeholder
                         flow_placeholder.empty()
                         
-                        # Formatear la respuesta con citas si existen
+                        # Formatear la respuesta con citas si existen (reemplaza el texto en streaming)
                         if citations:
                             formatted_response = formatear_texto_con_citas(response, citations)
-                            st.markdown(formatted_response, unsafe_allow_html=True)
+                            answer_placeholder.markdown(formatted_response, unsafe_allow_html=True)
                         else:
-                            st.markdown(response)
+                            answer_placeholder.markdown(response)
                         
                         # Mostrar las citas si existen
                         if citations:
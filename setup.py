@@ -22,6 +22,7 @@ setup(
         "pinecone==6.0.2",
         "openai==1.67.0",
         "tiktoken==0.9.0",
+        "numpy==1.26.4",
         "python-dotenv==1.0.1",
         "anthropic==0.49.0",
     ],